@@ -2,26 +2,51 @@
 VDyno - A PyQT based GUI for the V-Dyno project.
 
 This code is the entry point, initialising the model, view, and presenter components- the architecture is based on the Model-View-Presenter (MVP) pattern.
+The window is shown first; pyqtgraph, the remote plot process and the CAN bus are started once it has painted.
+Run with --profile-startup to print import and initialisation times.
+Run with --telemetry [tcp:HOST:PORT | unix:PATH] to stream live samples to other programs, see VDyno/model/telemetry.py.
+Run with --port PORT to choose the rig's CAN adapter when more than one is plugged in. To run several rigs from one process,
+use VDyno_headless.py --rig NAME=PORT.
 
 ===========================================================
-If testing without CAN tranceiver, switch can_handler.py to dummy_can_handler.py in VDyno/model/dyno.py.
+If testing without CAN tranceiver, switch can_handler.py to dummy_can_handler.py in Dyno.connect, VDyno/model/dyno.py.
 If you are using different hardware, you will need to modify the model/value_calibration.csv file to suit your needs. Values go factor, offset.
-If using Apple or Linux device, comment out line 238 of VDyno/view/main_window.py: "ctypes.windll.shell32.SetCurrentProcessExplicitAppUserModelID(myappid)"
 ============================================================
 
 written by:
     - Daniel Muir
 """
 
-from VDyno.view.main_window import create_UI
-from VDyno.presenter.data_handler import Presenter
-from VDyno.model.dyno import Dyno
+import sys
+
+from VDyno.presenter.startup_profiler import StartupProfiler
 
 
 def main() -> None:
+    profiler = StartupProfiler(enabled="--profile-startup" in sys.argv)
+    profiler.install_import_hook()
+
+    from VDyno.view.main_window import create_UI
+    from VDyno.presenter.data_handler import Presenter
+    from VDyno.model.dyno import Dyno
+
+    profiler.mark("imports done")
     view, app = create_UI()
-    model = Dyno()
-    presenter = Presenter(model, view, app)
+    profiler.mark("create_UI")
+    port = None
+    if "--port" in sys.argv:
+        position = sys.argv.index("--port") + 1
+        port = sys.argv[position] if position < len(sys.argv) else None
+    model = Dyno(connect=False, port=port)
+    if "--telemetry" in sys.argv:
+        from VDyno.model.telemetry import DEFAULT_ADDRESS, TelemetryPublisher
+
+        position = sys.argv.index("--telemetry") + 1
+        has_address = position < len(sys.argv) and not sys.argv[position].startswith("--")
+        publisher = TelemetryPublisher(model, sys.argv[position] if has_address else DEFAULT_ADDRESS)
+        publisher.start()
+        app.aboutToQuit.connect(publisher.stop)
+    presenter = Presenter(model, view, app, profiler)
     presenter.run()
 
 if __name__ == "__main__":
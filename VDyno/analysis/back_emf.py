@@ -0,0 +1,245 @@
+"""
+VDyno - A PyQT based GUI for the V-Dyno project.
+
+This code replaces the loading and constant finding in docs/motor_characterisation/Torque_Constant_Calculator.ipynb.
+Two oscilloscope export formats are understood:
+    - Rohde & Schwarz RTB2004 (Tests/*/RTB2004_CHAN*.csv): a text header then time,voltage rows.
+    - Tektronix TDS2012B (Back_EMF_Data_Drill/*/*.CSV): metadata in the first columns, time and voltage in columns 4 and 5.
+Parsed captures are cached as .npy files beside the source and memory mapped on later loads, so re-runs skip the csv parsing.
+Electrical frequency comes from hysteresis zero crossings (or an FFT peak), amplitude from per-cycle peak-to-peak,
+which together give the back EMF constant Ke, equal to the torque constant Kt in SI units.
+
+Usage:
+    python -m VDyno.analysis.back_emf docs/motor_characterisation/Tests --pole-pairs 7 --winding delta
+
+written by:
+    - Daniel Muir
+"""
+
+import argparse
+import csv
+import glob
+import os
+import re
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+if __name__ == "__main__":
+    sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
+
+CACHE_FOLDER = "__npycache__"
+# Channel 3 was captured through a 10:1 probe, see the centring cell of the notebook
+DEFAULT_CHANNEL_SCALE = {"CHAN3": 10.0}
+WINDING_FACTOR = {"delta": np.sqrt(2 / 3), "wye": np.sqrt(2)}
+
+
+def _first_numeric_line(file_path: str) -> int:
+    """Number of header lines before the data starts."""
+    with open(file_path, mode="r", encoding="utf-8", errors="replace") as file:
+        for number, line in enumerate(file):
+            try:
+                float(line.split(",")[0])
+                return number
+            except ValueError:
+                continue
+    return 0
+
+
+def _is_tektronix(file_path: str) -> bool:
+    with open(file_path, mode="r", encoding="utf-8", errors="replace") as file:
+        return "Record Length" in file.readline()
+
+
+def parse_capture(file_path: str) -> np.ndarray:
+    """Parse a scope export into a (2, n) array of time (s) and voltage (V)."""
+    if _is_tektronix(file_path):
+        data = np.loadtxt(file_path, delimiter=",", usecols=(3, 4), dtype=np.float64)
+    else:
+        skip = _first_numeric_line(file_path)
+        data = np.loadtxt(file_path, delimiter=",", usecols=(0, 1), skiprows=skip, dtype=np.float64)
+    return np.ascontiguousarray(data.T)
+
+
+def cache_path(file_path: str) -> str:
+    folder, name = os.path.split(file_path)
+    return os.path.join(folder, CACHE_FOLDER, os.path.splitext(name)[0] + ".npy")
+
+
+def load_capture(file_path: str, use_cache: bool = True) -> tuple:
+    """
+    Return (times, voltages) for a scope export.
+
+    The parsed array is saved to __npycache__ the first time and memory mapped from then on.
+    A cache older than its source file is rebuilt.
+    """
+    if not use_cache:
+        data = parse_capture(file_path)
+        return data[0], data[1]
+    cached = cache_path(file_path)
+    if not os.path.exists(cached) or os.path.getmtime(cached) < os.path.getmtime(file_path):
+        os.makedirs(os.path.dirname(cached), exist_ok=True)
+        np.save(cached, parse_capture(file_path))
+    data = np.load(cached, mmap_mode="r")
+    return data[0], data[1]
+
+
+def _crossing_indices(voltages: np.ndarray, hysteresis: float) -> np.ndarray:
+    """Indices where the signal rises through +hysteresis having last been below -hysteresis."""
+    state = np.zeros(len(voltages), dtype=np.int8)
+    state[voltages > hysteresis] = 1
+    state[voltages < -hysteresis] = -1
+    # Forward fill the dead band with the last decided state
+    decided = np.where(state != 0, np.arange(len(state)), 0)
+    np.maximum.accumulate(decided, out=decided)
+    state = state[decided]
+    return np.flatnonzero((state[1:] == 1) & (state[:-1] == -1)) + 1
+
+
+def zero_crossing_frequency(times: np.ndarray, voltages: np.ndarray, hysteresis: float) -> tuple:
+    """Return (frequency in Hz, rising crossing indices) using whole cycles between the first and last crossing."""
+    crossings = _crossing_indices(voltages, hysteresis)
+    if len(crossings) < 2:
+        return np.nan, crossings
+    span = times[crossings[-1]] - times[crossings[0]]
+    return (len(crossings) - 1) / span, crossings
+
+
+def fft_frequency(times: np.ndarray, voltages: np.ndarray) -> float:
+    """Dominant frequency from a Hann windowed FFT, refined by parabolic interpolation of the peak."""
+    n = len(voltages)
+    spacing = (times[-1] - times[0]) / (n - 1)
+    spectrum = np.abs(np.fft.rfft(voltages * np.hanning(n)))
+    spectrum[0] = 0
+    peak = int(np.argmax(spectrum))
+    if 0 < peak < len(spectrum) - 1:
+        left, centre, right = np.log(spectrum[peak - 1 : peak + 2] + 1e-30)
+        peak = peak + 0.5 * (left - right) / (left - 2 * centre + right)
+    return peak / (n * spacing)
+
+
+def peak_to_peak(voltages: np.ndarray, crossings: np.ndarray) -> float:
+    """Mean peak-to-peak voltage over the whole cycles between crossings."""
+    if len(crossings) < 2:
+        return float(np.percentile(voltages, 99.5) - np.percentile(voltages, 0.5))
+    cycles = voltages[crossings[0] : crossings[-1]]
+    starts = crossings[:-1] - crossings[0]
+    return float(np.mean(np.maximum.reduceat(cycles, starts) - np.minimum.reduceat(cycles, starts)))
+
+
+def torque_constant(frequency: float, pk2pk: float, pole_pairs: int, winding: str) -> float:
+    """Ke = Kt (Nm/A, V s/rad) from the electrical frequency and line peak-to-peak voltage."""
+    mechanical_speed = 2 * np.pi * frequency / pole_pairs
+    return (pk2pk / 2) / (WINDING_FACTOR[winding] * mechanical_speed)
+
+
+def analyse_capture(
+    file_path: str,
+    pole_pairs: int = 7,
+    winding: str = "delta",
+    method: str = "zero_crossing",
+    channel_scale: dict | None = None,
+    use_cache: bool = True,
+) -> dict:
+    """Work out frequency, speed, amplitude and Ke/Kt for a single capture."""
+    times, voltages = load_capture(file_path, use_cache)
+    scale = 1.0
+    for key, factor in (DEFAULT_CHANNEL_SCALE if channel_scale is None else channel_scale).items():
+        if key in os.path.basename(file_path):
+            scale = factor
+    voltages = (voltages - np.mean(voltages)) * scale
+
+    amplitude = (np.percentile(voltages, 99) - np.percentile(voltages, 1)) / 2
+    frequency, crossings = zero_crossing_frequency(times, voltages, 0.2 * amplitude)
+    if method == "fft" or np.isnan(frequency):
+        frequency = fft_frequency(times, voltages)
+    pk2pk = peak_to_peak(voltages, crossings)
+
+    match = re.search(r"(\d+)rpm", file_path)
+    return {
+        "file": file_path,
+        "nominal_rpm": int(match.group(1)) if match else "",
+        "samples": len(voltages),
+        "frequency_hz": frequency,
+        "rpm": 60 * frequency / pole_pairs,
+        "pk2pk_v": pk2pk,
+        "kt": torque_constant(frequency, pk2pk, pole_pairs, winding),
+    }
+
+
+def find_captures(folder: str) -> list[str]:
+    """Every scope export below folder, in name order."""
+    paths = glob.glob(os.path.join(folder, "**", "*.csv"), recursive=True)
+    paths += glob.glob(os.path.join(folder, "**", "*.CSV"), recursive=True)
+    return sorted(set(path for path in paths if CACHE_FOLDER not in path))
+
+
+def _analyse_capture_job(args: tuple) -> dict:
+    file_path, kwargs = args
+    try:
+        return analyse_capture(file_path, **kwargs)
+    except (OSError, ValueError) as e:
+        return {"file": file_path, "error": str(e)}
+
+
+def characterise(paths: list[str], workers: int | None = None, **kwargs) -> list[dict]:
+    """Analyse every capture in parallel, one capture per process."""
+    jobs = [(path, kwargs) for path in paths]
+    if workers == 1 or len(jobs) < 2:
+        return [_analyse_capture_job(job) for job in jobs]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(_analyse_capture_job, jobs))
+
+
+def write_results(file_path: str, results: list[dict]) -> None:
+    fields = ["file", "nominal_rpm", "samples", "frequency_hz", "rpm", "pk2pk_v", "kt"]
+    with open(file_path, mode="w", newline="", encoding="utf-8") as file:
+        writer = csv.DictWriter(file, fieldnames=fields, extrasaction="ignore")
+        writer.writeheader()
+        writer.writerows(result for result in results if "error" not in result)
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Back EMF / torque constant from oscilloscope captures.")
+    parser.add_argument("folders", nargs="+", help="folders searched recursively for scope exports")
+    parser.add_argument("--pole-pairs", type=int, default=7)
+    parser.add_argument("--winding", choices=list(WINDING_FACTOR), default="delta")
+    parser.add_argument("--method", choices=["zero_crossing", "fft"], default="zero_crossing")
+    parser.add_argument("--workers", type=int, default=None, help="process pool size (default: cpu count)")
+    parser.add_argument("--no-cache", action="store_true", help="always re-parse the csv files")
+    parser.add_argument("--output", default=None, help="optional .csv to write per capture results to")
+    args = parser.parse_args(argv)
+
+    paths = [path for folder in args.folders for path in find_captures(folder)]
+    if not paths:
+        print("No captures found.")
+        return 1
+    results = characterise(
+        paths,
+        args.workers,
+        pole_pairs=args.pole_pairs,
+        winding=args.winding,
+        method=args.method,
+        use_cache=not args.no_cache,
+    )
+    constants = []
+    for result in results:
+        if "error" in result:
+            print(f"Skipping {result['file']}: {result['error']}")
+            continue
+        constants.append(result["kt"])
+        print(
+            f"{result['file']}: {result['frequency_hz']:.2f} Hz, {result['rpm']:.0f} rpm, "
+            f"{result['pk2pk_v']:.3f} Vpp, Kt = {result['kt']:.5f} Nm/A"
+        )
+    if args.output:
+        write_results(args.output, results)
+    if not constants:
+        return 1
+    print(f"Mean Kt = {np.mean(constants):.5f} Nm/A, standard deviation {np.std(constants):.5f} over {len(constants)} captures")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
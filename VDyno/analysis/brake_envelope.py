@@ -0,0 +1,243 @@
+"""
+VDyno - A PyQT based GUI for the V-Dyno project.
+
+This code is a Python port of the MATLAB tools in docs/motor_characterisation/magtrol_graphs (file_loader.m, datasheet_scraper.m, motor_brake.m).
+Each digitised datasheet curve is loaded once into an Envelope, a log-log interpolant of the maximum absorbed torque against speed.
+As in the MATLAB area plots, the envelope is the region under the curve between its lowest and highest speed.
+Envelopes are overlaid on the live torque-speed plot and used to check experiment plans before they are run.
+
+Usage:
+    python -m VDyno.analysis.brake_envelope check VDyno/experiments/test_4A_1000rpm.json
+    python -m VDyno.analysis.brake_envelope recording experimental_results/2025-03-01_12-00-00.csv
+
+written by:
+    - Daniel Muir
+"""
+
+import argparse
+import csv
+import glob
+import json
+import os
+import sys
+from functools import lru_cache
+
+import numpy as np
+
+if __name__ == "__main__":
+    sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
+
+MAGTROL_FOLDER = "docs/motor_characterisation/magtrol_graphs"
+RIG_TORQUE_CONSTANT = 0.0496  # Nm/A, mean of the Tests captures, see VDyno.analysis.back_emf
+RIG_CURRENT_LIMIT = 60.0  # A, motor current limit configured on the load VESC
+RIG_MAX_RPM = 10000.0  # matches the load rpm range offered in the tools panel
+RAMP_POINTS = 100  # ExperimentWorker.ramp splits every ramp into 100 setpoints
+
+
+class Envelope:
+    """Maximum torque (Nm) against speed (rpm) for one brake or motor."""
+
+    def __init__(self, name: str, speed: np.ndarray, torque: np.ndarray) -> None:
+        keep = np.isfinite(speed) & np.isfinite(torque)
+        order = np.argsort(speed[keep], kind="stable")
+        self.name = name
+        self.speed = np.asarray(speed[keep][order], dtype=np.float64)
+        self.torque = np.asarray(torque[keep][order], dtype=np.float64)
+        # Datasheets are drawn on log-log axes, interpolate the same way when the curve allows it
+        self.log_scale = bool(np.all(self.speed > 0) and np.all(self.torque > 0))
+        if self.log_scale:
+            self._x = np.log10(self.speed)
+            self._y = np.log10(self.torque)
+        else:
+            self._x = self.speed
+            self._y = self.torque
+
+    def torque_limit(self, speed: np.ndarray) -> np.ndarray:
+        """Largest torque the envelope allows at each speed, 0 outside its speed range."""
+        speed = np.abs(np.asarray(speed, dtype=np.float64))
+        inside = (speed >= self.speed[0]) & (speed <= self.speed[-1])
+        limit = np.zeros(speed.shape)
+        if self.log_scale:
+            limit[inside] = 10 ** np.interp(np.log10(speed[inside]), self._x, self._y)
+        else:
+            limit[inside] = np.interp(speed[inside], self._x, self._y)
+        return limit
+
+    def margin(self, speed: np.ndarray, torque: np.ndarray) -> np.ndarray:
+        """Torque left before the envelope is reached, negative when outside it."""
+        return self.torque_limit(speed) - np.abs(np.asarray(torque, dtype=np.float64))
+
+    def contains(self, speed: np.ndarray, torque: np.ndarray) -> np.ndarray:
+        return self.margin(speed, torque) >= 0
+
+    def outline(self) -> tuple:
+        """Closed (speed, torque) outline for plotting, dropping to zero torque at both ends."""
+        speed = np.concatenate(([self.speed[0]], self.speed, [self.speed[-1]]))
+        torque = np.concatenate(([0.0], self.torque, [0.0]))
+        return speed, torque
+
+
+def file_loader(file_path: str, scaling_factor: float = 1.0) -> dict:
+    """
+    Read a digitised datasheet csv, port of file_loader.m.
+
+    The first column is speed, every further column is a torque curve scaled by scaling_factor.
+    Blank cells (curves of different lengths) are kept as NaN.
+    """
+    with open(file_path, mode="r", newline="", encoding="utf-8") as file:
+        header = next(csv.reader(file))
+    data = np.genfromtxt(file_path, delimiter=",", skip_header=1, dtype=np.float64, ndmin=2)
+    return {name: data[:, 0] if i == 0 else data[:, i] * scaling_factor for i, name in enumerate(header)}
+
+
+@lru_cache(maxsize=None)
+def load_envelopes(folder: str = MAGTROL_FOLDER) -> dict:
+    """
+    Every envelope in folder as {name: Envelope}, loaded once per process.
+
+    Files with several torque columns (ServoFromDrury.csv) give one envelope per column, named file/column.
+    """
+    envelopes = {}
+    for file_path in sorted(glob.glob(os.path.join(folder, "*.csv"))):
+        name = os.path.splitext(os.path.basename(file_path))[0]
+        columns = file_loader(file_path)
+        names = list(columns)
+        speed = columns[names[0]]
+        if len(names) == 2:
+            envelopes[name] = Envelope(name, speed, columns[names[1]])
+        else:
+            for column in names[1:]:
+                envelopes[f"{name}/{column}"] = Envelope(f"{name}/{column}", speed, columns[column])
+    return envelopes
+
+
+def motor_brake_envelope(
+    torque_constant: float = RIG_TORQUE_CONSTANT,
+    current_limit: float = RIG_CURRENT_LIMIT,
+    max_rpm: float = RIG_MAX_RPM,
+) -> Envelope:
+    """Flat torque envelope of a VESC driven motor used as a brake, port of motor_brake.m."""
+    speed = np.array([1.0, max_rpm])
+    torque = np.full(2, torque_constant * current_limit)
+    return Envelope("Motor Brake", speed, torque)
+
+
+def rig_envelope() -> Envelope:
+    """The absorption envelope of this rig, from MotorBrake.csv when it has been digitised."""
+    return load_envelopes().get("MotorBrake") or motor_brake_envelope()
+
+
+def plan_points(experiment: dict, torque_constant: float = RIG_TORQUE_CONSTANT) -> tuple:
+    """
+    Every (step, speed, torque) setpoint an experiment will request, as arrays.
+
+    Torque is the torque setpoint in closed loop steps, otherwise estimated from the MUT current through the torque
+    constant. Speed is the load motor rpm.
+    """
+    steps, speeds, torques = [], [], []
+    for index, step in enumerate(experiment["steps"]):
+        if step["action"] == "ramp":
+            fraction = np.arange(RAMP_POINTS + 1) / RAMP_POINTS
+            mut = step["MUT"]["start"] + fraction * (step["MUT"]["end"] - step["MUT"]["start"])
+            load = step["load_motor"]["start"] + fraction * (
+                step["load_motor"]["end"] - step["load_motor"]["start"]
+            )
+        else:
+            mut = np.array([step["MUT"]["value"]], dtype=np.float64)
+            load = np.array([step["load_motor"]["value"]], dtype=np.float64)
+        steps.append(np.full(len(mut), index))
+        if step["MUT"]["property"] == "torque":
+            torques.append(mut)
+        elif step["load_motor"]["property"] == "torque":
+            torques.append(load)
+        elif step["MUT"]["property"] == "current":
+            torques.append(mut * torque_constant)
+        else:
+            torques.append(np.zeros(len(mut)))
+        speeds.append(load if step["load_motor"]["property"] == "rpm" else np.zeros(len(load)))
+    if not steps:
+        return np.empty(0, dtype=int), np.empty(0), np.empty(0)
+    return (
+        np.concatenate(steps),
+        np.abs(np.concatenate(speeds)),
+        np.abs(np.concatenate(torques)),
+    )
+
+
+def check_experiment(
+    experiment_file: str,
+    envelope: Envelope | None = None,
+    torque_constant: float = RIG_TORQUE_CONSTANT,
+) -> list[str]:
+    """Human readable warnings for every step with setpoints outside the envelope, empty when the plan is safe."""
+    envelope = envelope or rig_envelope()
+    with open(experiment_file, "r") as file:
+        experiment = json.load(file)
+    steps, speed, torque = plan_points(experiment, torque_constant)
+    margin = envelope.margin(speed, torque)
+    # Standstill is always reachable, the envelope only starts at its first digitised speed
+    outside = (margin < 0) & ~((speed == 0) & (torque == 0))
+    warnings = []
+    for step in np.unique(steps[outside]):
+        worst = np.flatnonzero(outside & (steps == step))
+        worst = worst[np.argmin(margin[worst])]
+        warnings.append(
+            f"Step {step + 1}: {torque[worst]:.2f} Nm at {speed[worst]:.0f} rpm is outside "
+            f"{envelope.name} ({envelope.torque_limit(speed[worst : worst + 1])[0]:.2f} Nm)"
+        )
+    return warnings
+
+
+def check_recording(recording_file: str, envelope: Envelope | None = None) -> dict:
+    """How much of a recording ran outside the envelope."""
+    from VDyno.analysis.results import SPEED_KEY, TORQUE_KEY, iter_chunks
+
+    envelope = envelope or rig_envelope()
+    samples = 0
+    outside = 0
+    worst = 0.0
+    for chunk in iter_chunks(recording_file):
+        margin = envelope.margin(chunk[SPEED_KEY], chunk[TORQUE_KEY])
+        moving = chunk[SPEED_KEY] != 0
+        samples += len(margin)
+        outside += int(np.count_nonzero((margin < 0) & moving))
+        if np.any(moving):
+            worst = min(worst, float(np.min(margin[moving])))
+    return {"samples": samples, "outside": outside, "worst_excess_nm": max(0.0, -worst)}
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Brake envelope checks for experiment plans and recordings.")
+    parser.add_argument("mode", choices=["check", "recording", "list"])
+    parser.add_argument("files", nargs="*", help="experiment .json or recording .csv files")
+    parser.add_argument("--envelope", default=None, help="envelope name from the magtrol_graphs folder (default: rig)")
+    parser.add_argument("--torque-constant", type=float, default=RIG_TORQUE_CONSTANT)
+    args = parser.parse_args(argv)
+
+    if args.mode == "list":
+        for name, envelope in load_envelopes().items():
+            print(f"{name}: {envelope.speed[0]:g}-{envelope.speed[-1]:g} rpm, up to {envelope.torque.max():g} Nm")
+        return 0
+    envelope = load_envelopes()[args.envelope] if args.envelope else rig_envelope()
+
+    status = 0
+    for file_path in args.files:
+        if args.mode == "check":
+            warnings = check_experiment(file_path, envelope, args.torque_constant)
+            print(f"{file_path}: {'OK' if not warnings else f'{len(warnings)} step(s) outside envelope'}")
+            for warning in warnings:
+                print(f"    {warning}")
+        else:
+            result = check_recording(file_path, envelope)
+            warnings = result["outside"]
+            print(
+                f"{file_path}: {result['outside']} of {result['samples']} samples outside {envelope.name}, "
+                f"worst by {result['worst_excess_nm']:.3f} Nm"
+            )
+        if warnings:
+            status = 1
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
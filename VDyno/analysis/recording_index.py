@@ -0,0 +1,196 @@
+"""
+VDyno - A PyQT based GUI for the V-Dyno project.
+
+This code contains the RecordingIndex class, which lets the results window browse recordings of any length without loading them.
+The first time a recording is opened it is parsed once, in chunks, into a column-major binary copy in __npycache__, alongside
+a min/max pyramid: level 0 holds the min and max of every BLOCK samples, and each further level merges FACTOR bins of the one below.
+Afterwards everything is memory mapped, so a view of any range reads only the raw samples or pyramid bins it needs
+(about two values per pixel) however long the run. An index older than its recording (e.g. one still being written) is rebuilt.
+
+Usage:
+    python -m VDyno.analysis.recording_index experimental_results/2025-03-01_12-00-00.csv
+
+written by:
+    - Daniel Muir
+"""
+
+import json
+import os
+import sys
+
+import numpy as np
+
+if __name__ == "__main__":
+    sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
+
+from VDyno.analysis.results import iter_chunks, read_header
+
+CACHE_FOLDER = "__npycache__"
+BLOCK = 64  # samples per bin in the finest level
+FACTOR = 8  # bins merged into each bin of the next level
+INDEX_VERSION = 1
+
+
+def index_folder(file_path: str) -> str:
+    folder, name = os.path.split(file_path)
+    return os.path.join(folder, CACHE_FOLDER, os.path.splitext(name)[0])
+
+
+def _count_rows(file_path: str) -> int:
+    """Data rows in a csv, counted in binary blocks without parsing."""
+    lines = 0
+    last = b"\n"
+    with open(file_path, mode="rb") as file:
+        while block := file.read(1 << 20):
+            lines += block.count(b"\n")
+            last = block[-1:]
+    if last != b"\n":
+        lines += 1  # last row has no newline yet
+    return max(0, lines - 1)
+
+
+def _reduce_bins(mins: np.ndarray, maxs: np.ndarray, size: int) -> tuple:
+    """Merge every size bins along the last axis, keeping a partial bin at the end."""
+    bins = mins.shape[1]
+    whole = bins // size * size
+    shape = (mins.shape[0], whole // size, size)
+    merged_min = np.fmin.reduce(mins[:, :whole].reshape(shape), axis=2)
+    merged_max = np.fmax.reduce(maxs[:, :whole].reshape(shape), axis=2)
+    if whole < bins:
+        merged_min = np.concatenate((merged_min, np.fmin.reduce(mins[:, whole:], axis=1)[:, None]), axis=1)
+        merged_max = np.concatenate((merged_max, np.fmax.reduce(maxs[:, whole:], axis=1)[:, None]), axis=1)
+    return merged_min, merged_max
+
+
+class RecordingIndex:
+    def __init__(self, file_path: str) -> None:
+        self.file_path = file_path
+        self.folder = index_folder(file_path)
+        with open(os.path.join(self.folder, "index.json"), mode="r") as file:
+            meta = json.load(file)
+        self.columns = meta["columns"]
+        self.rows = meta["rows"]
+        self.data = np.load(os.path.join(self.folder, "data.npy"), mmap_mode="r")
+        self.levels = []  # (samples per bin, mins, maxs)
+        for level in range(meta["levels"]):
+            block = BLOCK * FACTOR**level
+            mins = np.load(os.path.join(self.folder, f"min_{level}.npy"), mmap_mode="r")
+            maxs = np.load(os.path.join(self.folder, f"max_{level}.npy"), mmap_mode="r")
+            self.levels.append((block, mins, maxs))
+
+    @staticmethod
+    def is_current(file_path: str) -> bool:
+        index_file = os.path.join(index_folder(file_path), "index.json")
+        if not os.path.exists(index_file):
+            return False
+        with open(index_file, mode="r") as file:
+            meta = json.load(file)
+        stat = os.stat(file_path)
+        return (
+            meta.get("version") == INDEX_VERSION
+            and meta.get("source_size") == stat.st_size
+            and meta.get("source_mtime") == stat.st_mtime
+        )
+
+    @classmethod
+    def build(cls, file_path: str, chunk_rows: int = 200_000) -> "RecordingIndex":
+        """Parse the recording once into the binary copy and pyramid."""
+        stat = os.stat(file_path)
+        folder = index_folder(file_path)
+        os.makedirs(folder, exist_ok=True)
+        columns = read_header(file_path)
+        capacity = _count_rows(file_path)
+        data = np.lib.format.open_memmap(
+            os.path.join(folder, "data.npy"), mode="w+", dtype=np.float64, shape=(len(columns), max(capacity, 1))
+        )
+        rows = 0
+        for chunk in iter_chunks(file_path, chunk_rows):
+            block = np.vstack([chunk[name] for name in columns])[:, : capacity - rows]
+            data[:, rows : rows + block.shape[1]] = block
+            rows += block.shape[1]
+        data.flush()
+
+        # Level 0 straight from the samples, a slab at a time so memory stays bounded
+        mins, maxs = [], []
+        slab = BLOCK * 16384
+        for start in range(0, rows, slab):
+            samples = np.asarray(data[:, start : min(rows, start + slab)])
+            level_min, level_max = _reduce_bins(samples, samples, BLOCK)
+            mins.append(level_min)
+            maxs.append(level_max)
+        del data
+        level_min = np.concatenate(mins, axis=1) if mins else np.empty((len(columns), 0))
+        level_max = np.concatenate(maxs, axis=1) if maxs else np.empty((len(columns), 0))
+        levels = 0
+        while True:
+            np.save(os.path.join(folder, f"min_{levels}.npy"), level_min)
+            np.save(os.path.join(folder, f"max_{levels}.npy"), level_max)
+            levels += 1
+            if level_min.shape[1] <= FACTOR:
+                break
+            level_min, level_max = _reduce_bins(level_min, level_max, FACTOR)
+
+        meta = {
+            "version": INDEX_VERSION,
+            "source_size": stat.st_size,
+            "source_mtime": stat.st_mtime,
+            "columns": columns,
+            "rows": rows,
+            "levels": levels,
+        }
+        with open(os.path.join(folder, "index.json"), mode="w") as file:
+            json.dump(meta, file)
+        return cls(file_path)
+
+    @classmethod
+    def open(cls, file_path: str) -> "RecordingIndex":
+        """Open the index for a recording, building it first if missing or out of date."""
+        if cls.is_current(file_path):
+            return cls(file_path)
+        return cls.build(file_path)
+
+    def column(self, name: str) -> np.ndarray:
+        """Memory mapped samples of one channel."""
+        return self.data[self.columns.index(name), : self.rows]
+
+    def view(self, name: str, start: float, stop: float, max_points: int = 2000) -> tuple:
+        """
+        (sample numbers, values) for a channel between start and stop with at most about max_points points.
+
+        Ranges that fit are returned sample for sample. Longer ranges come from the finest pyramid level that fits,
+        as the min then max of each bin, so spikes survive however far out the view is zoomed.
+        """
+        column = self.columns.index(name)
+        start = max(0, int(start))
+        stop = min(self.rows, int(np.ceil(stop)))
+        if stop <= start:
+            return np.empty(0), np.empty(0)
+        if stop - start <= max_points:
+            return np.arange(start, stop, dtype=np.float64), np.asarray(self.data[column, start:stop])
+        block, mins, maxs = self.levels[-1]
+        for level in self.levels:
+            if (stop - start) / level[0] <= max_points / 2:
+                block, mins, maxs = level
+                break
+        first = start // block
+        last = min(mins.shape[1], -(-stop // block))
+        bins = np.arange(first, last, dtype=np.float64) * block
+        x = np.empty(2 * len(bins))
+        y = np.empty(2 * len(bins))
+        x[0::2] = bins
+        x[1::2] = bins + block / 2
+        y[0::2] = mins[column, first:last]
+        y[1::2] = maxs[column, first:last]
+        return x, y
+
+
+if __name__ == "__main__":
+    from time import perf_counter
+
+    for path in sys.argv[1:]:
+        started = perf_counter()
+        index = RecordingIndex.open(path)
+        print(
+            f"{path}: {index.rows} rows, {len(index.columns)} channels, {len(index.levels)} levels "
+            f"in {perf_counter() - started:.2f} s"
+        )
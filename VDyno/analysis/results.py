@@ -0,0 +1,569 @@
+"""
+VDyno - A PyQT based GUI for the V-Dyno project.
+
+This code turns the .csv recordings written by FileSaver (experimental_results/*.csv) into results.
+Recordings are streamed in chunks and parsed with NumPy, split into experiment steps, then binned by speed and torque.
+Recordings with an event channel (<recording>_events.csv, see VDyno/presenter/file_saver.py) are split at the recorded
+hold steps. Older recordings are split by watching the setpoint channels. load_step reads a single step by seeking to it.
+Partial sums from each file are merged, so whole campaigns can be spread over a process pool without loading any file into memory.
+
+Outputs (all .csv):
+    - torque_speed_curve.csv: mean torque and 95% confidence interval per speed bin.
+    - efficiency_map.csv: mean efficiency per (speed, torque) bin, speed down the rows and torque across the columns.
+    - step_summary.csv: mean and confidence interval of every channel for each steady step in each file.
+
+With --from-steps the per-step summaries written during experiments (*_steps.csv, see VDyno/presenter/step_statistics.py)
+are used instead: each hold step's channel means count as one operating point, so no recording has to be read.
+
+Usage:
+    python -m VDyno.analysis.results experimental_results/*.csv --output analysis_output
+    python -m VDyno.analysis.results experimental_results/*_steps.csv --from-steps
+
+written by:
+    - Daniel Muir
+"""
+
+import argparse
+import csv
+import glob
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from typing import Iterator
+
+import numpy as np
+
+if __name__ == "__main__":
+    sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
+
+from VDyno.model.recording_format import TIME_KEY, events_path
+
+SPEED_KEY = "Status_RPM_V1"
+CURRENT_KEY = "Status_TotalCurrent_V1"
+DUTY_KEY = "Status_DutyCycle_V1"
+INPUT_VOLTAGE_KEY = "Status_InputVoltage_V1"
+TORQUE_KEY = "TorqueValue"
+SETPOINT_KEYS = ("Status_TotalCurrent_V1", "Status_RPM_V2")
+SETPOINT_PROPERTIES = ("current", "rpm")  # the experiment step property each of SETPOINT_KEYS follows
+SIDECAR_SUFFIXES = ("_steps.csv", "_events.csv")
+
+Z_95 = 1.959964  # two sided 95% normal quantile, steps and bins hold plenty of samples
+
+
+class AnalysisConfig:
+    """Settings shared by every worker in a campaign, kept picklable for the process pool."""
+
+    def __init__(
+        self,
+        max_rpm: float = 10000.0,
+        speed_bin_count: int = 50,
+        max_torque: float = 5.0,
+        torque_bin_count: int = 25,
+        bus_voltage: float = 24.0,
+        min_electrical_power: float = 5.0,
+        current_tolerance: float = 0.25,
+        rpm_tolerance: float = 50.0,
+        settle_samples: int = 10,
+        min_step_samples: int = 20,
+        chunk_rows: int = 200_000,
+    ) -> None:
+        self.speed_edges = np.linspace(0.0, max_rpm, speed_bin_count + 1)
+        self.torque_edges = np.linspace(0.0, max_torque, torque_bin_count + 1)
+        self.bus_voltage = bus_voltage
+        self.min_electrical_power = min_electrical_power
+        self.current_tolerance = current_tolerance
+        self.rpm_tolerance = rpm_tolerance
+        self.settle_samples = settle_samples
+        self.min_step_samples = min_step_samples
+        self.chunk_rows = chunk_rows
+
+
+def read_header(file_path: str) -> list[str]:
+    with open(file_path, mode="r", newline="", encoding="utf-8") as file:
+        return next(csv.reader(file))
+
+
+def _parse_field(field: str) -> float:
+    try:
+        return float(field)
+    except ValueError:
+        return np.nan
+
+
+def _parse_lines(lines: list[str], column_count: int) -> np.ndarray:
+    """
+    Parse a block of csv lines in one call, falling back to a tolerant parser for damaged rows.
+
+    Always one row per line, so row numbers stay aligned with the event channel's: values that aren't numbers become NaN,
+    and so does every value of a row cut short by a crash or with the wrong number of columns.
+    """
+    try:
+        block = np.loadtxt(lines, delimiter=",", dtype=np.float64, ndmin=2)
+        if block.shape == (len(lines), column_count):  # loadtxt skips blank lines, which would shift the rows
+            return block
+    except ValueError:
+        pass
+    block = np.full((len(lines), column_count), np.nan)
+    for row, line in enumerate(lines):
+        fields = line.rstrip("\r\n").split(",")
+        if len(fields) == column_count:
+            block[row] = [_parse_field(field) for field in fields]
+    return block
+
+
+def iter_chunks(file_path: str, chunk_rows: int = 200_000) -> Iterator[dict]:
+    """Yield the recording as {column name: array} blocks of at most chunk_rows rows."""
+    with open(file_path, mode="r", newline="", encoding="utf-8") as file:
+        header = next(csv.reader([file.readline()]))
+        while True:
+            lines = list(islice(file, chunk_rows))
+            if not lines:
+                return
+            block = _parse_lines(lines, len(header))
+            if block.size == 0:
+                continue
+            yield {name: block[:, i] for i, name in enumerate(header)}
+
+
+def read_step_index(file_path: str) -> list[dict]:
+    """
+    Where each experiment step starts and ends in a recording, from its event channel (<recording>_events.csv).
+
+    Each entry has the step number, its first row and byte offset, the row and byte offset after its last row
+    (None if the recording ends first) and the step definition. Empty for recordings without an event channel.
+    """
+    path = events_path(file_path)
+    if not os.path.exists(path):
+        return []
+    index = []
+    current = None
+    with open(path, mode="r", newline="", encoding="utf-8") as file:
+        for event in csv.DictReader(file):
+            if current is not None and event["event"] in ("step_start", "step_end", "experiment_stop"):
+                current["end_row"] = int(event["row"])
+                current["end_offset"] = int(event["offset"])
+                current = None
+            if event["event"] == "step_start":
+                current = {
+                    "step": int(event["step"]),
+                    "row": int(event["row"]),
+                    "offset": int(event["offset"]),
+                    "end_row": None,
+                    "end_offset": None,
+                    "detail": json.loads(event["detail"] or "{}"),
+                }
+                index.append(current)
+    return index
+
+
+def load_step(file_path: str, step: int) -> dict:
+    """Read only one step's rows, seeking to it with the step index, as {column name: array}."""
+    entry = next((entry for entry in read_step_index(file_path) if entry["step"] == step), None)
+    if entry is None:
+        raise ValueError(f"{file_path} has no index entry for step {step}")
+    header = read_header(file_path)
+    with open(file_path, mode="rb") as file:
+        file.seek(entry["offset"])
+        if entry["end_offset"] is None:
+            data = file.read()
+        else:
+            data = file.read(entry["end_offset"] - entry["offset"])
+    lines = data.decode("utf-8").splitlines()
+    if not lines:
+        return {name: np.empty(0) for name in header}
+    block = _parse_lines(lines, len(header))
+    return {name: block[:, i] for i, name in enumerate(header)}
+
+
+def _indexed_setpoint(step: dict) -> np.ndarray:
+    """Setpoints for SETPOINT_KEYS from an indexed step definition, NaN where the step sets another property."""
+    values = []
+    for device, property_name in zip(("MUT", "load_motor"), SETPOINT_PROPERTIES):
+        setting = step.get(device, {})
+        value = setting.get("value", setting.get("end")) if setting.get("property") == property_name else None
+        values.append(np.nan if value is None else float(value))
+    return np.array(values)
+
+
+def load_recording(file_path: str) -> dict:
+    """Load a whole recording into memory, only sensible for single runs."""
+    chunks = list(iter_chunks(file_path))
+    if not chunks:
+        return {name: np.empty(0) for name in read_header(file_path)}
+    return {name: np.concatenate([chunk[name] for chunk in chunks]) for name in chunks[0]}
+
+
+class StepSegmenter:
+    """
+    Splits a stream of samples into experiment steps.
+
+    A step is a run of samples whose setpoint channels stay within their tolerance of the step's reference. A new step
+    starts only once settle_samples samples in a row are outside that band, so noise on the measured setpoint channels
+    doesn't break a steady step apart. The reference of the new step is the median of those samples. Samples outside the
+    band are left out of every step (-1), as are the samples of a change until it has settled.
+    Ramps produce many short steps, which are later dropped by min_step_samples. State is carried between chunks.
+    """
+
+    def __init__(self, tolerances: tuple, settle_samples: int = 10) -> None:
+        self.tolerances = np.asarray(tolerances, dtype=np.float64)
+        self.settle_samples = settle_samples
+        self.reference = None  # setpoints the current step's samples are compared to, None before the first step
+        self.pending = np.empty((0, len(self.tolerances)))  # trailing samples outside the band, at most settle_samples
+        self.step = -1
+
+    def segment(self, setpoints: np.ndarray) -> tuple:
+        """Return (step id per sample, the step's setpoint per sample) for an (n, k) block."""
+        n = len(setpoints)
+        steps = np.full(n, -1, dtype=np.int64)
+        references = np.full(setpoints.shape, np.nan)
+        start = 0
+        # Vectorised over a window that doubles while the step holds, so a ramp's many short steps stay cheap too
+        window = 4 * self.settle_samples
+        while start < n:
+            block = setpoints[start:start + window]
+            finite = np.all(np.isfinite(block), axis=1)  # damaged rows neither belong to a step nor start one
+            if self.reference is None:
+                outside = finite
+            else:
+                outside = np.any(np.abs(block - self.reference) > self.tolerances, axis=1)
+            position = np.arange(len(block))
+            last_inside = np.maximum.accumulate(np.where(outside, -1, position))
+            run = position - last_inside + np.where(last_inside < 0, len(self.pending), 0)  # outside samples in a row
+            settled = np.flatnonzero(run >= self.settle_samples)
+            end = settled[0] + 1 if len(settled) else len(block)
+            if self.reference is not None:
+                inside = ~outside[:end] & finite[:end]
+                steps[start:start + end][inside] = self.step
+                references[start:start + end][inside] = np.round(self.reference / self.tolerances) * self.tolerances
+            trailing = int(run[end - 1])
+            self.pending = np.concatenate([self.pending, block[:end]])[-trailing:] if trailing else self.pending[:0]
+            if len(settled):
+                self.reference = np.median(self.pending[-self.settle_samples:], axis=0)
+                self.pending = self.pending[:0]
+                self.step += 1
+                window = 4 * self.settle_samples
+            else:
+                window *= 2
+            start += end
+        return steps, references
+
+
+class RunningMoments:
+    """Count, sum and sum of squares per bin, mergeable across chunks, files and processes."""
+
+    def __init__(self, shape: tuple) -> None:
+        self.count = np.zeros(shape, dtype=np.int64)
+        self.total = np.zeros(shape, dtype=np.float64)
+        self.total_sq = np.zeros(shape, dtype=np.float64)
+
+    def add(self, flat_index: np.ndarray, values: np.ndarray) -> None:
+        size = self.count.size
+        self.count += np.bincount(flat_index, minlength=size).reshape(self.count.shape)
+        self.total += np.bincount(flat_index, values, minlength=size).reshape(self.count.shape)
+        self.total_sq += np.bincount(flat_index, values * values, minlength=size).reshape(
+            self.count.shape
+        )
+
+    def merge(self, other: "RunningMoments") -> None:
+        self.count += other.count
+        self.total += other.total
+        self.total_sq += other.total_sq
+
+    def mean(self) -> np.ndarray:
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return np.where(self.count > 0, self.total / self.count, np.nan)
+
+    def confidence_interval(self) -> np.ndarray:
+        """Half width of the 95% confidence interval of the mean."""
+        with np.errstate(invalid="ignore", divide="ignore"):
+            n = self.count.astype(np.float64)
+            variance = (self.total_sq - self.total * self.total / n) / (n - 1)
+            half_width = Z_95 * np.sqrt(np.clip(variance, 0.0, None) / n)
+        return np.where(self.count > 1, half_width, np.nan)
+
+
+def _bin_index(values: np.ndarray, edges: np.ndarray) -> np.ndarray:
+    """Bin number per value, -1 when outside the edges."""
+    index = np.searchsorted(edges, values, side="right") - 1
+    index[(values < edges[0]) | (values > edges[-1]) | ~np.isfinite(values)] = -1
+    index[values == edges[-1]] = len(edges) - 2
+    return index
+
+
+def efficiency(chunk: dict, config: AnalysisConfig) -> tuple:
+    """Return (mechanical power, electrical power, efficiency) arrays for a chunk."""
+    omega = chunk[SPEED_KEY] * 2 * np.pi / 60
+    mechanical = chunk[TORQUE_KEY] * omega
+    voltage = chunk.get(INPUT_VOLTAGE_KEY, config.bus_voltage)
+    # VESC status 1 reports motor current, the supply sees it scaled by duty cycle (%)
+    electrical = voltage * chunk[DUTY_KEY] / 100 * chunk[CURRENT_KEY]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        eta = np.where(electrical > config.min_electrical_power, mechanical / electrical, np.nan)
+    return mechanical, electrical, eta
+
+
+def analyse_file(file_path: str, config: AnalysisConfig) -> dict:
+    """Stream one recording and return its mergeable partial results."""
+    speed_bins = len(config.speed_edges) - 1
+    torque_bins = len(config.torque_edges) - 1
+    curve = RunningMoments((speed_bins,))
+    eff_map = RunningMoments((speed_bins, torque_bins))
+    header = read_header(file_path)
+    missing = [key for key in (SPEED_KEY, CURRENT_KEY, DUTY_KEY, TORQUE_KEY) if key not in header]
+    if missing:
+        raise ValueError(f"{file_path} is missing columns: {', '.join(missing)}")
+
+    # Recorded step boundaries when the recording has an event channel, otherwise infer them from the setpoint channels
+    index = [step for step in read_step_index(file_path) if step["detail"].get("action") == "hold"]
+    if index:
+        starts = np.array([step["row"] for step in index])
+        ends = np.array([np.inf if step["end_row"] is None else step["end_row"] for step in index])
+        indexed_keys = {step["step"]: _indexed_setpoint(step["detail"]) for step in index}
+        step_numbers = np.array([step["step"] for step in index])
+    else:
+        segmenter = StepSegmenter((config.current_tolerance, config.rpm_tolerance), config.settle_samples)
+
+    channels = [name for name in header if name != TIME_KEY]
+    step_moments = {}
+    step_keys = {}
+    sample_count = 0
+    for chunk in iter_chunks(file_path, config.chunk_rows):
+        rows = sample_count + np.arange(len(chunk[SPEED_KEY]))
+        sample_count += len(rows)
+        speed = np.abs(chunk[SPEED_KEY])
+        torque = np.abs(chunk[TORQUE_KEY])
+        _, _, eta = efficiency(chunk, config)
+
+        speed_index = _bin_index(speed, config.speed_edges)
+        valid = speed_index >= 0
+        curve.add(speed_index[valid], torque[valid])
+
+        torque_index = _bin_index(torque, config.torque_edges)
+        valid = (speed_index >= 0) & (torque_index >= 0) & np.isfinite(eta)
+        eff_map.add(speed_index[valid] * torque_bins + torque_index[valid], eta[valid])
+
+        if index:
+            position = np.searchsorted(starts, rows, side="right") - 1
+            inside = (position >= 0) & (rows < ends[np.clip(position, 0, None)])
+            steps = np.where(inside, step_numbers[np.clip(position, 0, None)], -1)
+        else:
+            setpoints = np.column_stack(
+                [chunk.get(key, np.zeros_like(speed)) for key in SETPOINT_KEYS]
+            )
+            steps, references = segmenter.segment(setpoints)
+        in_step = steps >= 0
+        if not in_step.any():
+            continue
+        ids, first_seen, local = np.unique(steps[in_step], return_index=True, return_inverse=True)
+        moments = RunningMoments((len(ids), len(channels)))
+        for column, name in enumerate(channels):
+            values = chunk[name][in_step]
+            finite = np.isfinite(values)
+            moments.count[:, column] += np.bincount(local[finite], minlength=len(ids))
+            moments.total[:, column] += np.bincount(local[finite], values[finite], minlength=len(ids))
+            moments.total_sq[:, column] += np.bincount(
+                local[finite], values[finite] ** 2, minlength=len(ids)
+            )
+        for row, (step, first) in enumerate(zip(ids, first_seen)):
+            step = int(step)
+            if step not in step_moments:
+                step_moments[step] = RunningMoments((len(channels),))
+                if index:
+                    step_keys[step] = indexed_keys[step]
+                else:
+                    step_keys[step] = references[in_step][first]
+            partial = step_moments[step]
+            partial.count += moments.count[row]
+            partial.total += moments.total[row]
+            partial.total_sq += moments.total_sq[row]
+
+    steps = []
+    for step, moments in sorted(step_moments.items()):
+        if moments.count.max() < config.min_step_samples:
+            continue
+        steps.append(
+            {
+                "step": step,
+                "setpoint": step_keys[step],
+                "count": int(moments.count.max()),
+                "mean": moments.mean(),
+                "ci": moments.confidence_interval(),
+            }
+        )
+    return {
+        "file": file_path,
+        "samples": sample_count,
+        "channels": channels,
+        "curve": curve,
+        "efficiency": eff_map,
+        "steps": steps,
+    }
+
+
+def _analyse_file_safe(args: tuple) -> dict:
+    file_path, config = args
+    try:
+        return analyse_file(file_path, config)
+    except (OSError, ValueError) as e:
+        return {"file": file_path, "error": str(e)}
+
+
+def analyse_campaign(paths: list[str], config: AnalysisConfig, workers: int | None = None) -> dict:
+    """Analyse every recording in paths, one file per process, and merge the results."""
+    speed_bins = len(config.speed_edges) - 1
+    torque_bins = len(config.torque_edges) - 1
+    curve = RunningMoments((speed_bins,))
+    eff_map = RunningMoments((speed_bins, torque_bins))
+    files = []
+    jobs = [(path, config) for path in paths]
+    if workers == 1 or len(paths) < 2:
+        results = list(map(_analyse_file_safe, jobs))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(_analyse_file_safe, jobs))
+    for result in results:
+        if "error" in result:
+            print(f"Skipping {result['file']}: {result['error']}")
+            continue
+        print(f"Analysed {result['file']}: {result['samples']} samples, {len(result['steps'])} steps")
+        curve.merge(result["curve"])
+        eff_map.merge(result["efficiency"])
+        files.append(result)
+    return {"curve": curve, "efficiency": eff_map, "files": files}
+
+
+def analyse_step_summaries(paths: list[str], config: AnalysisConfig) -> dict:
+    """Torque-speed curve and efficiency map from the hold steps in *_steps.csv summaries, one point per step."""
+    speed_bins = len(config.speed_edges) - 1
+    torque_bins = len(config.torque_edges) - 1
+    curve = RunningMoments((speed_bins,))
+    eff_map = RunningMoments((speed_bins, torque_bins))
+    points = 0
+    for path in paths:
+        with open(path, mode="r", newline="", encoding="utf-8") as file:
+            rows = [row for row in csv.DictReader(file) if row["action"] == "hold"]
+        if not rows:
+            continue
+        chunk = {}
+        for key in (SPEED_KEY, CURRENT_KEY, DUTY_KEY, TORQUE_KEY, INPUT_VOLTAGE_KEY):
+            column = f"{key}_mean"
+            if column in rows[0]:
+                chunk[key] = np.array([float(row[column] or "nan") for row in rows])
+        if any(key not in chunk for key in (SPEED_KEY, CURRENT_KEY, DUTY_KEY, TORQUE_KEY)):
+            print(f"Skipping {path}: not a step summary")
+            continue
+        speed = np.abs(chunk[SPEED_KEY])
+        torque = np.abs(chunk[TORQUE_KEY])
+        _, _, eta = efficiency(chunk, config)
+        speed_index = _bin_index(speed, config.speed_edges)
+        valid = speed_index >= 0
+        curve.add(speed_index[valid], torque[valid])
+        torque_index = _bin_index(torque, config.torque_edges)
+        valid = (speed_index >= 0) & (torque_index >= 0) & np.isfinite(eta)
+        eff_map.add(speed_index[valid] * torque_bins + torque_index[valid], eta[valid])
+        points += len(rows)
+        print(f"Read {path}: {len(rows)} hold steps")
+    return {"curve": curve, "efficiency": eff_map, "points": points}
+
+
+def _bin_centres(edges: np.ndarray) -> np.ndarray:
+    return (edges[:-1] + edges[1:]) / 2
+
+
+def write_torque_speed_curve(file_path: str, curve: RunningMoments, config: AnalysisConfig) -> None:
+    with open(file_path, mode="w", newline="", encoding="utf-8") as file:
+        writer = csv.writer(file)
+        writer.writerow(["speed_rpm", "torque_mean", "torque_ci95", "samples"])
+        for speed, mean, ci, count in zip(
+            _bin_centres(config.speed_edges), curve.mean(), curve.confidence_interval(), curve.count
+        ):
+            if count:
+                writer.writerow([f"{speed:g}", mean, ci, count])
+
+
+def write_efficiency_map(file_path: str, eff_map: RunningMoments, config: AnalysisConfig) -> None:
+    means = eff_map.mean()
+    with open(file_path, mode="w", newline="", encoding="utf-8") as file:
+        writer = csv.writer(file)
+        writer.writerow(["speed_rpm\\torque_nm"] + [f"{t:g}" for t in _bin_centres(config.torque_edges)])
+        for speed, row in zip(_bin_centres(config.speed_edges), means):
+            writer.writerow([f"{speed:g}"] + ["" if np.isnan(value) else value for value in row])
+
+
+def write_step_summary(file_path: str, files: list[dict]) -> None:
+    # Recordings from different setups can log different channels, so the columns are every channel seen in any file
+    channels = list(dict.fromkeys(name for result in files for name in result["channels"]))
+    with open(file_path, mode="w", newline="", encoding="utf-8") as file:
+        writer = csv.writer(file)
+        header = ["file", "step", "samples"] + [f"setpoint_{key}" for key in SETPOINT_KEYS]
+        for name in channels:
+            header += [f"{name}_mean", f"{name}_ci95"]
+        writer.writerow(header)
+        for result in files:
+            for step in result["steps"]:
+                row = [os.path.basename(result["file"]), step["step"], step["count"]]
+                row += list(step["setpoint"])
+                values = dict(zip(result["channels"], zip(step["mean"], step["ci"])))
+                for name in channels:
+                    row += list(values.get(name, ("", "")))
+                writer.writerow(row)
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Torque-speed curves and efficiency maps from VDyno recordings.")
+    parser.add_argument("recordings", nargs="+", help="recording .csv files or glob patterns")
+    parser.add_argument("--output", default="analysis_output", help="folder for the result files")
+    parser.add_argument("--workers", type=int, default=None, help="process pool size (default: cpu count)")
+    parser.add_argument("--max-rpm", type=float, default=10000.0)
+    parser.add_argument("--speed-bins", type=int, default=50)
+    parser.add_argument("--max-torque", type=float, default=5.0)
+    parser.add_argument("--torque-bins", type=int, default=25)
+    parser.add_argument("--bus-voltage", type=float, default=24.0, help="used when the recording has no input voltage")
+    parser.add_argument("--chunk-rows", type=int, default=200_000)
+    parser.add_argument("--from-steps", action="store_true", help="use the *_steps.csv step summaries, not recordings")
+    args = parser.parse_args(argv)
+
+    paths = []
+    for pattern in args.recordings:
+        paths.extend(sorted(glob.glob(pattern)) or [pattern])
+    # Step summaries and event channels sit next to the recordings, keep each run to its own kind of file
+    if args.from_steps:
+        paths = [path for path in paths if path.endswith("_steps.csv")]
+    else:
+        paths = [path for path in paths if not path.endswith(SIDECAR_SUFFIXES)]
+    config = AnalysisConfig(
+        max_rpm=args.max_rpm,
+        speed_bin_count=args.speed_bins,
+        max_torque=args.max_torque,
+        torque_bin_count=args.torque_bins,
+        bus_voltage=args.bus_voltage,
+        chunk_rows=args.chunk_rows,
+    )
+    if args.from_steps:
+        results = analyse_step_summaries(paths, config)
+        if not results["points"]:
+            print("No hold steps found in the step summaries.")
+            return 1
+        os.makedirs(args.output, exist_ok=True)
+        write_torque_speed_curve(os.path.join(args.output, "torque_speed_curve.csv"), results["curve"], config)
+        write_efficiency_map(os.path.join(args.output, "efficiency_map.csv"), results["efficiency"], config)
+        print(f"Results written to {args.output}")
+        return 0
+
+    results = analyse_campaign(paths, config, args.workers)
+    if not results["files"]:
+        print("No recordings could be analysed.")
+        return 1
+
+    os.makedirs(args.output, exist_ok=True)
+    write_torque_speed_curve(os.path.join(args.output, "torque_speed_curve.csv"), results["curve"], config)
+    write_efficiency_map(os.path.join(args.output, "efficiency_map.csv"), results["efficiency"], config)
+    write_step_summary(os.path.join(args.output, "step_summary.csv"), results["files"])
+    print(f"Results written to {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
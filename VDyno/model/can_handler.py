@@ -3,15 +3,48 @@ VDyno - A PyQT based GUI for the V-Dyno project.
 
 This code uses cantools to encode, decode, send and recieve CAN messages using VESC.dbc
 
+Each CANHandler owns one bus, so a process can run several rigs by giving each its own port. Without a port, the only
+USB-SERIAL CH340 adapter is used, and it is an error if there are none or several. Received frames are read by a
+python-can Notifier thread and pushed to whoever subscribed to that message, so devices are not polled. expect() is kept
+for scripts that want to wait for the next frame of a message.
+
+Given the messages the rig uses (Dyno.connect passes its devices' status messages), everything else is filtered out as low
+down as the interface allows. The exact frame IDs are passed to python-can as can_filters, which SocketCAN applies in the
+kernel and other interfaces apply in python-can before a frame is handed on. The filters match the ID only, not the frame
+type: the DBC marks every message extended, but the Teensy sends TEENSY_Status (0x19) as a standard frame. The seeedstudio
+adapter has a single id/mask pair for a single frame type, so it is set to the bits all the wanted IDs share, and only if
+every wanted message has been seen and all of them as extended frames. Its byte order isn't documented, so the mask is only
+kept if every wanted message is still seen after setting it, otherwise it is cleared again. Frames that get through are
+only decoded if they are wanted.
+
+on_receive and on_send taps are called with (message name, signals, timestamp) for every decoded and every sent frame. The
+receive timestamp is the bus's own (frame.timestamp, from the kernel on SocketCAN), the send timestamp is time() once the
+frame has been handed to the interface. The latency measurement uses them, see VDyno/presenter/latency.py.
+
 written by:
     - Daniel Muir
 """
 
+import threading
+import traceback
+from time import sleep, time
+
 import serial
 import can
 import cantools
 import serial.tools.list_ports
 
+if __name__ == "__main__":
+    import os
+    import sys
+
+    sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
+
+from VDyno.model.tracing import traced
+
+EXTENDED_MASK = 0x1FFFFFFF
+FILTER_CHECK_TIME = 0.25  # s spent listening for the wanted messages before, and after, the adapter mask is set
+
 
 def list_ports() -> list:
     ports = serial.tools.list_ports.comports()
@@ -21,33 +54,128 @@ def list_ports() -> list:
     return port_list
 
 
+def can_filters(database: object, message_names: list) -> list:
+    """python-can filters passing exactly the frame IDs of message_names, as standard or extended frames."""
+    filters = []
+    for name in message_names:
+        message = database.get_message_by_name(name)
+        # No "extended" key, so a frame the DBC calls extended is still received when it is sent as standard
+        filters.append({"can_id": message.frame_id, "can_mask": EXTENDED_MASK})
+    return filters
+
+
+def common_mask(frame_ids: list) -> tuple:
+    """(id, mask) for a single acceptance filter passing every frame ID: the mask keeps the bits they all agree on."""
+    differing = 0
+    for frame_id in frame_ids:
+        differing |= frame_id ^ frame_ids[0]
+    mask = EXTENDED_MASK & ~differing
+    return frame_ids[0] & mask, mask
+
+
 class CANHandler:
-    def __init__(self) -> None:
-        self.detect_port()
+    def __init__(
+        self, port: str | None = None, messages: list | None = None, interface: str = "seeedstudio"
+    ) -> None:
+        """
+        port is a serial port for seeedstudio adapters, or a channel such as can0 for other python-can interfaces.
+        messages are the names of the messages to receive, None for every message in the DBC.
+        """
+        self.interface = interface
+        self.message_names = messages
+        self.filtering = "none"  # none, software, driver, or driver + adapter mask
+        self.on_receive = []  # called with (message name, signals, bus timestamp) for every decoded frame
+        self.on_send = []  # called with (message name, signals, time sent) for every frame sent
+        self.detect_port(port)
         self.get_dbc()
         self.open()
 
-    def detect_port(self) -> None:
-        ports = list(serial.tools.list_ports.comports())
-        for port in ports:
-            if "USB-SERIAL CH340" in port.description:
-                self.com_port = port.device
-                break
-        else:
+    def detect_port(self, port: str | None = None) -> None:
+        if port is not None or self.interface != "seeedstudio":
+            self.com_port = port
+            return
+        ports = [port for port in serial.tools.list_ports.comports() if "USB-SERIAL CH340" in port.description]
+        if not ports:
             raise Exception("USB-SERIAL CH340 not found")
+        if len(ports) > 1:
+            names = ", ".join(port.device for port in ports)
+            raise Exception(f"{len(ports)} USB-SERIAL CH340 adapters found ({names}), choose one with --port")
+        self.com_port = ports[0].device
 
     def get_dbc(self) -> None:
         self.database = cantools.db.load_file("VDyno/model/CAN/VESC.dbc")
+        wanted = self.database.messages
+        if self.message_names is not None:
+            wanted = [self.database.get_message_by_name(name) for name in self.message_names]
+        self._messages = {message.frame_id: message for message in wanted}  # frames that are decoded
+        # Signals not given to send() are sent as 0, as cantools.tester.Tester did
+        self._defaults = {message.name: {signal.name: 0 for signal in message.signals} for message in self.database.messages}
 
     def open(self) -> None:
-        _can_bus = can.interface.Bus(
-            interface="seeedstudio",
-            channel=self.com_port,
-            baudrate=2000000,
-            bitrate=500000,
-        )
-        self.tester = cantools.tester.Tester("VESC1", self.database, _can_bus)
-        self.tester.start()
+        filters = None if self.message_names is None else can_filters(self.database, self.message_names)
+        if self.interface == "seeedstudio":
+            self.can_bus = can.interface.Bus(
+                interface="seeedstudio",
+                channel=self.com_port,
+                baudrate=2000000,
+                bitrate=500000,
+                can_filters=filters,
+            )
+        else:
+            self.can_bus = can.interface.Bus(interface=self.interface, channel=self.com_port, can_filters=filters)
+        if filters:
+            # python-can marks buses whose driver applied the filters, the rest are filtered in BusABC.recv
+            self.filtering = "driver" if getattr(self.can_bus, "_is_filtered", False) else "software"
+        self._subscribers = {}  # message name: [callback(signals)]
+        self._latest = {}  # message name: (sequence, signals) of the last frame received
+        self._standard = set()  # names of the messages received as standard frames
+        self._frame_ready = threading.Condition()
+        self._send_lock = threading.Lock()  # the control loop and the interlock both send
+        self.notifier = can.Notifier(self.can_bus, [self._on_frame])
+        if filters and self.interface == "seeedstudio":
+            self.set_adapter_mask()
+        print(self.filter_summary())
+
+    def filter_summary(self) -> str:
+        wanted = ", ".join(f"{frame_id:#x}" for frame_id in self._messages) if self.message_names is not None else "all"
+        return f"CAN {self.com_port}: receiving {wanted}, filtered by {self.filtering}"
+
+    def _messages_seen(self, duration: float) -> set:
+        """Names of the wanted messages received in the next duration seconds."""
+        with self._frame_ready:
+            before = {name: entry[0] for name, entry in self._latest.items()}
+        sleep(duration)
+        with self._frame_ready:
+            return {name for name, entry in self._latest.items() if entry[0] != before.get(name, 0)}
+
+    def set_adapter_mask(self) -> bool:
+        """Set the seeedstudio adapter's acceptance mask to the wanted IDs, keeping it only if they still arrive."""
+        seen = self._messages_seen(FILTER_CHECK_TIME)
+        unseen = {message.name for message in self._messages.values()} - seen
+        if unseen:
+            # Without a frame there's no knowing its type, and the adapter mask passes extended frames only
+            print(f"CAN {self.com_port}: {', '.join(sorted(unseen))} not seen yet, adapter mask not set")
+            return False
+        if self._standard:
+            print(f"CAN {self.com_port}: {', '.join(sorted(self._standard))} sent as standard frames, adapter mask not set")
+            return False
+        filter_id, mask = common_mask(list(self._messages))
+        self._configure_adapter(filter_id.to_bytes(4, "big"), mask.to_bytes(4, "big"), "EXT")
+        missing = seen - self._messages_seen(FILTER_CHECK_TIME)
+        if missing:
+            self._configure_adapter(bytes(4), bytes(4), "STD")
+            print(f"CAN {self.com_port}: adapter mask blocked {', '.join(sorted(missing))}, cleared it again")
+            return False
+        self.filtering = f"{self.filtering} + adapter mask {filter_id:#x}/{mask:#x}"
+        return True
+
+    def _configure_adapter(self, filter_id: bytes, mask_id: bytes, frame_type: str) -> None:
+        bus = self.can_bus
+        bus.filter_id = bytearray(filter_id)
+        bus.mask_id = bytearray(mask_id)
+        bus.frame_type = frame_type
+        with self._send_lock:
+            bus.init_frame()
 
     def open_connection(self) -> None:
         try:
@@ -63,25 +191,108 @@ class CANHandler:
         else:
             return ports
 
+    def subscribe(self, message_name: str, callback) -> None:
+        """Call callback(signals) with every decoded frame of message_name, on the bus's reader thread."""
+        self._subscribers.setdefault(message_name, []).append(callback)
+
+    def unsubscribe(self, message_name: str, callback) -> None:
+        callbacks = self._subscribers.get(message_name, [])
+        if callback in callbacks:
+            callbacks.remove(callback)
+
+    @traced("CAN receive", "can")
+    def _on_frame(self, frame: can.Message) -> None:
+        message = self._messages.get(frame.arbitration_id)
+        if message is None or frame.is_error_frame or frame.is_remote_frame:
+            return
+        signals = message.decode(frame.data, decode_choices=False)
+        if not frame.is_extended_id:
+            self._standard.add(message.name)
+        with self._frame_ready:
+            sequence = self._latest.get(message.name, (0, None))[0] + 1
+            self._latest[message.name] = (sequence, signals)
+            self._frame_ready.notify_all()
+        try:
+            for tap in self.on_receive:
+                tap(message.name, signals, frame.timestamp)
+        except Exception as e:
+            print(f"Error tapping {message.name}: {e}")
+            traceback.print_exc()
+        for callback in self._subscribers.get(message.name, ()):
+            try:
+                callback(signals)
+            except Exception as e:
+                print(f"Error handling {message.name}: {e}")
+                traceback.print_exc()
+
+    @traced("CAN send", "can")
     def send(self, message_name: str, signals: dict) -> None:
-        self.tester.send(message_name, signals)
+        message = self.database.get_message_by_name(message_name)
+        data = message.encode({**self._defaults[message_name], **signals})
+        frame = can.Message(arbitration_id=message.frame_id, is_extended_id=message.is_extended_frame, data=data)
+        with self._send_lock:
+            self.can_bus.send(frame)
+            sent = time()
+        for tap in self.on_send:
+            tap(message_name, signals, sent)
 
     def flush_input(self) -> None:
-        self.tester.flush_input()
+        """Nothing is queued, expect() always waits for a frame received after it was called."""
 
+    @traced("CAN expect", "can")
     def expect(self, message: object, timeout: float) -> object | None:
-        message = self.tester.expect(
-            message, None, timeout, discard_other_messages=True
-        )
-        return message
+        with self._frame_ready:
+            sequence = self._latest.get(message, (0, None))[0]
+            if not self._frame_ready.wait_for(lambda: self._latest.get(message, (0, None))[0] != sequence, timeout):
+                return None
+            return self._latest[message][1]
 
     def close(self) -> None:
+        self.notifier.stop()
         self.can_bus.shutdown()
 
 
+def check_filters() -> bool:
+    """Send wanted and unwanted frames, standard and extended, through a filtered CANHandler on a virtual bus."""
+    names = ["VESC_Status1_V1", "VESC_Status1_V2", "TEENSY_Status"]
+    handler = CANHandler("vdyno-filter-check", names, interface="virtual")
+    received = []
+    for name in names:
+        handler.subscribe(name, lambda signals, name=name: received.append(name))
+    teensy = handler.database.get_message_by_name("TEENSY_Status")
+    status = handler.database.get_message_by_name("VESC_Status1_V1")
+    frames = [
+        # (arbitration id, extended, data, expected message or None)
+        (teensy.frame_id, False, teensy.encode({"TorqueValue": 2048}), "TEENSY_Status"),  # as the Teensy firmware sends it
+        (status.frame_id, True, bytes(status.length), "VESC_Status1_V1"),
+        (0x555, False, bytes(8), None),
+        (0x90A, True, bytes(8), None),
+    ]
+    sender = can.interface.Bus(interface="virtual", channel="vdyno-filter-check")
+    passed = True
+    try:
+        for arbitration_id, extended, data, expected in frames:
+            received.clear()
+            sender.send(can.Message(arbitration_id=arbitration_id, is_extended_id=extended, data=data))
+            sleep(0.05)
+            got = received[0] if received else None
+            kind = "extended" if extended else "standard"
+            print(f"{kind} {arbitration_id:#x}: {'received as ' + got if got else 'filtered'}")
+            passed &= got == expected
+    finally:
+        sender.shutdown()
+        handler.close()
+    print("Filters OK" if passed else "Filters FAILED")
+    return passed
+
+
 if __name__ == "__main__":
+    if sys.argv[1:] == ["--check-filters"]:
+        sys.exit(0 if check_filters() else 1)
     try:
-        connection_handler = CANHandler()
+        connection_handler = CANHandler(
+            sys.argv[1] if len(sys.argv) > 1 else None, ["VESC_Status1_V1", "VESC_Status1_V2", "TEENSY_Status"]
+        )
     except Exception as e:
         print(f"Error: {e}")
         print(list_ports())
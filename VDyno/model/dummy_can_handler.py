@@ -2,6 +2,9 @@
 VDyno - A PyQT based GUI for the V-Dyno project.
 
 This code replicates can_handler.py for testing and debugging purposes.
+There is no reader thread: poll() makes one random walk frame for every subscribed message, and the AcquisitionEngine
+calls it for every dummy rig from one shared thread (see VDyno/presenter/acquisition.py).
+The walks are held inside bounds well within interlock_limits.csv, so a dummy rig left running doesn't trip the interlock.
 
 written by:
     - Daniel Muir
@@ -10,6 +13,25 @@ written by:
 from serial.tools import list_ports
 import cantools
 from random import randint
+from time import time
+
+if __name__ == "__main__":
+    import os
+    import sys
+
+    sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
+
+from VDyno.model.tracing import traced
+
+# Raw (uncalibrated) bounds of the random walks, see value_calibration.csv: about 5000 rpm, 20 A and 3.5 Nm
+SPEED_BOUND = 35000
+CURRENT_BOUND = 20
+TORQUE_BOUND = 3000
+
+
+def walk(value: int, step: int, bound: int) -> int:
+    """One random step of at most step, held within +/- bound."""
+    return max(-bound, min(bound, value + randint(-step, step)))
 
 
 def list_COM_ports() -> list:
@@ -21,8 +43,12 @@ def list_COM_ports() -> list:
 
 
 class CANHandler:
-    def __init__(self) -> None:
-        self.detect_port()
+    def __init__(self, port: str | None = None, messages: list | None = None, interface: str = "dummy") -> None:
+        self.interface = "dummy"
+        self.filtering = "none"
+        self.on_receive = []
+        self.on_send = []
+        self.detect_port(port)
         self.database = self.get_dbc()
         self.open()
         self.MUT_speed = 0
@@ -30,9 +56,11 @@ class CANHandler:
         self.load_speed = 0
         self.load_brake_current = 0
         self.transducer_torque = 0
+        self._subscribers = {}
 
-    def detect_port(self) -> None:
+    def detect_port(self, port: str | None = None) -> None:
         print("Detecting COM port...")
+        self.com_port = port or "dummy"
 
     def get_dbc(self) -> None:
         self.database = cantools.db.load_file("VDyno/model/CAN/VESC.dbc")
@@ -42,30 +70,52 @@ class CANHandler:
 
     def send(self, message_name: str, signals: dict) -> None:
         # print(f"Sending message: {message_name}, signals: {signals}")
-        return
+        for tap in self.on_send:
+            tap(message_name, signals, time())
 
     def flush_input(self) -> None: ...  # print("Flushing input...")
 
+    def subscribe(self, message_name: str, callback) -> None:
+        self._subscribers.setdefault(message_name, []).append(callback)
+
+    def unsubscribe(self, message_name: str, callback) -> None:
+        callbacks = self._subscribers.get(message_name, [])
+        if callback in callbacks:
+            callbacks.remove(callback)
+
+    def poll(self) -> None:
+        """Receive one frame of every subscribed message."""
+        for message_name, callbacks in list(self._subscribers.items()):
+            if callbacks:
+                message = self.expect(message_name, 0)
+                for tap in self.on_receive:
+                    tap(message_name, message, time())
+                for callback in callbacks:
+                    callback(message)
+
+    @traced("CAN expect", "can")
     def expect(self, message_name: object, timeout: float) -> object | None:
         if message_name == "VESC_Status1_V1":
-            self.MUT_speed = self.MUT_speed + randint(-100, 100)
-            self.MUT_brake_current = self.MUT_brake_current + randint(-1, 1)
+            self.MUT_speed = walk(self.MUT_speed, 100, SPEED_BOUND)
+            self.MUT_brake_current = walk(self.MUT_brake_current, 1, CURRENT_BOUND)
             message = {
                 "Status_RPM_V1": self.MUT_speed,
                 "Status_TotalCurrent_V1": self.MUT_brake_current,
                 "Status_DutyCycle_V1": self.MUT_brake_current * self.MUT_speed,
             }
         elif message_name == "VESC_Status1_V2":
-            self.load_speed = self.MUT_speed + randint(-100, 100)
-            self.load_brake_current = self.MUT_brake_current + randint(-1, 1)
+            self.load_speed = walk(self.MUT_speed, 100, SPEED_BOUND)
+            self.load_brake_current = walk(self.MUT_brake_current, 1, CURRENT_BOUND)
             message = {
                 "Status_RPM_V2": self.load_speed,
                 "Status_TotalCurrent_V2": self.load_brake_current,
                 "Status_DutyCycle_V2": self.load_brake_current * self.load_speed,
             }
         elif message_name == "TEENSY_Status":
-            self.transducer_torque = self.transducer_torque + randint(-100, 100)
+            self.transducer_torque = walk(self.transducer_torque, 100, TORQUE_BOUND)
             message = {"TorqueValue": self.transducer_torque}
+        elif message_name == "VESC_Status5_V1":
+            message = {"Status_Tachometer_V1": 0, "Status_Reserved_V1": 0, "Status_InputVoltage_V1": 24 + randint(-2, 2) / 10}
 
         return message
 
@@ -74,10 +124,6 @@ class CANHandler:
 
 
 if __name__ == "__main__":
-    import os
-    import sys
-
-    sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
     try:
         connection_handler = CANHandler()
     except Exception as e:
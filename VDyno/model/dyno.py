@@ -3,14 +3,22 @@ VDyno - A PyQT based GUI for the V-Dyno project.
 
 This code contains the Motor and TorqueTransducer classes, which are then initalised into a Dyno object.
 Each offsets their messages with factors defined by user in value_calibration.csv, then interacts with can_handler mainly.
+The Dyno also runs a ParameterEstimator on the MUT and torque frames, whose Kt, Ke and R estimates are derived channels
+that listeners receive alongside the measured ones. BusVoltage receives the MUT VESC's Status5 frames, whose input voltage
+the estimator needs to turn duty cycle into volts. It isn't one of the devices, so the interlock doesn't trip on a VESC
+that doesn't send Status5, the estimator flags its R and Ke as unreliable instead.
 dummy_can_handler is avaliable for testing purposes if required.
+Each Dyno is one rig on one CAN bus, chosen by port, so one process can hold several. Devices receive their status frames
+through receive(), which the AcquisitionEngine subscribes to the bus (VDyno/presenter/acquisition.py).
 
 written by:
     - Daniel Muir
 """
 
 import csv
+import threading
 
+from time import time
 from typing import Protocol
 
 if __name__ == "__main__":
@@ -19,16 +27,23 @@ if __name__ == "__main__":
 
     sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
 
-#from VDyno.model.can_handler import CANHandler
-from VDyno.model.dummy_can_handler import CANHandler
+from VDyno.model.parameter_estimator import ParameterEstimator
+from VDyno.model.tracing import traced
 
 
 class can_server_handler(Protocol):
     def send(self, message: object) -> None: ...
-    def flush_input(self) -> None: ...
+    def subscribe(self, message_name: str, callback) -> None: ...
+    def unsubscribe(self, message_name: str, callback) -> None: ...
     def expect(self, message: str, timeout: float) -> dict: ...
 
 
+class sample_listener(Protocol):
+    """Called with every new calibrated status and its time.time() timestamp, on the acquisition thread."""
+
+    def __call__(self, status: dict, timestamp: float) -> None: ...
+
+
 def load_calibration(file_path: str) -> dict:
     calibration_data = {}
     with open(file_path, mode="r") as file:
@@ -47,12 +62,17 @@ class Motor:
     ) -> None:
         self.model = can_server
         self.vesc_number = vesc_number
+        self.message_name = f"VESC_Status1_V{vesc_number}"
         self.status = {
             f"Status_RPM_V{vesc_number}": 0,
             f"Status_TotalCurrent_V{vesc_number}": 0,
             f"Status_DutyCycle_V{vesc_number}": 0,
         }
         self.calibration = load_calibration(calibration_file)
+        self.listeners = []
+        # Set by the interlock, every command is sent as zero until it is reset
+        self.lockout = False
+        self._command_lock = threading.Lock()
 
     def set_rpm(self, rpm_value: int) -> None:
         # Apply inverse scaling and offset if calibration exists
@@ -63,62 +83,188 @@ class Motor:
             rpm_value = int((rpm_value - offset) / factor)
 
         message_name = f"VESC_Command_RPM_V{self.vesc_number}"
-        signals = {f"Command_RPM_V{self.vesc_number}": rpm_value}
-        self.model.send(message_name, signals)
+        with self._command_lock:
+            signals = {f"Command_RPM_V{self.vesc_number}": 0 if self.lockout else rpm_value}
+            self.model.send(message_name, signals)
 
     def set_current(self, current_value: int) -> None:
         message_name = f"VESC_Command_AbsCurrent_V{self.vesc_number}"
-        signals = {f"Command_Current_V{self.vesc_number}": current_value}
-        self.model.send(message_name, signals)
+        with self._command_lock:
+            signals = {f"Command_Current_V{self.vesc_number}": 0 if self.lockout else current_value}
+            self.model.send(message_name, signals)
 
     def set_brake_current(self, brake_current: float) -> None:
         message_name = f"VESC_Command_AbsBrakeCurrent_V{self.vesc_number}"
-        signals = {f"Command_BrakeCurrent_V{self.vesc_number}": brake_current}
-        self.model.send(message_name, signals)
+        with self._command_lock:
+            signals = {f"Command_BrakeCurrent_V{self.vesc_number}": 0 if self.lockout else brake_current}
+            self.model.send(message_name, signals)
 
+    def lock_out(self) -> None:
+        """Send zero current now, and send every later command as zero until lockout is cleared."""
+        with self._command_lock:
+            self.lockout = True
+            if self.model is not None:
+                self.model.send(
+                    f"VESC_Command_AbsCurrent_V{self.vesc_number}", {f"Command_Current_V{self.vesc_number}": 0}
+                )
+
+    @traced("VESC update_status", "acquisition")
     def update_status(self) -> None:
-        self.model.flush_input()
-        status = self.model.expect(f"VESC_Status1_V{self.vesc_number}", timeout=0.021)
+        """Wait for the next status frame and receive it. The rig is normally fed by subscription instead."""
+        status = self.model.expect(self.message_name, timeout=0.021)
         if status is not None:
-            scaled_status = {}
-            for key, value in status.items():
-                if key in self.calibration:
-                    factor = self.calibration[key]["factor"]
-                    offset = self.calibration[key]["offset"]
-                    scaled_status[key] = value * factor + offset
-                else:
-                    scaled_status[key] = value
-            self.status = scaled_status
+            self.receive(status)
+
+    @traced("VESC receive", "acquisition")
+    def receive(self, status: dict) -> None:
+        """Calibrate a decoded status frame and pass it to the listeners."""
+        scaled_status = {}
+        for key, value in status.items():
+            if key in self.calibration:
+                factor = self.calibration[key]["factor"]
+                offset = self.calibration[key]["offset"]
+                scaled_status[key] = value * factor + offset
+            else:
+                scaled_status[key] = value
+        self.status = scaled_status
+        timestamp = time()
+        for listener in self.listeners:
+            listener(scaled_status, timestamp)
 
 
 class TorqueTransducer:
     def __init__(self, can_server: can_server_handler, calibration_file: str) -> None:
         self.model = can_server
+        self.message_name = "TEENSY_Status"
         self.status = {"TorqueValue": 0}
+        self.updated = None  # time() of the latest frame, None until one arrives
         self.calibration = load_calibration(calibration_file)
+        self.listeners = []
 
+    @traced("Teensy update_status", "acquisition")
     def update_status(self) -> None:
-        self.model.flush_input()
-        status = self.model.expect("TEENSY_Status", timeout=0.02)
+        status = self.model.expect(self.message_name, timeout=0.02)
         if status is not None:
-            scaled_status = {}
-            for key, value in status.items():
-                if key in self.calibration:
-                    factor = self.calibration[key]["factor"]
-                    offset = self.calibration[key]["offset"]
-                    scaled_status[key] = value * factor + offset
-                else:
-                    scaled_status[key] = value
-            self.status = scaled_status
+            self.receive(status)
+
+    @traced("Teensy receive", "acquisition")
+    def receive(self, status: dict) -> None:
+        scaled_status = {}
+        for key, value in status.items():
+            if key in self.calibration:
+                factor = self.calibration[key]["factor"]
+                offset = self.calibration[key]["offset"]
+                scaled_status[key] = value * factor + offset
+            else:
+                scaled_status[key] = value
+        self.status = scaled_status
+        timestamp = time()
+        self.updated = timestamp
+        for listener in self.listeners:
+            listener(scaled_status, timestamp)
+
+
+class BusVoltage:
+    """The input voltage a VESC reports in its Status5 frames."""
+
+    def __init__(self, can_server: can_server_handler, vesc_number: int) -> None:
+        self.model = can_server
+        self.vesc_number = vesc_number
+        self.message_name = f"VESC_Status5_V{vesc_number}"
+        self.status = {f"Status_InputVoltage_V{vesc_number}": 0}
+        self.listeners = []
+
+    def receive(self, status: dict) -> None:
+        # Only the input voltage, Status5 also carries the tachometer
+        key = f"Status_InputVoltage_V{self.vesc_number}"
+        if key not in status:
+            return
+        self.status = {key: status[key]}
+        timestamp = time()
+        for listener in self.listeners:
+            listener(self.status, timestamp)
 
 
 class Dyno:
-    def __init__(self) -> None:
-        can_server = CANHandler()
+    def __init__(
+        self,
+        connect: bool = True,
+        port: str | None = None,
+        name: str | None = None,
+        interface: str = "seeedstudio",
+        dummy: bool = True,
+    ) -> None:
+        """
+        Set connect=False to create the devices now and open the CAN bus later with connect().
+        port picks the rig's CAN adapter, see CANHandler.detect_port. name tells rigs apart in file names and messages.
+        interface is the python-can interface, e.g. socketcan with port can0.
+        dummy=True connects to dummy_can_handler's random walks rather than the rig, dummy=False to the real CANHandler.
+        """
+        self.port = port
+        self.name = name
+        self.interface = interface
+        self.dummy = dummy
         calibration_file = "VDyno/model/value_calibration.csv"
-        self.MUT = Motor(can_server, 1, calibration_file)
-        self.load_motor = Motor(can_server, 2, calibration_file)
-        self.torque_transducer = TorqueTransducer(can_server, calibration_file)
+        self.can_server = None
+        self.MUT = Motor(None, 1, calibration_file)
+        self.load_motor = Motor(None, 2, calibration_file)
+        self.torque_transducer = TorqueTransducer(None, calibration_file)
+        self.bus_voltage = BusVoltage(None, self.MUT.vesc_number)
+        self.parameter_estimator = ParameterEstimator(self.MUT.vesc_number)
+        self.MUT.listeners.append(self.parameter_estimator.add)
+        self.torque_transducer.listeners.append(self.parameter_estimator.add)
+        self.bus_voltage.listeners.append(self.parameter_estimator.add)
+        if connect:
+            self.connect()
+
+    @property
+    def connected(self) -> bool:
+        return self.can_server is not None
+
+    @property
+    def devices(self) -> tuple:
+        return (self.MUT, self.load_motor, self.torque_transducer)
+
+    @property
+    def receivers(self) -> tuple:
+        """Everything fed with frames from the bus: the devices and the bus voltage."""
+        return self.devices + (self.bus_voltage,)
+
+    @property
+    def sources(self) -> tuple:
+        """Everything that publishes samples: the receivers, then the derived channels."""
+        return self.receivers + (self.parameter_estimator,)
+
+    def add_listener(self, listener: sample_listener) -> None:
+        """Receive every sample from every source. Listeners run on the acquisition threads, so keep them cheap."""
+        for device in self.sources:
+            device.listeners.append(listener)
+
+    def remove_listener(self, listener: sample_listener) -> None:
+        for device in self.sources:
+            if listener in device.listeners:
+                device.listeners.remove(listener)
+
+    def connect(self) -> None:
+        """Parse the DBC, open the CAN bus and hand it to each device. Slow, so the GUI calls it off the main thread."""
+        # Imported here so python-can, cantools and pyserial only load when the bus is opened
+        if self.dummy:
+            from VDyno.model.dummy_can_handler import CANHandler
+        else:
+            from VDyno.model.can_handler import CANHandler
+
+        # Only the receivers' status frames are let through, see can_handler.py
+        can_server = CANHandler(self.port, [device.message_name for device in self.receivers], self.interface)
+        for device in self.receivers:
+            device.model = can_server
+        self.can_server = can_server
+
+    def disconnect(self) -> None:
+        if self.can_server is not None:
+            self.can_server.close()
+            self.can_server = None
+            for device in self.receivers:
+                device.model = None
 
 
 if __name__ == "__main__":
@@ -0,0 +1,152 @@
+"""
+VDyno - A PyQT based GUI for the V-Dyno project.
+
+This code contains the Interlock class, which checks every frame the devices decode against the limits in interlock_limits.csv.
+It runs as a Dyno listener on the acquisition threads, so a frame is checked as soon as it is decoded, whatever the GUI,
+control or experiment threads are doing. A watchdog thread catches channels that stop arriving (stale data).
+
+Checks, per channel (blank cells in the csv are not checked):
+    - min/max: calibrated value outside the range.
+    - max_rate: change since the previous frame faster than max_rate units per second.
+    - stale: no frame for stale_timeout seconds, counting from start() (or reset()) for a channel not seen yet, so a device
+      whose frames never arrive trips the same way as one whose frames stop.
+
+On a trip both motors are locked out (Motor.lockout), so later setpoints from the control loop are sent as zero. Zero current
+to the MUT and zero RPM to the load motor are sent straight away from the thread that detected the trip. Reaction time is measured from
+when the frame was decoded (or the data went stale) to when the zero commands have been sent. Clear with reset().
+
+written by:
+    - Daniel Muir
+"""
+
+import csv
+import threading
+from collections import deque
+from time import time
+
+LIMITS_FILE = "VDyno/model/interlock_limits.csv"
+MIN_RATE_INTERVAL = 0.005  # s, frames closer than this are treated as this far apart for the rate check
+
+
+def _optional_float(text: str) -> float | None:
+    text = (text or "").strip()
+    return float(text) if text else None
+
+
+def load_limits(file_path: str) -> dict:
+    """{channel: {"min", "max", "max_rate"}} from the limits csv, None where no limit is set."""
+    limits = {}
+    with open(file_path, mode="r") as file:
+        reader = csv.DictReader(file)
+        for row in reader:
+            limits[row["name"]] = {
+                "min": _optional_float(row["min"]),
+                "max": _optional_float(row["max"]),
+                "max_rate": _optional_float(row["max_rate"]),
+            }
+    return limits
+
+
+class Interlock:
+    def __init__(
+        self,
+        dyno: object,
+        limits_file: str = LIMITS_FILE,
+        stale_timeout: float = 0.25,
+        watchdog_period: float = 0.005,
+    ) -> None:
+        self.dyno = dyno
+        self.limits = load_limits(limits_file)
+        self.stale_timeout = stale_timeout
+        self.watchdog_period = watchdog_period
+        self.tripped = False
+        self.trip_reason = None
+        self.reaction_times_ms = deque(maxlen=1000)
+        self.on_trip = []  # called with the reason after the motors have been stopped
+        self._last = {}  # channel: (value, timestamp), value None until the channel's first frame
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._watchdog = None
+
+    def _expect_channels(self) -> None:
+        """Start the stale clock of every channel the devices report, frames received or not."""
+        now = time()
+        for device in self.dyno.devices:
+            for name in device.status:
+                self._last.setdefault(name, (None, now))
+
+    def start(self) -> None:
+        with self._lock:
+            self._last.clear()  # frames from before a stop, e.g. a replay, would be stale straight away
+            self._expect_channels()
+        self.dyno.add_listener(self.check)
+        self._stop.clear()
+        self._watchdog = threading.Thread(target=self._watch, name="interlock watchdog", daemon=True)
+        self._watchdog.start()
+
+    def stop(self) -> None:
+        self.dyno.remove_listener(self.check)
+        self._stop.set()
+        if self._watchdog is not None:
+            self._watchdog.join(timeout=1.0)
+            self._watchdog = None
+
+    def check(self, status: dict, timestamp: float) -> None:
+        """Dyno listener, runs on the acquisition thread for every decoded frame."""
+        for name, value in status.items():
+            previous = self._last.get(name)
+            self._last[name] = (value, timestamp)
+            if self.tripped:
+                continue
+            limit = self.limits.get(name)
+            if limit is None:
+                continue
+            if (limit["min"] is not None and value < limit["min"]) or (
+                limit["max"] is not None and value > limit["max"]
+            ):
+                self.trip(f"{name} at {value:.3f} is outside {limit['min']} to {limit['max']}", timestamp)
+            elif limit["max_rate"] is not None and previous is not None and previous[0] is not None:
+                rate = abs(value - previous[0]) / max(timestamp - previous[1], MIN_RATE_INTERVAL)
+                if rate > limit["max_rate"]:
+                    self.trip(f"{name} changing at {rate:.1f}/s, limit {limit['max_rate']}/s", timestamp)
+
+    def _watch(self) -> None:
+        while not self._stop.wait(self.watchdog_period):
+            if self.tripped:
+                continue
+            now = time()
+            for name, (value, timestamp) in list(self._last.items()):
+                if now - timestamp > self.stale_timeout:
+                    since = "received in" if value is None else "for"
+                    self.trip(f"No {name} {since} {(now - timestamp) * 1000:.0f} ms", timestamp + self.stale_timeout)
+                    break
+
+    def trip(self, reason: str, detected_at: float | None = None) -> None:
+        """Lock out and stop both motors. detected_at is when the fault was first visible, for the reaction time."""
+        with self._lock:
+            if self.tripped:
+                return
+            self.tripped = True
+        detected_at = detected_at if detected_at is not None else time()
+        self.dyno.MUT.lock_out()
+        self.dyno.load_motor.lock_out()
+        if self.dyno.load_motor.model is not None:
+            self.dyno.load_motor.set_rpm(0)  # brake the shaft to a stop rather than let it coast
+        reaction_ms = (time() - detected_at) * 1000
+        self.reaction_times_ms.append(reaction_ms)
+        self.trip_reason = reason
+        rig = f" on {self.dyno.name}" if getattr(self.dyno, "name", None) else ""
+        print(f"INTERLOCK TRIPPED{rig}: {reason}. Motors stopped {reaction_ms:.2f} ms after detection.")
+        for callback in self.on_trip:
+            callback(reason)
+
+    def reset(self) -> None:
+        """Clear a trip and allow commands again. Stale checks restart from now."""
+        with self._lock:
+            self._last.clear()
+            self._expect_channels()
+            for motor in (self.dyno.MUT, self.dyno.load_motor):
+                motor.lockout = False
+            self.tripped = False
+            self.trip_reason = None
+        print("Interlock reset.")
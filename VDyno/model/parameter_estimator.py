@@ -0,0 +1,180 @@
+"""
+VDyno - A PyQT based GUI for the V-Dyno project.
+
+This code contains the ParameterEstimator class, which identifies the MUT's torque constant (Kt), back EMF constant (Ke)
+and winding resistance (R) online, from the frames the rig already streams. It replaces reading them off scope captures
+(VDyno.analysis.back_emf) and copying them into the code by hand, and follows them as the motor warms up.
+
+Two models are fitted by recursive least squares with exponential forgetting:
+    - torque:  |TorqueValue| = Kt * |I| + c            (c soaks up friction and transducer offset)
+    - voltage: duty * V_in   = R * I + Ke * omega        (DC equivalent, omega in mechanical rad/s)
+Each update is a fixed number of float operations on a 2x2 covariance, so every frame costs O(1) time and memory.
+The 95% confidence half width of each parameter comes from its covariance scaled by the running residual variance.
+Frames with too little current or speed to tell the parameters apart are not used, so the estimates don't drift at rest.
+
+The voltage model needs the bus voltage, read from the MUT VESC's Status5 frames (Status_InputVoltage). Until one
+arrives bus_voltage is assumed, and Estimate_VoltageAssumed_V1 is 1 to flag R and Ke as unreliable. The first measured
+voltage restarts the voltage fit, so nothing fitted against the assumed voltage is kept. Set bus_voltage to the supply's
+voltage if the VESC isn't set to send Status5.
+
+The estimates are published as derived channels (Estimate_Kt_V1, Estimate_Kt_CI_V1, ...) to the Dyno listeners, once per MUT
+frame, so they reach telemetry, step statistics and the interlock like any measured channel.
+
+written by:
+    - Daniel Muir
+"""
+
+import math
+import threading
+from time import time
+
+# Starting guesses, the Tests captures give Kt = Ke = 0.0496 (see VDyno.analysis.brake_envelope.RIG_TORQUE_CONSTANT)
+INITIAL_TORQUE_CONSTANT = 0.0496  # Nm/A
+INITIAL_RESISTANCE = 0.05  # ohm
+DEFAULT_BUS_VOLTAGE = 24.0  # V, assumed until a Status_InputVoltage frame is seen
+FORGETTING = 0.999  # weight kept by past frames per update, about a 1000 frame memory
+MAX_COVARIANCE = 1e4  # stop forgetting past this, so the covariance can't wind up during weak excitation
+MIN_CURRENT = 1.0  # A, below this frames don't say much about Kt or R
+MIN_SPEED = 50.0  # rpm, below this frames don't say much about Ke
+PAIR_WINDOW = 0.05  # s, longest gap between a torque frame and the MUT current it is paired with
+Z_95 = 1.959964
+
+
+class RecursiveLeastSquares:
+    """y = a * x1 + b * x2, fitted with exponential forgetting. Written out for two parameters to stay in plain floats."""
+
+    def __init__(
+        self, a: float, b: float, forgetting: float = FORGETTING, initial_covariance: float = 100.0
+    ) -> None:
+        self.a = a
+        self.b = b
+        self.forgetting = forgetting
+        self.p11 = self.p22 = initial_covariance
+        self.p12 = 0.0
+        self.residual_variance = 0.0
+        self.updates = 0
+
+    def update(self, x1: float, x2: float, y: float) -> None:
+        error = y - (self.a * x1 + self.b * x2)
+        # P x, and the gain k = P x / (lambda + x' P x)
+        px1 = self.p11 * x1 + self.p12 * x2
+        px2 = self.p12 * x1 + self.p22 * x2
+        lam = self.forgetting if self.p11 + self.p22 < MAX_COVARIANCE else 1.0
+        denominator = lam + x1 * px1 + x2 * px2
+        k1 = px1 / denominator
+        k2 = px2 / denominator
+        self.a += k1 * error
+        self.b += k2 * error
+        # P = (P - k x' P) / lambda, x' P is the transpose of P x as P is symmetric
+        self.p11 = (self.p11 - k1 * px1) / lam
+        self.p12 = (self.p12 - k1 * px2) / lam
+        self.p22 = (self.p22 - k2 * px2) / lam
+        self.updates += 1
+        weight = max(1.0 - self.forgetting, 1.0 / self.updates)
+        self.residual_variance += weight * (error * error - self.residual_variance)
+
+    def confidence(self) -> tuple:
+        """95% confidence half widths of a and b, infinite until there are enough updates to judge."""
+        if self.updates < 3:
+            return math.inf, math.inf
+        return (
+            Z_95 * math.sqrt(max(self.p11, 0.0) * self.residual_variance),
+            Z_95 * math.sqrt(max(self.p22, 0.0) * self.residual_variance),
+        )
+
+
+class ParameterEstimator:
+    def __init__(self, vesc_number: int = 1, bus_voltage: float = DEFAULT_BUS_VOLTAGE) -> None:
+        self.vesc_number = vesc_number
+        self.bus_voltage = bus_voltage  # V, assumed until voltage_measured
+        self.voltage_measured = False
+        self.torque_fit = RecursiveLeastSquares(INITIAL_TORQUE_CONSTANT, 0.0)
+        self.voltage_fit = RecursiveLeastSquares(INITIAL_RESISTANCE, INITIAL_TORQUE_CONSTANT)
+        self._keys = {
+            "rpm": f"Status_RPM_V{vesc_number}",
+            "current": f"Status_TotalCurrent_V{vesc_number}",
+            "duty": f"Status_DutyCycle_V{vesc_number}",
+            "voltage": f"Status_InputVoltage_V{vesc_number}",
+        }
+        self.status = {}
+        self.listeners = []
+        self._current = None  # (latest MUT current, its timestamp) for pairing with torque frames
+        self._lock = threading.Lock()
+        self._publish()
+
+    def add(self, status: dict, timestamp: float) -> None:
+        """Device listener on the MUT and torque transducer, runs on the acquisition threads."""
+        keys = self._keys
+        if keys["voltage"] in status:
+            with self._lock:
+                if not self.voltage_measured:
+                    # Fitted against the assumed voltage so far, start again from the initial guesses
+                    self.voltage_fit = RecursiveLeastSquares(INITIAL_RESISTANCE, INITIAL_TORQUE_CONSTANT)
+                    self.voltage_measured = True
+                self.bus_voltage = status[keys["voltage"]]
+            return
+        if "TorqueValue" in status:
+            with self._lock:
+                if self._current is not None and abs(timestamp - self._current[1]) < PAIR_WINDOW:
+                    current = abs(self._current[0])
+                    if current >= MIN_CURRENT:
+                        self.torque_fit.update(current, 1.0, abs(status["TorqueValue"]))
+            return
+        if keys["current"] not in status:
+            return
+        current = status[keys["current"]]
+        rpm = status.get(keys["rpm"], 0.0)
+        with self._lock:
+            self._current = (current, timestamp)
+            if abs(current) >= MIN_CURRENT or abs(rpm) >= MIN_SPEED:
+                voltage = status.get(keys["duty"], 0.0) / 100 * self.bus_voltage
+                self.voltage_fit.update(current, rpm * 2 * math.pi / 60, voltage)
+            self._publish()
+        derived = self.status
+        for listener in self.listeners:
+            listener(derived, timestamp)
+
+    def _publish(self) -> None:
+        kt_ci, _ = self.torque_fit.confidence()
+        r_ci, ke_ci = self.voltage_fit.confidence()
+        n = self.vesc_number
+        self.status = {
+            f"Estimate_Kt_V{n}": self.torque_fit.a,
+            f"Estimate_Kt_CI_V{n}": kt_ci,
+            f"Estimate_Ke_V{n}": self.voltage_fit.b,
+            f"Estimate_Ke_CI_V{n}": ke_ci,
+            f"Estimate_R_V{n}": self.voltage_fit.a,
+            f"Estimate_R_CI_V{n}": r_ci,
+            f"Estimate_VoltageAssumed_V{n}": 0.0 if self.voltage_measured else 1.0,
+        }
+
+    def summary(self) -> str:
+        status = self.status
+        n = self.vesc_number
+        return (
+            f"Motor {n} estimates: Kt {status[f'Estimate_Kt_V{n}']:.4f} +/- {status[f'Estimate_Kt_CI_V{n}']:.2g} Nm/A, "
+            f"Ke {status[f'Estimate_Ke_V{n}']:.4f} +/- {status[f'Estimate_Ke_CI_V{n}']:.2g} V s/rad, "
+            f"R {status[f'Estimate_R_V{n}']:.4f} +/- {status[f'Estimate_R_CI_V{n}']:.2g} ohm "
+            f"({self.torque_fit.updates} torque, {self.voltage_fit.updates} voltage frames)"
+            + ("" if self.voltage_measured else f", R and Ke unreliable: bus voltage assumed {self.bus_voltage:g} V")
+        )
+
+
+if __name__ == "__main__":
+    # Recover known constants from noisy synthetic frames
+    import random
+
+    estimator = ParameterEstimator()
+    kt, ke, resistance = 0.052, 0.048, 0.08
+    now = time()
+    estimator.add({"Status_InputVoltage_V1": DEFAULT_BUS_VOLTAGE}, now)
+    for frame in range(5000):
+        now += 0.005
+        current = 2 + 8 * random.random()
+        rpm = 500 + 4000 * random.random()
+        voltage = resistance * current + ke * rpm * 2 * math.pi / 60
+        duty = 100 * voltage / DEFAULT_BUS_VOLTAGE + random.gauss(0, 0.2)
+        estimator.add({"Status_RPM_V1": rpm, "Status_TotalCurrent_V1": current, "Status_DutyCycle_V1": duty}, now)
+        estimator.add({"TorqueValue": kt * current - 0.03 + random.gauss(0, 0.01)}, now + 0.001)
+    print(f"True: Kt {kt}, Ke {ke}, R {resistance}")
+    print(estimator.summary())
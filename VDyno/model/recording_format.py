@@ -0,0 +1,21 @@
+"""
+VDyno - A PyQT based GUI for the V-Dyno project.
+
+This code contains the layout of a recording, shared by the FileSaver that writes them (VDyno/presenter/file_saver.py) and
+the analysis and replay that read them back, so reading a recording doesn't pull in the presenter.
+A recording is a .csv whose first column, Time, is the wall clock time (s) each row was written, followed by the status
+channels. Its event channel is <recording>_events.csv, with the columns of EVENT_HEADER.
+
+written by:
+    - Daniel Muir
+"""
+
+import os
+
+TIME_KEY = "Time"
+RECORD_RATE_HZ = 40  # rows a second, replay.py assumes this for recordings without a Time column
+EVENT_HEADER = ["time", "row", "offset", "event", "step", "detail"]
+
+
+def events_path(recording_path: str) -> str:
+    return os.path.splitext(recording_path)[0] + "_events.csv"
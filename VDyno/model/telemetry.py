@@ -0,0 +1,355 @@
+"""
+VDyno - A PyQT based GUI for the V-Dyno project.
+
+This code contains the TelemetryPublisher, which streams calibrated samples from the Dyno to other programs over a
+local TCP or Unix socket, and TelemetryClient, a small client for them. Nothing is published unless a publisher is
+started (VDyno.py --telemetry / VDyno_headless.py --telemetry).
+
+The publisher listens to each device (Dyno.add_listener). The listener only appends to a bounded deque, so the
+acquisition loop never waits on a socket. A sender thread packs everything received each tick into one batch frame
+and offers it to every subscriber. Each subscriber has its own queue and writer thread and picks a policy on connect:
+    - drop-oldest: the default, when its queue is full the oldest batch is dropped and the next batch reports how
+      many were lost.
+    - backpressure: lossless, the writer waits on the socket (TCP flow control) and a subscriber that falls
+      queue_size batches behind is disconnected rather than silently losing samples.
+
+Wire format, little endian. After connecting the client sends one policy byte (b"D" or b"B"), the server answers with
+MAGIC and then frames of HEADER (frame type, payload length) followed by the payload:
+    - SCHEMA: JSON list of channel names, a channel's id is its index. Sent on connect and when new channels appear.
+    - BATCH: BATCH_HEADER (batches dropped before this one, sample count) then per sample SAMPLE_HEADER
+      (timestamp from time.time(), value count) and that many VALUE (channel id, float32 value).
+
+Address format: tcp:HOST:PORT or unix:PATH, e.g. tcp:127.0.0.1:5760. Use an SSH tunnel to reach it from another PC.
+
+Usage:
+    python -m VDyno.model.telemetry tcp:127.0.0.1:5760
+
+written by:
+    - Daniel Muir
+"""
+
+import argparse
+import json
+import os
+import socket
+import struct
+import sys
+import threading
+from collections import deque
+from time import monotonic
+
+DEFAULT_ADDRESS = "tcp:127.0.0.1:5760"
+MAGIC = b"VDYN\x01"
+HEADER = struct.Struct("<BI")
+BATCH_HEADER = struct.Struct("<IH")
+SAMPLE_HEADER = struct.Struct("<dH")
+VALUE = struct.Struct("<Hf")
+SCHEMA = 1
+BATCH = 2
+POLICIES = {b"D": "drop-oldest", b"B": "backpressure"}
+
+
+def parse_address(address: str) -> tuple:
+    """(socket family, socket address) for a tcp:HOST:PORT or unix:PATH address."""
+    kind, _, rest = address.partition(":")
+    if kind == "tcp":
+        host, _, port = rest.rpartition(":")
+        return socket.AF_INET, (host or "127.0.0.1", int(port))
+    if kind == "unix" and rest and hasattr(socket, "AF_UNIX"):
+        return socket.AF_UNIX, rest
+    raise ValueError(f"Telemetry address must be tcp:HOST:PORT or unix:PATH, not {address!r}")
+
+
+def frame(frame_type: int, payload: bytes) -> bytes:
+    return HEADER.pack(frame_type, len(payload)) + payload
+
+
+class _Subscriber:
+    """One connected client, written to from its own thread so a slow client only holds itself up."""
+
+    def __init__(self, connection: socket.socket, policy: str, queue_size: int, on_close) -> None:
+        self.connection = connection
+        self.policy = policy
+        self.queue_size = queue_size
+        self.frames = deque()
+        self.dropped = 0
+        self.closed = False
+        self._on_close = on_close
+        self._ready = threading.Condition()
+        self._thread = threading.Thread(target=self._write_loop, name="telemetry subscriber", daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def offer(self, frame_type: int, payload: bytes) -> None:
+        with self._ready:
+            if self.closed:
+                return
+            batches = sum(1 for kind, _ in self.frames if kind == BATCH)
+            if frame_type == BATCH and batches >= self.queue_size:
+                if self.policy == "backpressure":
+                    print(f"Telemetry subscriber fell {batches} batches behind, disconnecting it.")
+                    self.closed = True
+                    self._ready.notify()
+                    self._shutdown()
+                    return
+                # Drop the oldest batch, keeping any schema frames ahead of it
+                for index, (kind, _) in enumerate(self.frames):
+                    if kind == BATCH:
+                        del self.frames[index]
+                        break
+                self.dropped += 1
+            self.frames.append((frame_type, payload))
+            self._ready.notify()
+
+    def close(self) -> None:
+        with self._ready:
+            self.closed = True
+            self._ready.notify()
+        self._shutdown()
+
+    def _shutdown(self) -> None:
+        """Wake a writer blocked in sendall with an OSError, so it cleans up rather than waiting on the client."""
+        try:
+            self.connection.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass  # already closed by the writer
+
+    def _write_loop(self) -> None:
+        try:
+            self.connection.sendall(MAGIC)
+            while True:
+                with self._ready:
+                    while not self.frames and not self.closed:
+                        self._ready.wait()
+                    if self.closed:
+                        break
+                    frame_type, payload = self.frames.popleft()
+                    if frame_type == BATCH:
+                        # Patch in how many batches were dropped ahead of this one
+                        payload = BATCH_HEADER.pack(self.dropped, BATCH_HEADER.unpack_from(payload)[1]) + payload[
+                            BATCH_HEADER.size :
+                        ]
+                        self.dropped = 0
+                self.connection.sendall(frame(frame_type, payload))
+        except OSError:
+            pass
+        finally:
+            self.closed = True
+            self.connection.close()
+            self._on_close(self)
+
+
+class TelemetryPublisher:
+    def __init__(
+        self,
+        dyno: object,
+        address: str = DEFAULT_ADDRESS,
+        tick: float = 1 / 40,
+        queue_size: int = 200,
+        pending_limit: int = 10000,
+    ) -> None:
+        self.dyno = dyno
+        self.address = address
+        self.tick = tick
+        self.queue_size = queue_size
+        self.channels = {}  # channel name: id
+        self.samples_dropped = 0  # samples lost because the sender thread fell behind
+        self._pending = deque(maxlen=pending_limit)
+        self._subscribers = []
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._server = None
+        self._threads = []
+
+    def on_sample(self, status: dict, timestamp: float) -> None:
+        """Device listener, called on the acquisition threads. Must stay cheap."""
+        if not self._subscribers:
+            return
+        if len(self._pending) == self._pending.maxlen:
+            self.samples_dropped += 1
+        self._pending.append((timestamp, status))
+
+    def start(self) -> None:
+        family, address = parse_address(self.address)
+        if family != socket.AF_INET and os.path.exists(address):
+            os.unlink(address)  # stale socket file from an earlier run
+        self._server = socket.socket(family, socket.SOCK_STREAM)
+        if family == socket.AF_INET:
+            self._server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._server.bind(address)
+        self._server.listen()
+        self._server.settimeout(0.5)
+        self._stop.clear()
+        for target, name in ((self._accept_loop, "telemetry accept"), (self._send_loop, "telemetry sender")):
+            thread = threading.Thread(target=target, name=name, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        self.dyno.add_listener(self.on_sample)
+        print(f"Publishing telemetry on {self.address}")
+
+    def stop(self) -> None:
+        self.dyno.remove_listener(self.on_sample)
+        self._stop.set()
+        for thread in self._threads:
+            thread.join(timeout=1.0)
+        self._threads.clear()
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscriber in subscribers:
+            subscriber.close()
+        if self._server is not None:
+            self._server.close()
+            family, address = parse_address(self.address)
+            if family != socket.AF_INET and os.path.exists(address):
+                os.unlink(address)
+            self._server = None
+
+    @property
+    def subscriber_count(self) -> int:
+        return len(self._subscribers)
+
+    def _remove(self, subscriber: _Subscriber) -> None:
+        with self._lock:
+            if subscriber in self._subscribers:
+                self._subscribers.remove(subscriber)
+
+    def _schema_payload(self) -> bytes:
+        return json.dumps(list(self.channels)).encode("utf-8")
+
+    def _accept_loop(self) -> None:
+        while not self._stop.is_set():
+            try:
+                connection, _ = self._server.accept()
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+            connection.settimeout(1.0)
+            try:
+                policy = POLICIES.get(connection.recv(1), "drop-oldest")
+            except OSError:
+                policy = "drop-oldest"
+            connection.settimeout(None)
+            subscriber = _Subscriber(connection, policy, self.queue_size, self._remove)
+            with self._lock:
+                subscriber.offer(SCHEMA, self._schema_payload())
+                self._subscribers.append(subscriber)
+            subscriber.start()
+            print(f"Telemetry subscriber connected ({policy}), {self.subscriber_count} in total")
+
+    def _encode_batch(self, samples: list) -> tuple:
+        """BATCH payload for samples, and whether new channels were added to the schema."""
+        schema_changed = False
+        parts = [BATCH_HEADER.pack(0, len(samples))]
+        for timestamp, status in samples:
+            parts.append(SAMPLE_HEADER.pack(timestamp, len(status)))
+            for name, value in status.items():
+                channel = self.channels.get(name)
+                if channel is None:
+                    channel = self.channels[name] = len(self.channels)
+                    schema_changed = True
+                parts.append(VALUE.pack(channel, value))
+        return b"".join(parts), schema_changed
+
+    def _send_loop(self) -> None:
+        deadline = monotonic()
+        while not self._stop.is_set():
+            deadline += self.tick
+            self._stop.wait(max(0.0, deadline - monotonic()))
+            samples = []
+            while self._pending and len(samples) < 0xFFFF:
+                samples.append(self._pending.popleft())
+            if not samples:
+                continue
+            payload, schema_changed = self._encode_batch(samples)
+            with self._lock:
+                subscribers = list(self._subscribers)
+                schema = self._schema_payload() if schema_changed else None
+            for subscriber in subscribers:
+                if schema is not None:
+                    subscriber.offer(SCHEMA, schema)
+                subscriber.offer(BATCH, payload)
+
+
+class TelemetryClient:
+    """Reads samples from a TelemetryPublisher. Only needs the standard library."""
+
+    def __init__(self, address: str = DEFAULT_ADDRESS, policy: str = "drop-oldest") -> None:
+        family, socket_address = parse_address(address)
+        self.channels = []
+        self.batches_dropped = 0
+        self._socket = socket.socket(family, socket.SOCK_STREAM)
+        self._socket.connect(socket_address)
+        self._socket.sendall(b"B" if policy == "backpressure" else b"D")
+        self._file = self._socket.makefile("rb")
+        if self._file.read(len(MAGIC)) != MAGIC:
+            raise ConnectionError(f"{address} is not a VDyno telemetry publisher")
+
+    def close(self) -> None:
+        self._file.close()
+        self._socket.close()
+
+    def __enter__(self) -> "TelemetryClient":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def _read(self, size: int) -> bytes:
+        data = self._file.read(size)
+        if len(data) < size:
+            raise ConnectionError("Telemetry publisher closed the connection")
+        return data
+
+    def batches(self):
+        """Yield each batch as a list of (timestamp, {channel name: value}) samples."""
+        while True:
+            frame_type, length = HEADER.unpack(self._read(HEADER.size))
+            payload = self._read(length)
+            if frame_type == SCHEMA:
+                self.channels = json.loads(payload.decode("utf-8"))
+                continue
+            if frame_type != BATCH:
+                continue
+            dropped, count = BATCH_HEADER.unpack_from(payload)
+            self.batches_dropped += dropped
+            offset = BATCH_HEADER.size
+            samples = []
+            for _ in range(count):
+                timestamp, values = SAMPLE_HEADER.unpack_from(payload, offset)
+                offset += SAMPLE_HEADER.size
+                status = {}
+                for channel, value in VALUE.iter_unpack(payload[offset : offset + values * VALUE.size]):
+                    status[self.channels[channel]] = value
+                offset += values * VALUE.size
+                samples.append((timestamp, status))
+            yield samples
+
+    def samples(self):
+        """Yield (timestamp, {channel name: value}) for every sample received."""
+        for batch in self.batches():
+            yield from batch
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Print samples from a running VDyno telemetry publisher.")
+    parser.add_argument("address", nargs="?", default=DEFAULT_ADDRESS, help="tcp:HOST:PORT or unix:PATH")
+    parser.add_argument("--policy", choices=["drop-oldest", "backpressure"], default="drop-oldest")
+    args = parser.parse_args(argv)
+
+    try:
+        with TelemetryClient(args.address, args.policy) as client:
+            for timestamp, status in client.samples():
+                values = ", ".join(f"{name} {value:.3f}" for name, value in status.items())
+                print(f"{timestamp:.3f}  {values}", flush=True)
+    except KeyboardInterrupt:
+        return 0
+    except (OSError, ConnectionError) as e:
+        print(f"Error: {e}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
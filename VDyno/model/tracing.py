@@ -0,0 +1,128 @@
+"""
+VDyno - A PyQT based GUI for the V-Dyno project.
+
+This code contains a lightweight tracer for the hot paths: CAN receive/decode, control ticks, record writes and plot updates.
+Spans are kept in a fixed size ring buffer and can be saved at any time as Chrome trace JSON,
+which opens in chrome://tracing or https://ui.perfetto.dev with one row per thread.
+Tracing is off by default. While off, a traced function costs one extra call and a flag check.
+
+Usage:
+    from VDyno.model.tracing import tracer, traced
+
+    @traced("control tick", "control")
+    def control_motors(self): ...
+
+    tracer.enable()
+    tracer.dump("trace.json")
+
+written by:
+    - Daniel Muir
+"""
+
+import json
+import os
+import threading
+from collections import deque
+from contextlib import contextmanager, nullcontext
+from functools import wraps
+from time import perf_counter_ns
+
+_NULL_SPAN = nullcontext()
+
+
+class TraceRecorder:
+    """Ring buffer of completed spans and counter samples. Appending to a deque is thread safe."""
+
+    def __init__(self, capacity: int = 200_000) -> None:
+        self.enabled = False
+        self._events = deque(maxlen=capacity)
+        self._thread_names = {}
+
+    def enable(self) -> None:
+        self.enabled = True
+
+    def disable(self) -> None:
+        self.enabled = False
+
+    def clear(self) -> None:
+        self._events.clear()
+
+    def add_span(self, name: str, category: str, start_ns: int, end_ns: int) -> None:
+        thread = threading.current_thread()
+        self._thread_names[thread.ident] = thread.name
+        self._events.append(("X", name, category, start_ns, end_ns - start_ns, thread.ident))
+
+    def counter(self, name: str, value: float) -> None:
+        """Record a value over time, e.g. how late a timer fired."""
+        if self.enabled:
+            self._events.append(("C", name, "counter", perf_counter_ns(), value, 0))
+
+    def span(self, name: str, category: str = "vdyno"):
+        """Context manager timing a block. Returns a shared no-op context while disabled."""
+        if not self.enabled:
+            return _NULL_SPAN
+        return self._span(name, category)
+
+    @contextmanager
+    def _span(self, name: str, category: str):
+        start = perf_counter_ns()
+        try:
+            yield
+        finally:
+            self.add_span(name, category, start, perf_counter_ns())
+
+    def chrome_trace(self) -> dict:
+        """The buffered events in Chrome trace event format (timestamps in microseconds)."""
+        pid = os.getpid()
+        events = [
+            {"name": "thread_name", "ph": "M", "pid": pid, "tid": tid, "args": {"name": name}}
+            for tid, name in list(self._thread_names.items())
+        ]
+        for phase, name, category, start_ns, value, tid in list(self._events):
+            if phase == "X":
+                events.append(
+                    {
+                        "name": name,
+                        "cat": category,
+                        "ph": "X",
+                        "ts": start_ns / 1000,
+                        "dur": value / 1000,
+                        "pid": pid,
+                        "tid": tid,
+                    }
+                )
+            else:
+                events.append(
+                    {"name": name, "ph": "C", "ts": start_ns / 1000, "pid": pid, "args": {"value": value}}
+                )
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def dump(self, file_path: str) -> int:
+        """Write the buffer as Chrome trace JSON, returning the number of events written."""
+        trace = self.chrome_trace()
+        with open(file_path, mode="w", encoding="utf-8") as file:
+            json.dump(trace, file)
+        print(f"Trace with {len(trace['traceEvents'])} events saved to {file_path}")
+        return len(trace["traceEvents"])
+
+
+tracer = TraceRecorder()
+
+
+def traced(name: str, category: str = "vdyno"):
+    """Decorator recording a span for every call while the tracer is enabled."""
+
+    def decorate(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not tracer.enabled:
+                return fn(*args, **kwargs)
+            start = perf_counter_ns()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                tracer.add_span(name, category, start, perf_counter_ns())
+
+        return wrapper
+
+    return decorate
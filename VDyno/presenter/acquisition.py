@@ -0,0 +1,126 @@
+"""
+VDyno - A PyQT based GUI for the V-Dyno project.
+
+This code contains the AcquisitionEngine class, which feeds the devices of one or more Dynos with their status frames.
+Instead of a polling thread per device, each receiver's receive() (the devices and the bus voltage) is subscribed to its rig's CAN bus, so frames are decoded,
+calibrated and passed to the listeners on the bus reader thread as they arrive. A rig's cost is then the frames it sends,
+not a set of threads waking at ACQUISITION_RATE_HZ whether a frame came or not.
+
+Handlers without a reader thread (dummy_can_handler) are polled instead, all from one shared thread at ACQUISITION_RATE_HZ,
+so adding dummy rigs adds work to that thread rather than more threads.
+
+written by:
+    - Daniel Muir
+"""
+
+import os
+import sys
+import threading
+import traceback
+
+if __name__ == "__main__":
+    sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
+
+from VDyno.presenter.pacing import ACQUISITION_RATE_HZ, Ticker
+
+
+class AcquisitionEngine:
+    def __init__(self, rate_hz: float = ACQUISITION_RATE_HZ) -> None:
+        self.rate_hz = rate_hz
+        self.dynos = []
+        self.frames = {}  # rig label: frames received, kept after the rig is removed
+        self._subscriptions = {}  # id(dyno): [(message name, callback)]
+        self.ticker = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def add(self, dyno: object) -> None:
+        """Start receiving a connected dyno's status frames. Adding a dyno twice does nothing."""
+        if dyno.can_server is None:
+            raise ValueError(f"{self._label(dyno)} is not connected")
+        with self._lock:
+            if dyno in self.dynos:
+                return
+            self.dynos.append(dyno)
+            self.frames.setdefault(self._label(dyno), 0)
+            self._subscriptions[id(dyno)] = [(device.message_name, self._receiver(dyno, device)) for device in dyno.receivers]
+        for message_name, callback in self._subscriptions[id(dyno)]:
+            dyno.can_server.subscribe(message_name, callback)
+        if hasattr(dyno.can_server, "poll"):
+            self.start()
+
+    def remove(self, dyno: object) -> None:
+        """Stop receiving a dyno's frames, e.g. while a recording is replayed into it."""
+        with self._lock:
+            if dyno not in self.dynos:
+                return
+            self.dynos.remove(dyno)
+            subscriptions = self._subscriptions.pop(id(dyno))
+        if dyno.can_server is not None:
+            for message_name, callback in subscriptions:
+                dyno.can_server.unsubscribe(message_name, callback)
+
+    def _receiver(self, dyno: object, device: object):
+        key = self._label(dyno)
+        receive = device.receive
+
+        def on_frame(signals: dict) -> None:
+            self.frames[key] += 1
+            receive(signals)
+
+        return on_frame
+
+    def start(self) -> None:
+        """Start the shared poll thread, if it isn't running."""
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self.ticker = Ticker(self.rate_hz, "acquisition poll")
+        self._thread = threading.Thread(target=self._poll, name="acquisition poll", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=1.0)
+            self._thread = None
+
+    def _poll(self) -> None:
+        while not self._stop.is_set():
+            with self._lock:
+                dynos = list(self.dynos)
+            for dyno in dynos:
+                handler = dyno.can_server
+                if handler is None or not hasattr(handler, "poll"):
+                    continue
+                try:
+                    handler.poll()
+                except Exception as e:
+                    print(f"Error polling {self._label(dyno)}: {e}")
+                    traceback.print_exc()
+            self.ticker.wait(self._stop)
+
+    @staticmethod
+    def _label(dyno: object) -> str:
+        return f"rig {dyno.name}" if getattr(dyno, "name", None) else "the dyno"
+
+    def summary(self) -> str:
+        counts = ", ".join(f"{label} {frames}" for label, frames in self.frames.items())
+        return f"acquisition: frames received from {counts or 'no rigs'}"
+
+
+if __name__ == "__main__":
+    # Feed three dummy rigs from one engine and count their frames
+    from time import sleep
+
+    from VDyno.model.dyno import Dyno
+
+    engine = AcquisitionEngine()
+    rigs = [Dyno(port=f"dummy{n}", name=f"rig{n}") for n in range(3)]
+    for rig in rigs:
+        engine.add(rig)
+    sleep(1.0)
+    print(engine.summary())
+    print(f"{threading.active_count()} threads running")
+    engine.stop()
@@ -0,0 +1,144 @@
+"""
+VDyno - A PyQT based GUI for the V-Dyno project.
+
+This code contains the CommandMailbox class, which carries setpoints from whoever sets them to the control loop.
+The Manual Control spin boxes (GUI thread), the experiment (a pool thread) and the interlock (an acquisition thread) post
+to it, and the control loop takes the latest value of every channel once per tick. A burst of posts between two ticks,
+such as holding an arrow key on a spin box, is coalesced into the one value the next tick sends and logs.
+
+Channels are MUT_current (A), load_rpm and torque ((Nm or None, actuator)). Every post records its source, and a source
+can't overwrite a channel held by a higher priority one:
+    - interlock: zeroes every channel on a trip and holds them until the interlock is reset,
+    - manual: the operator overrides the experiment until Manual Control is unticked,
+    - experiment: the lowest, it never blocks anyone.
+
+Posts take a lock among themselves. The control loop never does: each post publishes a new immutable dict of commands by
+swapping one reference, and take() only reads that reference. There must be a single taker.
+
+written by:
+    - Daniel Muir
+"""
+
+import threading
+from typing import NamedTuple
+
+MANUAL = "manual"
+EXPERIMENT = "experiment"
+INTERLOCK = "interlock"
+PRIORITY = {EXPERIMENT: 0, MANUAL: 1, INTERLOCK: 2}
+
+ZERO = {"MUT_current": 0, "load_rpm": 0, "torque": (None, "MUT")}
+
+
+class Command(NamedTuple):
+    value: object
+    source: str | None  # None for the starting values and after reset()
+    sequence: int  # bumped by every accepted post, so the taker can tell what changed
+
+
+class CommandMailbox:
+    def __init__(self) -> None:
+        self._commands = {channel: Command(value, None, 0) for channel, value in ZERO.items()}
+        self._holders = {}  # channel: source whose priority other posts are checked against
+        self._sequence = 0
+        self._taken = {channel: 0 for channel in ZERO}  # sequence of each channel's last taken command, taker only
+        self._lock = threading.Lock()  # between posters only
+        self.posted = 0
+        self.rejected = 0
+        self.applied = 0  # changes handed to the taker, posted - applied were coalesced away
+
+    @property
+    def commands(self) -> dict:
+        """The latest command of every channel."""
+        return self._commands
+
+    def value(self, channel: str) -> object:
+        return self._commands[channel].value
+
+    def post(self, channel: str, value: object, source: str) -> bool:
+        """Set a channel from any thread. Returns False if a higher priority source holds it."""
+        return self.post_many({channel: value}, source) == [channel]
+
+    def post_many(self, values: dict, source: str) -> list:
+        """Set several channels at once, so the taker never sees half of them. Returns the channels accepted."""
+        accepted = []
+        with self._lock:
+            commands = dict(self._commands)
+            for channel, value in values.items():
+                holder = self._holders.get(channel)
+                if holder is not None and PRIORITY[source] < PRIORITY[holder]:
+                    self.rejected += 1
+                    continue
+                self._sequence += 1
+                commands[channel] = Command(value, source, self._sequence)
+                self._holders[channel] = source
+                accepted.append(channel)
+            self.posted += len(accepted)
+            self._commands = commands  # the one reference take() reads
+        return accepted
+
+    def zero(self, source: str) -> list:
+        return self.post_many(ZERO, source)
+
+    def release(self, source: str) -> None:
+        """Let lower priority sources post again to the channels source holds. The values stay as they are."""
+        with self._lock:
+            for channel in [channel for channel, holder in self._holders.items() if holder == source]:
+                del self._holders[channel]
+
+    def reset(self) -> None:
+        """Zero every channel and release every hold."""
+        with self._lock:
+            self._holders.clear()
+            commands = {}
+            for channel, value in ZERO.items():
+                self._sequence += 1
+                commands[channel] = Command(value, None, self._sequence)
+            self._commands = commands
+
+    def take(self) -> tuple:
+        """(latest command of every channel, [(channel, command)] changed since the last take). For the control loop only."""
+        commands = self._commands
+        changed = [(channel, command) for channel, command in commands.items() if command.sequence != self._taken[channel]]
+        for channel, command in changed:
+            self._taken[channel] = command.sequence
+        self.applied += len(changed)
+        return commands, changed
+
+    def summary(self) -> str:
+        return (
+            f"commands: {self.posted} posted, {self.applied} applied "
+            f"({max(0, self.posted - self.applied)} coalesced), {self.rejected} rejected by priority"
+        )
+
+
+if __name__ == "__main__":
+    # An arrow key held on the MUT current box for a second posts ~500 values, a 200 Hz control loop applies 200
+    from time import perf_counter, sleep
+
+    mailbox = CommandMailbox()
+    stop = threading.Event()
+
+    def hold_arrow_key() -> None:
+        value = 0.0
+        while not stop.is_set():
+            value = round(value + 0.1, 1)
+            mailbox.post("MUT_current", value, MANUAL)
+            sleep(0.002)
+
+    thread = threading.Thread(target=hold_arrow_key)
+    thread.start()
+    sent = 0
+    started = perf_counter()
+    while perf_counter() - started < 1.0:
+        commands, changed = mailbox.take()
+        sent += 1
+        sleep(0.005)
+    stop.set()
+    thread.join()
+    print(f"{sent} ticks sent one command each, {mailbox.summary()}")
+    print("Experiment post while manual holds:", mailbox.post("MUT_current", 1.0, EXPERIMENT))
+    mailbox.zero(INTERLOCK)
+    print("Manual post after a trip:", mailbox.post("MUT_current", 1.0, MANUAL))
+    mailbox.release(INTERLOCK)
+    print("Manual post once the interlock is released:", mailbox.post("MUT_current", 1.0, MANUAL))
@@ -3,9 +3,12 @@ VDyno - A PyQT based GUI for the V-Dyno project.
 
 This code is the Presenter part of MVP architecture, handling the logic and data flow between the mainWindow and dyno class.
 It call on additional functionality in TestAutomator and FileSaver.
+Status frames reach the devices through an AcquisitionEngine and recordings are written by a Recorder, both of which can be
+shared with other rigs in the same process (see acquisition.py). The control loop is the rig's own, and takes its setpoints
+from a CommandMailbox that the manual controls, the experiment and the interlock post to (see command_mailbox.py).
 Primarily, it handles the threading, allowing for responsive UI. The rate of data collection, control commands can be modified here.
-
-Threading is handled by QThreadPool, built using a tutorial avaliable by PythonGUIs.com: https://www.pythonguis.com/tutorials/multithreading-pyqt-applications-qthreadpool/
+Background tasks (connecting, the control loop, experiments) are started and stopped through a Supervisor, which won't run
+two of the same task and waits for them on shutdown, see supervisor.py.
 
 written by:
     - Daniel Muir
@@ -13,19 +16,31 @@ written by:
 
 from __future__ import annotations
 from typing import Protocol
-from PyQt6.QtCore import QObject, pyqtSignal, pyqtSlot, QThreadPool, QRunnable, QTimer
+from PyQt6.QtCore import QThreadPool, QTimer
 from PyQt6.QtWidgets import QApplication
+import math
 import os
 import sys
-import traceback
-from time import sleep
+import threading
+from time import perf_counter
 
 if __name__ == "__main__":
     sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
 
 from VDyno.model.dyno import Dyno
+from VDyno.model.interlock import Interlock
 from VDyno.presenter.test_automator import TestAutomator
-from VDyno.presenter.file_saver import FileSaver
+from VDyno.presenter.acquisition import AcquisitionEngine
+from VDyno.presenter.command_mailbox import EXPERIMENT, INTERLOCK, MANUAL, CommandMailbox
+from VDyno.presenter.file_saver import FileSaver, Recorder
+from VDyno.presenter.replay import Replayer
+from VDyno.presenter.spectrum import TorqueSpectrum, pole_pairs_from_calibration
+from VDyno.presenter.step_statistics import StepStatistics, summary_path
+from VDyno.presenter.startup_profiler import StartupProfiler
+from VDyno.presenter.supervisor import InfiniteWorker, Supervisor, Worker, WorkerSignals
+from VDyno.model.tracing import tracer
+from VDyno.presenter.pacing import CONTROL_RATE_HZ, Ticker
+from VDyno.presenter.torque_control import TorqueControl
 
 
 class View(Protocol):
@@ -34,100 +49,22 @@ class View(Protocol):
     def selected_experiment(self) -> str: ...
 
 
-class WorkerSignals(QObject):
-    finished = pyqtSignal()
-    error = pyqtSignal(tuple)
-    result = pyqtSignal(object)
-    progress = pyqtSignal(int)
-    stop = pyqtSignal()
-
-
-class Worker(QRunnable):
-    """
-    Worker thread
-
-    Inherits from QRunnable to handler worker thread setup, signals and wrap-up.
-
-    :param callback: The function callback to run on this worker thread. Supplied args and
-                     kwargs will be passed through to the runner.
-    :type callback: function
-    :param args: Arguments to pass to the callback function
-    :param kwargs: Keywords to pass to the callback function
-
-    """
-
-    def __init__(self, fn, *args, **kwargs):
-        super().__init__()
-
-        # Store constructor arguments (re-used for processing)
-        self.fn = fn
-        self._args = args
-        self._kwargs = kwargs
-        self.signals = WorkerSignals()
-
-        # Add the callback to our kwargs
-        # .kwargs["progress_callback"] = self.signals.progress
-
-    @pyqtSlot()
-    def run(self):
-        """
-        Initialise the runner function with passed args, kwargs.
-        """
-
-        # Retrieve args/kwargs here; and fire processing using them
-        try:
-            result = self.fn(*self._args, **self._kwargs)
-        except Exception as e:
-            print("Error in worker thread: %s" % e)
-            traceback.print_exc()
-            exctype, value = sys.exc_info()[:2]
-            self.signals.error.emit((exctype, value, traceback.format_exc()))
-        else:
-            self.signals.result.emit(result)  # Return the result of the processing
-        finally:
-            self.signals.finished.emit()  # Done
-
-    def stop(self):
-        print("Stopping worker thread...")
-        if "stop" in self._kwargs:
-            self._kwargs["stop"] = True
-
-
-class InfiniteWorker(QRunnable):
-    def __init__(self, fn, *args, **kwargs):
-        super().__init__()
-        self.fn = fn
-        self._args = args
-        self._kwargs = kwargs
-        self.signals = WorkerSignals()
-
-        self.running = True  # Add a running flag
-
-    @pyqtSlot()
-    def run(self):
-        """Run the worker function."""
-        while self.running:  # Check the running flag
-            try:
-                self.fn(*self._args, **self._kwargs)
-            except Exception as e:
-                print(f"Error in worker thread: {e}")
-                traceback.print_exc()
-                exctype, value = sys.exc_info()[:2]
-                self.signals.error.emit((exctype, value, traceback.format_exc()))
-
-    def stop(self):
-        """Stop the worker thread."""
-        if "stop" in self._kwargs:
-            self._kwargs["stop"] = True
-        self.running = False  # Set the running flag to False
-        # If the function supports a stop mechanism, pass the stop flag
-
-
 class Presenter:
-    def __init__(self, dyno: Dyno, view: View, app: QApplication) -> None:
+    def __init__(
+        self,
+        dyno: Dyno,
+        view: View,
+        app: QApplication,
+        profiler: StartupProfiler | None = None,
+        acquisition: AcquisitionEngine | None = None,
+        recorder: Recorder | None = None,
+    ) -> None:
         self.dyno = dyno
+        self.acquisition = acquisition or AcquisitionEngine()
+        self.recorder = recorder or Recorder()
         self.view = view
         self.app = app
+        self.profiler = profiler or StartupProfiler()
         self.motor_keys = [
             "Status_RPM_V",
             "Status_TotalCurrent_V",
@@ -137,21 +74,55 @@ class Presenter:
         self.MUT_key = 0
         self.load_motor_key = 0
         self.transducer_key = 0
-        self.desired_MUT_current = 0
-        self.desired_load_rpm = 0
+        self.commands = CommandMailbox()
+        self.plot_interval_ms = 1000 // 30
+        self._last_plot_tick = None
+        self.torque_control = TorqueControl()
+        self.control_ticker = Ticker(CONTROL_RATE_HZ, "control loop")
+        self.automator = None
+        self.recording = None
+        self._recording_lock = threading.Lock()  # an experiment's recording is closed from its worker's finished signal
+        self.spectrum = None  # created when the spectrum view is first opened
+        self.replayer = None
+        self.replay_interlock = None
+        self.replay_trips = []  # (seconds into the recording, reason) the interlock would have tripped during replay
+        self.interlock = Interlock(dyno)
+        # Trips are detected on the acquisition threads, the signal brings them to the GUI thread
+        self.interlock_signals = WorkerSignals()
+        self.interlock_signals.result.connect(self._on_interlock_trip)
+        self.interlock.on_trip.append(self.interlock_signals.result.emit)
+        # Logged from the thread that tripped, so the event time is as close to the fault as the motor stop
+        self.interlock.on_trip.append(lambda reason: self.log_event("interlock_trip", reason=reason))
+        # Zeroed from the thread that tripped too, and held until reset so nothing restarts the motors
+        self.interlock.on_trip.append(lambda reason: self.commands.zero(INTERLOCK))
         self.threadpool = QThreadPool()
-        self.workers = []  # Keep track of all Worker instances
+        self.supervisor = Supervisor(self.threadpool)
         self.timer = QTimer()  # Create a QTimer for periodic updates
         self.timer.timeout.connect(
             self.update_plots
         )  # Connect the timer to the update method
 
-    def control_motors(self, blank=False, stop=False) -> None:
-        if stop is True:
-            return
-        self.dyno.MUT.set_current(self.desired_MUT_current)
-        self.dyno.load_motor.set_rpm(self.desired_load_rpm)
-        sleep(1 / 40)  # Sleep for a short duration to avoid busy waiting
+    def control_motors(self, stop: threading.Event | None = None) -> None:
+        with tracer.span("control tick", "control"):
+            commands, changed = self.commands.take()
+            for channel, command in changed:
+                if channel == "torque":
+                    self.torque_control.set_setpoint(*command.value)
+                if command.source == MANUAL:
+                    # One event per tick however fast the box was changed, with the value actually sent
+                    self.log_event("manual_setpoint", **{channel: command.value})
+            self.torque_control.tick(
+                self.dyno, commands["MUT_current"].value, commands["load_rpm"].value, self.control_ticker.period
+            )
+        self.control_ticker.wait(stop)  # fixed rate, see pacing.py
+
+    def post_command(self, channel: str, value: object, source: str = EXPERIMENT) -> bool:
+        """Set a setpoint for the next control tick, see command_mailbox.py. False if a higher priority source holds it."""
+        return self.commands.post(channel, value, source)
+
+    def release_manual_control(self) -> None:
+        """Manual Control was unticked, let the experiment set the setpoints again."""
+        self.commands.release(MANUAL)
 
     def plot_MUT_changed(self, key: int) -> None:
         self.MUT_key = key
@@ -162,71 +133,232 @@ class Presenter:
     def plot_TT_changed(self, key: int) -> None:
         self.transducer_key = key
 
-    def object_updater(self, monitor_object: object, stop=False) -> None:
-        if stop is True:
-            return
-        monitor_object.update_status()
-        sleep(1 / 40)
-
     def update_plots(self) -> None:
         """Update the plots with the latest data."""
-        self.view.live_plot.update()
+        if tracer.enabled:
+            now = perf_counter()
+            if self._last_plot_tick is not None:
+                late = (now - self._last_plot_tick) * 1000 - self.plot_interval_ms
+                tracer.counter("plot timer lateness (ms)", late)
+            self._last_plot_tick = now
+        if self.view.live_plot is not None:
+            self.view.live_plot.update()
 
     def thread_complete(self):
         print("THREAD COMPLETE!")
 
     def start_monitor_thread(self):
-        """Start monitoring threads."""
-        # Create workers
-        MUT_worker = InfiniteWorker(self.object_updater, self.dyno.MUT)
-        load_worker = InfiniteWorker(self.object_updater, self.dyno.load_motor)
-        TT_worker = InfiniteWorker(self.object_updater, self.dyno.torque_transducer)
-        control_worker = InfiniteWorker(self.control_motors)
-
-        # Keep track of workers
-        self.workers.extend([MUT_worker, load_worker, TT_worker, control_worker])
-
-        # Start workers
-        self.threadpool.start(MUT_worker)
-        self.threadpool.start(load_worker)
-        self.threadpool.start(TT_worker)
-        self.threadpool.start(control_worker)
-
-    def start_control_thread(self) -> None:
-        """Start the control thread."""
-        # Create a worker for the control thread
-        control_worker = Worker(self.dyno.control_loop)
-        self.workers.append(control_worker)
-        self.threadpool.start(control_worker)
+        """Start receiving status frames and the control thread."""
+        self.acquisition.add(self.dyno)
+        self.supervisor.start("control loop", InfiniteWorker(self.control_motors, stop=None))
 
     def start_record_thread(self) -> None:
         """Start the recording thread."""
+        if not self.dyno.connected:
+            print("Cannot start recording: CAN bus not connected yet.")
+            return
+        if self.replayer is not None:
+            print("Cannot start recording: a recording is being replayed.")
+            return
+        if self.recording is not None:
+            print(f"Already recording to {self.recording.file_path}.")
+            return
         print("Starting recording thread...")
         recording = FileSaver(self.dyno)
         recording.open()
-        record_worker = InfiniteWorker(recording.record)
-        self.workers.append(record_worker)
-        self.threadpool.start(record_worker)
-        print(self.workers)
+        self.recording = recording
+        self.recorder.add(recording)
+
+    def stop_recording(self) -> None:
+        """Close the recording, if recording, so a new one or a replay can start."""
+        with self._recording_lock:
+            recording, self.recording = self.recording, None
+        if recording is None:
+            return
+        self.recorder.remove(recording)
+        recording.close()
+        print(f"Recording saved to {recording.file_path}.")
 
     def start_plots(self) -> None:
         """Start updating the plots."""
-        self.timer.start(1000 // 30)  # Update at 30 FPS (1000 ms / 30)
+        # Samples the plots at 30 FPS (1000 ms / 30), PlotWindow sends frames only as fast as the plot process keeps up
+        self.timer.start(self.plot_interval_ms)
+
+    def start_subsystems(self) -> None:
+        """Called once the window has painted: load the plots, then open the CAN bus in the background."""
+        self.profiler.mark("window shown")
+        self.view.load_live_plot()
+        self.profiler.mark("live plot ready")
+        self.start_plots()
+        if self.dyno.connected:
+            self._on_connected()
+            return
+        connect_worker = Worker(self.dyno.connect)
+        connect_worker.signals.finished.connect(self._on_connected)
+        self.supervisor.start("CAN connect", connect_worker)
+
+    def _on_connected(self) -> None:
+        if not self.dyno.connected:
+            print("CAN bus could not be opened, see the error above.")
+            return
+        self.profiler.mark("CAN connected")
+        if self.replayer is not None:
+            return  # stop_replay starts the interlock and monitor threads
+        self.interlock.start()
+        self.start_monitor_thread()
 
     def start_experiment(self) -> None:
         """Start an experiment in a separate thread."""
-        # Check if the recording thread is active
-        if not any(isinstance(worker, InfiniteWorker) and worker.fn == FileSaver(self.dyno).record for worker in self.workers):
+        if not self.dyno.connected:
+            print("Cannot start experiment: CAN bus not connected yet.")
+            return
+        if self.replayer is not None:
+            print("Cannot start experiment: a recording is being replayed.")
+            return
+        if self.interlock.tripped:
+            print(f"Cannot start experiment: interlock tripped ({self.interlock.trip_reason}).")
+            return
+        if self.supervisor.running("experiment"):
+            print("Cannot start experiment: one is already running.")
+            return
+        # An experiment started while Manual Control is ticked takes over from it
+        self.commands.release(MANUAL)
+        # Experiments always record, to a recording of their own unless one was already started
+        own_recording = self.recording is None
+        if own_recording:
             self.start_record_thread()
 
         # Proceed with starting the experiment
         filename = f"VDyno/experiments/{self.view.selected_experiment}"
-        automator = TestAutomator(self.view)
-        experiment_worker = Worker(automator.start_experiment, filename)
-        self.workers.append(experiment_worker)
-        self.threadpool.start(experiment_worker)
+        self.automator = TestAutomator(self.view, self.dyno)
+        # One summary row per step, written next to the recording as each step ends
+        step_statistics = StepStatistics(self.dyno, summary_path(self.recording.file_path))
+        experiment_worker = Worker(
+            self.automator.start_experiment,
+            filename,
+            step_statistics=step_statistics,
+            events=self.recording.log_event,
+        )
+        if own_recording:
+            # Closed once the experiment has logged its last event, so the next experiment or a replay can start
+            experiment_worker.signals.finished.connect(self.stop_recording)
+        self.supervisor.start("experiment", experiment_worker, on_stop=self.automator.stop_experiment)
         print("Experiment thread setup complete.")
 
+    def log_event(self, event: str, step: int | None = None, **detail) -> None:
+        """Add an event to the recording's event channel, if recording."""
+        if self.recording is not None:
+            self.recording.log_event(event, step, **detail)
+
+    def _on_interlock_trip(self, reason: str) -> None:
+        """The motors are already stopped and the commands zeroed, stop the experiment too."""
+        self.supervisor.stop("experiment", timeout=0)  # on the GUI thread, so don't wait
+        self.view.show_interlock_trip(reason, self.interlock.reaction_times_ms[-1])
+
+    def reset_interlock(self) -> None:
+        self.commands.reset()
+        self.interlock.reset()
+        self.log_event("interlock_reset")
+
+    def torque_spectrum(self) -> TorqueSpectrum:
+        """The live torque spectrum, listening to the dyno from the first time it is asked for."""
+        if self.spectrum is None:
+            self.spectrum = TorqueSpectrum(pole_pairs_from_calibration(self.dyno.MUT.calibration))
+            self.dyno.add_listener(self.spectrum.add)
+        return self.spectrum
+
+    def start_replay(self, file_path: str) -> Replayer | None:
+        """
+        Replay a recording into the dyno in place of the rig, see VDyno/presenter/replay.py.
+
+        Acquisition, the control loop and the live interlock are paused and the motors are sent zero, so the replayed statuses
+        drive the plots, derived channels and spectrum. A separate interlock checks the replayed frames and only reports
+        where it would have tripped. Returns None if a replay can't start now.
+        """
+        if self.replayer is not None:
+            self.stop_replay()
+        if self.supervisor.running("experiment"):
+            print("Cannot replay: an experiment is running.")
+            return None
+        if self.interlock.tripped:
+            print(f"Cannot replay: interlock tripped ({self.interlock.trip_reason}), reset it first.")
+            return None
+        if self.recording is not None:
+            # The recorder would write the replayed statuses into the recording
+            print("Stopping the recording to replay.")
+            self.stop_recording()
+        replayer = Replayer(self.dyno, file_path)
+
+        self.commands.reset()
+        self.acquisition.remove(self.dyno)
+        self.supervisor.stop("control loop")  # so it can't send a setpoint after the zeros below
+        self.torque_control.set_setpoint(None)  # the stopped loop never took the reset, and nothing else ticks it now
+        if self.dyno.connected:
+            self.dyno.MUT.set_current(0)
+            self.dyno.load_motor.set_rpm(0)
+        self.interlock.stop()
+
+        # Recorded timestamps are in the past, so the stale check is off
+        self.replay_trips = []
+        self.replay_interlock = Interlock(self.dyno, stale_timeout=math.inf, watchdog_period=1.0)
+        self.replay_interlock.on_trip.append(
+            lambda reason: self.replay_trips.append((replayer.elapsed, reason))
+        )
+        replayer.on_seek.append(self.replay_interlock.reset)  # a seek isn't a rate of change, and re-arms after a trip
+        self.replay_interlock.start()
+        self.replayer = replayer
+        replayer.start()
+        print(f"Replaying {file_path}: {replayer.rows} rows, {replayer.duration:.1f} s.")
+        return replayer
+
+    def stop_replay(self) -> None:
+        """Stop replaying and hand the dyno back to the rig."""
+        if self.replayer is None:
+            return
+        self.replayer.stop()
+        self.replayer = None
+        self.replay_interlock.stop()
+        self.replay_interlock.reset()  # clears the motor lockout a replayed trip set
+        self.replay_interlock = None
+        for trip in self.replay_trips:
+            print(f"Replay: interlock would have tripped {trip[0]:.2f} s in: {trip[1]}")
+        print("Replay stopped.")
+        if self.dyno.connected:
+            self.interlock.start()
+            self.start_monitor_thread()
+
+    def set_tracing(self, enabled: bool) -> None:
+        """Turn hot path tracing on or off, see VDyno/model/tracing.py."""
+        if enabled:
+            tracer.enable()
+        else:
+            tracer.disable()
+            self._last_plot_tick = None
+
+    def save_trace(self, file_path: str) -> None:
+        """Save the traced spans as Chrome trace JSON."""
+        tracer.dump(file_path)
+
+    def check_experiment(self) -> list[str]:
+        """Check the selected experiment's setpoints against the rig's absorption envelope."""
+        from VDyno.analysis.brake_envelope import check_experiment
+
+        filename = f"VDyno/experiments/{self.view.selected_experiment}"
+        try:
+            return check_experiment(filename)
+        except (OSError, ValueError, KeyError) as e:
+            return [f"Could not check {filename}: {e}"]
+
+    def dry_run_experiment(self) -> list[str]:
+        """Run the selected experiment against a simulated rig, see VDyno/presenter/dry_run.py. Summary line first."""
+        from VDyno.presenter.dry_run import dry_run_file, format_report
+
+        filename = f"VDyno/experiments/{self.view.selected_experiment}"
+        try:
+            return format_report(dry_run_file(filename))
+        except (OSError, ValueError, KeyError) as e:
+            return [f"Could not dry run {filename}: {e}"]
+
     def get_experiment_list(self) -> list[str]:
         experiments_dir = os.path.join(os.path.dirname(__file__), "../experiments")
         if not os.path.exists(experiments_dir):
@@ -238,19 +370,32 @@ class Presenter:
         ]
 
     def stop_all_threads(self) -> None:
-        """Stop all running threads."""
-        # Stop all workers
+        """Stop all running threads, waiting for them at most STOP_TIMEOUT."""
         print("Stopping all threads...")
-        for worker in self.workers:
-            worker.stop()
-
-        # Clear the worker list
-        self.workers.clear()
+        # The experiment first, so its last setpoints and events are in before the recording is closed
+        self.supervisor.stop_all()
+        if self.replayer is not None:
+            self.replayer.stop()
+            self.replay_interlock.stop()
+        self.interlock.stop()
+        if self.spectrum is not None:
+            self.dyno.remove_listener(self.spectrum.add)
+        self.acquisition.remove(self.dyno)
+        if not self.acquisition.dynos:
+            self.acquisition.stop()
+        self.stop_recording()
+        if not self.recorder.savers:
+            self.recorder.stop()
+        print(self.supervisor.summary())
+        print(self.acquisition.summary())
+        print(self.control_ticker.summary())
+        print(self.commands.summary())
+        print(self.dyno.parameter_estimator.summary())
         print("All threads stopped.")
 
     def run(self) -> None:
-        print("Starting Thread")
-        self.start_monitor_thread()
+        # Monitor threads start once the CAN bus is open, see start_subsystems
+        self.profiler.expect("window shown", "live plot ready", "CAN connected")
         self.app.aboutToQuit.connect(self.stop_all_threads)
         print("Running the presenter")
         self.view.init_UI(self)
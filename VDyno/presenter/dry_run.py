@@ -0,0 +1,385 @@
+"""
+VDyno - A PyQT based GUI for the V-Dyno project.
+
+This code contains the experiment dry run. An experiment is run through TestAutomator/ExperimentWorker as it would be on the
+rig, but against SimulatedRig on a virtual clock. That predicts how long it will take, its peak current, speed and torque,
+the energy of each step and any interlock limits it would break, before it is started, in a fraction of a second.
+
+SimulatedRig stands in for the Dyno, for the window the worker sends setpoints to and for the worker's clock.
+The rig model is deliberately simple and noise free:
+    - the MUT current follows its command straight away (the VESC current loop is far faster than a step) and gives
+      Kt * I of torque on a lossless shaft, which the torque transducer reads,
+    - in rpm mode the load motor brings the shaft to its setpoint with a first order lag, absorbing whatever torque it takes,
+    - in brake current mode (closed loop torque on the load motor) the shaft accelerates with the difference in torque,
+    - each motor's voltage is R * I + Ke * omega, which gives its duty cycle and the MUT's electrical energy,
+    - each motor's winding temperature rises with its I^2 R loss through a first order thermal model (THERMAL_RESISTANCE
+      to ambient, THERMAL_TIME_CONSTANT), starting from AMBIENT_TEMPERATURE. R is held constant as the windings warm, and
+      every experiment starts cold, so back to back experiments run hotter than predicted.
+In open loop the commands only change with the setpoints, so after its first control tick each sleep() is solved exactly
+in intervals of up to MAX_INTERVAL, which sets how closely violations are timed. Closed loop torque runs the real
+TorqueControl every control tick.
+Samples go to the listeners (steady holds) with virtual timestamps, and are checked against the interlock limits
+(interlock_limits.csv) the way Interlock.check does, so max_rate is measured over one control tick. The modelled winding
+temperatures (WindingTemperature_V1 and _V2) are checked against their limits there too. The live rig doesn't measure them,
+so they are only checked here.
+
+Usage:
+    python -m VDyno.presenter.dry_run VDyno/experiments/*.json
+
+written by:
+    - Daniel Muir
+"""
+
+import json
+import math
+import sys
+from time import perf_counter
+
+if __name__ == "__main__":
+    import os
+
+    sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
+
+from VDyno.analysis.brake_envelope import RIG_TORQUE_CONSTANT
+from VDyno.model.interlock import LIMITS_FILE, MIN_RATE_INTERVAL, load_limits
+from VDyno.model.parameter_estimator import DEFAULT_BUS_VOLTAGE, INITIAL_RESISTANCE
+from VDyno.presenter.pacing import CONTROL_RATE_HZ
+from VDyno.presenter.test_automator import TestAutomator
+from VDyno.presenter.torque_control import TorqueControl
+
+CONTROL_PERIOD = 1 / CONTROL_RATE_HZ
+INERTIA = 1e-3  # kg m^2, both motors, couplings and transducer together, a rough figure
+SPEED_TIME_CONSTANT = 0.1  # s, how quickly the load VESC's speed loop follows a new setpoint
+MAX_INTERVAL = 0.1  # s, longest open loop interval solved in one go
+AMBIENT_TEMPERATURE = 25.0  # deg C
+THERMAL_RESISTANCE = 0.5  # K/W, winding to ambient, a rough figure for a 63 mm outrunner on the rig
+THERMAL_TIME_CONSTANT = 300.0  # s, winding and stator heating up together
+RPM_TO_RAD_S = 2 * math.pi / 60
+STEP_TOTALS = ("duration", "mut_energy", "shaft_energy", "copper_loss", "current_squared")
+STEP_PEAKS = ("peak_current", "peak_rpm", "peak_torque", "peak_load_current", "peak_temperature")
+
+
+class _SimulatedMotor:
+    """Takes the same commands as Motor and keeps the latest for the rig to act on."""
+
+    def __init__(self, vesc_number: int) -> None:
+        self.vesc_number = vesc_number
+        self.status = {
+            f"Status_RPM_V{vesc_number}": 0.0,
+            f"Status_TotalCurrent_V{vesc_number}": 0.0,
+            f"Status_DutyCycle_V{vesc_number}": 0.0,
+        }
+        self.listeners = []
+        self.lockout = False
+        self.mode = "current"
+        self.command = 0.0
+
+    def set_current(self, current_value: float) -> None:
+        self.mode, self.command = "current", current_value
+
+    def set_rpm(self, rpm_value: float) -> None:
+        self.mode, self.command = "rpm", rpm_value
+
+    def set_brake_current(self, brake_current: float) -> None:
+        self.mode, self.command = "brake", brake_current
+
+
+class _SimulatedTransducer:
+    def __init__(self) -> None:
+        self.status = {"TorqueValue": 0.0}
+        self.updated = None  # virtual time of the latest sample
+        self.listeners = []
+
+
+class SimulatedRig:
+    def __init__(
+        self,
+        limits_file: str = LIMITS_FILE,
+        torque_constant: float = RIG_TORQUE_CONSTANT,
+        resistance: float = INITIAL_RESISTANCE,
+        inertia: float = INERTIA,
+        speed_time_constant: float = SPEED_TIME_CONSTANT,
+        bus_voltage: float = DEFAULT_BUS_VOLTAGE,
+        ambient_temperature: float = AMBIENT_TEMPERATURE,
+        thermal_resistance: float = THERMAL_RESISTANCE,
+        thermal_time_constant: float = THERMAL_TIME_CONSTANT,
+    ) -> None:
+        self.MUT = _SimulatedMotor(1)
+        self.load_motor = _SimulatedMotor(2)
+        self.torque_transducer = _SimulatedTransducer()
+        self.torque_constant = torque_constant
+        self.resistance = resistance
+        self.inertia = inertia
+        self.speed_time_constant = speed_time_constant
+        self.bus_voltage = bus_voltage
+        self.ambient_temperature = ambient_temperature
+        self.thermal_resistance = thermal_resistance
+        self.thermal_time_constant = thermal_time_constant
+        self.temperatures = [ambient_temperature, ambient_temperature]  # deg C, MUT and load motor windings
+        self.torque_control = TorqueControl(torque_constant, clock=self.monotonic)
+        self.desired_MUT_current = 0.0
+        self.desired_load_rpm = 0.0
+        self.limits = load_limits(limits_file)
+        self.now = 0.0  # s of virtual time
+        self.omega = 0.0  # rad/s, shaft speed
+        self.step_summaries = {}  # step index: totals and peaks
+        self.violations = {}  # (step, channel, kind): the worst violation
+        self._step = None
+        self._totals = None
+        self._last = {}  # channel: (value, time) for the rate check
+
+    # Dyno interface, for steady holds
+    @property
+    def devices(self) -> tuple:
+        return (self.MUT, self.load_motor, self.torque_transducer)
+
+    @property
+    def sources(self) -> tuple:
+        return self.devices
+
+    def add_listener(self, listener) -> None:
+        for device in self.devices:
+            device.listeners.append(listener)
+
+    def remove_listener(self, listener) -> None:
+        for device in self.devices:
+            if listener in device.listeners:
+                device.listeners.remove(listener)
+
+    # Window interface, the setpoints ExperimentWorker sends
+    def change_MUT_current(self, value: float) -> None:
+        self.desired_MUT_current = value
+
+    def change_load_rpm(self, value: float) -> None:
+        self.desired_load_rpm = value
+
+    def change_torque(self, value: float | None, actuator: str = "MUT") -> None:
+        self.torque_control.set_setpoint(value, actuator)
+
+    # Clock interface
+    def monotonic(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float) -> None:
+        """Run the control loop and rig for seconds of virtual time."""
+        end = self.now + max(0.0, seconds)
+        while end - self.now > 1e-9:
+            self.torque_control.tick(self, self.desired_MUT_current, self.desired_load_rpm, CONTROL_PERIOD)
+            self._advance(min(CONTROL_PERIOD, end - self.now))
+            while not self.torque_control.active and end - self.now > 1e-9:
+                self._advance(min(MAX_INTERVAL, end - self.now))  # same commands every tick until the setpoints change
+
+    def begin_step(self, index: int) -> None:
+        """ExperimentWorker progress callback, called as each step starts."""
+        self.end_step()
+        self._step = index
+        self._totals = dict.fromkeys(STEP_TOTALS + STEP_PEAKS, 0.0)
+        self._totals["started"] = self.now
+
+    def end_step(self) -> None:
+        if self._totals is None:
+            return
+        totals = self._totals
+        totals["duration"] = self.now - totals.pop("started")
+        totals["rms_current"] = math.sqrt(totals.pop("current_squared") / totals["duration"]) if totals["duration"] else 0.0
+        self.step_summaries[self._step] = totals
+        self._totals = None
+
+    def _advance(self, dt: float) -> None:
+        """Move the rig on by dt with the commands held, then publish one sample."""
+        kt = self.torque_constant
+        current = self.MUT.command if self.MUT.mode == "current" else 0.0
+        torque = kt * current
+        omega0 = self.omega
+        load = self.load_motor
+        if load.mode == "rpm":
+            target = load.command * RPM_TO_RAD_S
+            tau = self.speed_time_constant
+            decay = math.exp(-dt / tau)
+            omega1 = target + (omega0 - target) * decay
+            omega_integral = target * dt + (omega0 - target) * tau * (1 - decay)
+            acceleration = (target - omega1) / tau
+        else:
+            # A brake opposes the motion, or holds the shaft still against up to its own torque
+            brake = kt * abs(load.command) if load.mode == "brake" else 0.0
+            direction = omega0 if omega0 else torque
+            net = 0.0 if (not omega0 and abs(torque) <= brake) else torque - math.copysign(brake, direction)
+            omega1 = omega0 + net / self.inertia * dt
+            if omega0 and omega1 * omega0 < 0 and abs(torque) <= brake:
+                omega1 = 0.0  # braked to a stop within the interval
+            omega_integral = (omega0 + omega1) / 2 * dt
+            acceleration = net / self.inertia
+        self.omega = omega1
+        self.now += dt
+
+        resistance = self.resistance
+        load_current = -(torque - self.inertia * acceleration) / kt  # generating against the MUT
+        if self._totals is not None:
+            totals = self._totals
+            totals["mut_energy"] += resistance * current * current * dt + kt * current * omega_integral
+            totals["shaft_energy"] += torque * omega_integral
+            totals["copper_loss"] += resistance * current * current * dt
+            totals["current_squared"] += current * current * dt
+
+        rpm = omega1 / RPM_TO_RAD_S
+        self._publish(
+            self.MUT,
+            {
+                "Status_RPM_V1": rpm,
+                "Status_TotalCurrent_V1": current,
+                "Status_DutyCycle_V1": 100 * (resistance * current + kt * omega1) / self.bus_voltage,
+            },
+        )
+        self._publish(
+            load,
+            {
+                "Status_RPM_V2": rpm,
+                "Status_TotalCurrent_V2": load_current,
+                "Status_DutyCycle_V2": 100 * (resistance * load_current + kt * omega1) / self.bus_voltage,
+            },
+        )
+        self._publish(self.torque_transducer, {"TorqueValue": torque})
+        # The MUT current is held over dt, so its winding is solved exactly. The load current is taken at the end of dt
+        decay = math.exp(-dt / self.thermal_time_constant)
+        for index, winding_current in enumerate((current, load_current)):
+            steady = self.ambient_temperature + winding_current * winding_current * resistance * self.thermal_resistance
+            self.temperatures[index] = steady + (self.temperatures[index] - steady) * decay
+        self._check({"WindingTemperature_V1": self.temperatures[0], "WindingTemperature_V2": self.temperatures[1]}, self.now)
+        if self._totals is not None:
+            totals = self._totals
+            totals["peak_current"] = max(totals["peak_current"], abs(current))
+            totals["peak_rpm"] = max(totals["peak_rpm"], abs(rpm))
+            totals["peak_torque"] = max(totals["peak_torque"], abs(torque))
+            totals["peak_load_current"] = max(totals["peak_load_current"], abs(load_current))
+            totals["peak_temperature"] = max(totals["peak_temperature"], *self.temperatures)
+
+    def _publish(self, device: object, status: dict) -> None:
+        device.status = status
+        timestamp = self.now
+        device.updated = timestamp
+        for listener in device.listeners:
+            listener(status, timestamp)
+        self._check(status, timestamp)
+
+    def _check(self, status: dict, timestamp: float) -> None:
+        """Note every interlock limit the sample breaks, keeping the worst per step, channel and kind."""
+        for name, value in status.items():
+            previous = self._last.get(name)
+            self._last[name] = (value, timestamp)
+            limit = self.limits.get(name)
+            if limit is None:
+                continue
+            if limit["max"] is not None and value > limit["max"]:
+                self._violation(name, "max", value, limit["max"], value - limit["max"])
+            elif limit["min"] is not None and value < limit["min"]:
+                self._violation(name, "min", value, limit["min"], limit["min"] - value)
+            if limit["max_rate"] is not None and previous is not None:
+                rate = abs(value - previous[0]) / max(timestamp - previous[1], MIN_RATE_INTERVAL)
+                if rate > limit["max_rate"]:
+                    self._violation(name, "max_rate", rate, limit["max_rate"], rate - limit["max_rate"])
+
+    def _violation(self, name: str, kind: str, value: float, limit: float, excess: float) -> None:
+        key = (self._step, name, kind)
+        worst = self.violations.get(key)
+        if worst is None:
+            self.violations[key] = {
+                "step": self._step, "channel": name, "kind": kind, "value": value, "limit": limit,
+                "excess": excess, "time": self.now,
+            }
+        elif excess > worst["excess"]:
+            worst.update(value=value, excess=excess)
+
+
+def dry_run(steps: list, rig: SimulatedRig | None = None) -> dict:
+    """
+    Run experiment steps against a simulated rig on a virtual clock.
+
+    Returns the predicted duration (s), the per step summaries (duration, energies in J, peaks, whether a steady hold
+    settled), the peaks over the whole experiment, the limit violations, and the wall time the dry run took.
+    """
+    rig = rig or SimulatedRig()
+    started = perf_counter()
+    automator = TestAutomator(rig, rig)
+    automator.run_steps(steps, progress_callback=rig.begin_step, clock=rig)
+    rig.end_step()
+    wall_time = perf_counter() - started
+
+    summaries = []
+    for index, step in enumerate(steps):
+        summary = rig.step_summaries.get(index, dict.fromkeys(STEP_TOTALS + STEP_PEAKS + ("rms_current",), 0.0))
+        settle = automator.worker.settle_statistics.get(index)
+        summaries.append(dict(summary, step=index, action=step["action"], settled=settle["settled"] if settle else None))
+    peaks = {key: max((summary[key] for summary in summaries), default=0.0) for key in STEP_PEAKS}
+    return {
+        "duration": rig.now,
+        "steps": summaries,
+        "peaks": peaks,
+        "energy": sum(summary["mut_energy"] for summary in summaries),
+        "violations": sorted(rig.violations.values(), key=lambda v: (v["time"], v["channel"])),
+        "wall_time": wall_time,
+    }
+
+
+def dry_run_file(experiment_file: str) -> dict:
+    with open(experiment_file, "r") as file:
+        experiment = json.load(file)
+    return dry_run(experiment["steps"])
+
+
+def _duration_text(seconds: float) -> str:
+    if seconds >= 3600:
+        return f"{int(seconds // 3600)} h {int(seconds % 3600 // 60):02d} min"
+    if seconds >= 60:
+        return f"{int(seconds // 60)} min {int(seconds % 60):02d} s"
+    return f"{seconds:.1f} s"
+
+
+def _energy_text(joules: float) -> str:
+    return f"{joules / 1000:.2f} kJ" if abs(joules) >= 1000 else f"{joules:.1f} J"
+
+
+def format_report(report: dict) -> list[str]:
+    """Human readable lines, the first a one line summary."""
+    peaks = report["peaks"]
+    violations = report["violations"]
+    lines = [
+        f"Dry run: takes {_duration_text(report['duration'])}, peaks {peaks['peak_current']:.1f} A, "
+        f"{peaks['peak_rpm']:.0f} rpm, {peaks['peak_torque']:.2f} Nm, {peaks['peak_temperature']:.0f} C winding, "
+        f"{_energy_text(report['energy'])} into the MUT, "
+        f"{len(violations) or 'no'} limit violation{'' if len(violations) == 1 else 's'}."
+    ]
+    speedup = report["duration"] / report["wall_time"] if report["wall_time"] > 0 else math.inf
+    lines.append(f"Simulated in {report['wall_time'] * 1000:.0f} ms ({speedup:.0f}x real time).")
+    for summary in report["steps"]:
+        settled = "" if summary["settled"] is None else (", settled" if summary["settled"] else ", not steady")
+        lines.append(
+            f"Step {summary['step'] + 1} {summary['action']}: {_duration_text(summary['duration'])}{settled}, "
+            f"{_energy_text(summary['mut_energy'])} in, {_energy_text(summary['shaft_energy'])} shaft, "
+            f"{_energy_text(summary['copper_loss'])} copper loss, {summary['rms_current']:.1f} A rms, "
+            f"peaks {summary['peak_current']:.1f} A, {summary['peak_rpm']:.0f} rpm, {summary['peak_torque']:.2f} Nm, "
+            f"{summary['peak_temperature']:.0f} C"
+        )
+    for violation in violations:
+        step = "" if violation["step"] is None else f"Step {violation['step'] + 1}: "
+        units = "/s" if violation["kind"] == "max_rate" else ""
+        lines.append(
+            f"{step}{violation['channel']} reaches {violation['value']:.1f}{units}, "
+            f"{violation['kind']} {violation['limit']:g}{units}, {violation['time']:.2f} s in"
+        )
+    return lines
+
+
+if __name__ == "__main__":
+    total_duration = 0.0
+    total_wall = 0.0
+    status = 0
+    for path in sys.argv[1:]:
+        report = dry_run_file(path)
+        print(f"{path}:")
+        for line in format_report(report):
+            print(f"    {line}")
+        total_duration += report["duration"]
+        total_wall += report["wall_time"]
+        status = status or int(bool(report["violations"]))
+    print(f"{len(sys.argv) - 1} experiments, {_duration_text(total_duration)} of rig time checked in {total_wall:.2f} s")
+    sys.exit(status)
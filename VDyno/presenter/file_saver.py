@@ -3,6 +3,15 @@ VDyno - A PyQT based GUI for the V-Dyno project.
 
 This code contains the FileSaver class, which is used to save data from each of the motors and the torque transducer (file type: dict) into a .csv file.
 Results are stored in data_output/results, with the filename being the date and time of creation.
+The first column, Time, is the wall clock time (s) each row was written.
+
+Alongside each recording, <recording>_events.csv holds the event channel: experiment start/stop, step starts and ends with
+their setpoints, manual setpoint changes and interlock trips. Events carry the same Time clock as the rows, plus the number
+of rows and the byte offset in the recording where the next row will start. The step_start events are therefore an index of
+where each step begins, so analysis can seek straight to a step (see VDyno/analysis/results.py).
+
+A Recorder writes the rows of any number of open FileSavers from one thread, so recording several rigs costs one thread.
+Recordings of a named rig (Dyno(name=...)) have the name after the date, so rigs started in the same second don't clash.
 
 written by:
     - Daniel Muir
@@ -10,8 +19,20 @@ written by:
 
 import csv
 from datetime import datetime
+import json
 import os
-from time import sleep
+import threading
+from time import sleep, time
+
+if __name__ == "__main__":
+    import sys
+
+    sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
+
+from VDyno.model.recording_format import EVENT_HEADER, RECORD_RATE_HZ, TIME_KEY, events_path
+from VDyno.model.tracing import traced
+from VDyno.presenter.pacing import Ticker
+
 
 class FileSaver:
     def __init__(self, parent):
@@ -19,6 +40,11 @@ class FileSaver:
         self.MUT_data = parent.MUT.status
         self.load_data = parent.load_motor.status
         self.TT_data = parent.torque_transducer.status
+        self.file = None
+        self.writer = None
+        self.events_file = None
+        self.rows = 0
+        self._lock = threading.Lock()  # rows come from the record thread, events from any thread
 
     def open(self):
         """
@@ -29,14 +55,21 @@ class FileSaver:
         os.makedirs(folder_path, exist_ok=True)
 
         # Create the file in the specified folder
-        filename = datetime.now().strftime("%Y-%m-%d_%H-%M-%S.csv")
-        file_path = os.path.join(folder_path, filename)
-        self.file = open(file_path, mode='w', newline='', encoding='utf-8')
+        filename = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+        name = getattr(self.parent, "name", None)
+        filename += f"_{name}.csv" if name else ".csv"
+        self.file_path = os.path.join(folder_path, filename)
+        self.file = open(self.file_path, mode='w', newline='', encoding='utf-8')
         self.writer = csv.writer(self.file)
         
         # Write the header row (keys from all dictionaries)
-        headers = list(self.MUT_data.keys()) + list(self.load_data.keys()) + list(self.TT_data.keys())
+        headers = [TIME_KEY] + list(self.MUT_data.keys()) + list(self.load_data.keys()) + list(self.TT_data.keys())
         self.writer.writerow(headers)
+        self.rows = 0
+
+        self.events_file = open(events_path(self.file_path), mode='w', newline='', encoding='utf-8')
+        self.events_writer = csv.writer(self.events_file)
+        self.events_writer.writerow(EVENT_HEADER)
 
     def record(self, stop:bool=False):
         """
@@ -45,27 +78,102 @@ class FileSaver:
         if stop:
                 print("Stopping recording...")
                 return  # Exit the method if stop is True
-        
+
+        self.write_row()
+        sleep(1/RECORD_RATE_HZ)
+
+    @traced("record write", "record")
+    def write_row(self):
+        """
+        Write one row of the latest statuses, without pacing.
+        """
         self.MUT_data = self.parent.MUT.status
         self.load_data = self.parent.load_motor.status
         self.TT_data = self.parent.torque_transducer.status
-        if not self.writer:
-            raise ValueError("File is not open. Call 'open' before recording.")
-        
-        # Write only the values from the dictionaries
-        row = list(self.MUT_data.values()) + list(self.load_data.values()) + list(self.TT_data.values())
-        self.writer.writerow(row)
-        sleep(1/40)
+        with self._lock:
+            if not self.writer:
+                raise ValueError("File is not open. Call 'open' before recording.")
+
+            # Write only the values from the dictionaries
+            row = [round(time(), 4)]
+            row += list(self.MUT_data.values()) + list(self.load_data.values()) + list(self.TT_data.values())
+            self.writer.writerow(row)
+            self.rows += 1
+
+    def log_event(self, event: str, step: int | None = None, **detail) -> None:
+        """
+        Add an event to the event channel, stamped with the time and the position of the next row. Safe from any thread.
+        """
+        with self._lock:
+            if not self.events_file:
+                return
+            # tell() flushes the row buffer, so the offset is where the next row will be written
+            offset = self.file.tell()
+            step = "" if step is None else step
+            self.events_writer.writerow(
+                [round(time(), 4), self.rows, offset, event, step, json.dumps(detail) if detail else ""]
+            )
+            self.events_file.flush()
 
     def close(self):
         """
-        Close the .csv file.
+        Close the .csv file and its event channel.
         """
         print("Closing file...")
-        if self.file:
-            self.file.close()
-            self.file = None
-            self.writer = None
+        with self._lock:
+            if self.file:
+                self.file.close()
+                self.file = None
+                self.writer = None
+            if self.events_file:
+                self.events_file.close()
+                self.events_file = None
+
+class Recorder:
+    """Writes a row to every added FileSaver RECORD_RATE_HZ times a second, from one shared thread."""
+
+    def __init__(self, rate_hz: float = RECORD_RATE_HZ) -> None:
+        self.rate_hz = rate_hz
+        self.savers = []
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def add(self, saver: FileSaver) -> None:
+        """Start writing an open FileSaver's rows, starting the thread if needed."""
+        with self._lock:
+            if saver not in self.savers:
+                self.savers.append(saver)
+            if self._thread is None:
+                self._stop.clear()
+                self._thread = threading.Thread(target=self._run, name="recorder", daemon=True)
+                self._thread.start()
+
+    def remove(self, saver: FileSaver) -> None:
+        """Stop writing a FileSaver's rows. Once this returns no more rows will be written, so it can be closed."""
+        with self._lock:
+            if saver in self.savers:
+                self.savers.remove(saver)
+
+    def stop(self) -> None:
+        with self._lock:
+            self.savers.clear()
+            thread, self._thread = self._thread, None
+        self._stop.set()
+        if thread is not None:
+            thread.join(timeout=1.0)
+
+    def _run(self) -> None:
+        ticker = Ticker(self.rate_hz, "recorder")
+        while not self._stop.is_set():
+            with self._lock:
+                for saver in self.savers:
+                    try:
+                        saver.write_row()
+                    except Exception as e:
+                        print(f"Error recording {saver.file_path}: {e}")
+            ticker.wait(self._stop)
+
 
 if __name__ == "__main__":
 
@@ -90,6 +198,7 @@ if __name__ == "__main__":
     file_saver.open()
 
     # Record the current state of the dictionaries (writes values as a row)
+    file_saver.log_event("step_start", 0, action="hold")
     file_saver.record()
 
     # Modify the dictionaries to simulate new data
@@ -0,0 +1,428 @@
+"""
+VDyno - A PyQT based GUI for the V-Dyno project.
+
+This code contains the HeadlessRunner class, which runs experiments against the dyno without the Qt GUI.
+It takes the place of the Presenter: the same monitor, control and recording loops run on plain threads, and
+TestAutomator drives the setpoints through change_MUT_current/change_load_rpm as it would through MainWindow.
+Nothing here imports PyQt6 or pyqtgraph, so it starts quickly on headless lab machines. Entry point is VDyno_headless.py.
+
+Several rigs can be run from one process with --rig NAME=PORT, once per rig. Each rig has its own Dyno, CAN bus, control
+thread, interlock and recordings, and runs the plan on its own thread. The AcquisitionEngine and the Recorder are shared, so
+adding a rig adds its frames to process, not another set of polling and recording threads.
+
+Exit status: 0 when every experiment completed, 1 when one failed, was stopped or tripped the interlock, 2 for bad arguments.
+With --dry-run nothing is connected: each experiment runs against the simulated rig (see dry_run.py) and the exit status
+is 1 if any would break an interlock limit.
+
+written by:
+    - Daniel Muir
+"""
+
+import argparse
+import glob
+import itertools
+import json
+import os
+import signal
+import sys
+import threading
+import traceback
+from time import monotonic
+
+if __name__ == "__main__":
+    sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
+
+from VDyno.model.dyno import Dyno
+from VDyno.model.interlock import Interlock
+from VDyno.presenter.test_automator import TestAutomator
+from VDyno.presenter.acquisition import AcquisitionEngine
+from VDyno.presenter.command_mailbox import EXPERIMENT, INTERLOCK, CommandMailbox
+from VDyno.presenter.file_saver import FileSaver, Recorder
+from VDyno.presenter.step_statistics import StepStatistics, summary_path
+from VDyno.model.tracing import tracer
+from VDyno.presenter.pacing import CONTROL_RATE_HZ, Ticker
+from VDyno.presenter.torque_control import TorqueControl
+
+
+def sweep_steps(current: float, rpm: float, ramp_time: float, hold_time: float, until_steady: bool = False) -> list:
+    """
+    Ramp up, hold and ramp down steps for one operating point, the layout of the test_*A_*rpm.json files.
+
+    With until_steady the hold ends once torque and speed settle, with hold_time as the longest it may take.
+    """
+    steps = [
+        {
+            "action": "ramp",
+            "MUT": {"property": "current", "start": 0, "end": current},
+            "load_motor": {"property": "rpm", "start": 0, "end": rpm},
+            "duration": ramp_time,
+        },
+        {
+            "action": "hold",
+            "MUT": {"property": "current", "value": current},
+            "load_motor": {"property": "rpm", "value": rpm},
+            "duration": hold_time,
+        },
+        {
+            "action": "ramp",
+            "MUT": {"property": "current", "start": current, "end": 0},
+            "load_motor": {"property": "rpm", "start": rpm, "end": 0},
+            "duration": ramp_time,
+        },
+    ]
+    if until_steady:
+        steps[1]["until"] = "steady"
+    return steps
+
+
+class HeadlessRunner:
+    """Monitor, control and record the dyno on plain threads, and run experiments on the calling thread."""
+
+    def __init__(
+        self,
+        dyno: Dyno,
+        record: bool = True,
+        status_interval: float = 1.0,
+        acquisition: AcquisitionEngine | None = None,
+        recorder: Recorder | None = None,
+    ) -> None:
+        self.dyno = dyno
+        self.acquisition = acquisition or AcquisitionEngine()
+        self.recorder = recorder or Recorder()
+        self.prefix = f"{dyno.name} " if dyno.name else ""  # in front of every progress line, to tell rigs apart
+        self.record = record
+        self.status_interval = status_interval
+        self.commands = CommandMailbox()
+        self.torque_control = TorqueControl()
+        self.control_ticker = Ticker(CONTROL_RATE_HZ, "control loop")
+        self.automator = TestAutomator(self, dyno)
+        self.recording = None
+        self._stop = threading.Event()
+        self._threads = []
+
+    def change_MUT_current(self, value: float) -> None:
+        self.commands.post("MUT_current", value, EXPERIMENT)
+
+    def change_load_rpm(self, value: int) -> None:
+        self.commands.post("load_rpm", value, EXPERIMENT)
+
+    def change_torque(self, value: float | None, actuator: str = "MUT") -> None:
+        self.commands.post("torque", (value, actuator), EXPERIMENT)
+
+    def log_event(self, event: str, step: int | None = None, **detail) -> None:
+        """Add an event to the current recording's event channel, if recording."""
+        if self.recording is not None:
+            self.recording.log_event(event, step, **detail)
+
+    def _loop(self, fn, stop: threading.Event, *args) -> None:
+        threading.current_thread().name = self.prefix + fn.__name__
+        while not stop.is_set():
+            try:
+                fn(*args)
+            except Exception as e:
+                print(f"Error in worker thread: {e}")
+                traceback.print_exc()
+                stop.wait(1 / 40)
+
+    def _start_thread(self, fn, stop: threading.Event, *args) -> threading.Thread:
+        thread = threading.Thread(target=self._loop, args=(fn, stop) + args, daemon=True)
+        thread.start()
+        self._threads.append(thread)
+        return thread
+
+    def control_motors(self) -> None:
+        with tracer.span("control tick", "control"):
+            commands, changed = self.commands.take()
+            for channel, command in changed:
+                if channel == "torque":
+                    self.torque_control.set_setpoint(*command.value)
+            self.torque_control.tick(
+                self.dyno, commands["MUT_current"].value, commands["load_rpm"].value, self.control_ticker.period
+            )
+        self.control_ticker.wait(self._stop)
+
+    def start(self) -> None:
+        """Start receiving status frames and the control loop, as Presenter.start_monitor_thread does."""
+        self.acquisition.add(self.dyno)
+        self._start_thread(self.control_motors, self._stop)
+
+    def stop(self) -> None:
+        """Stop any experiment, send zero setpoints and wait for the loops to finish."""
+        if hasattr(self.automator, "worker"):
+            self.automator.stop_experiment()
+        self._stop.set()
+        for thread in self._threads:
+            thread.join(timeout=1.0)
+        self._threads.clear()
+        self.torque_control.set_setpoint(None)
+        self.dyno.MUT.set_current(0)
+        self.dyno.load_motor.set_rpm(0)
+        self.acquisition.remove(self.dyno)
+        print(self.prefix + self.control_ticker.summary())
+        print(self.prefix + self.commands.summary())
+        print(self.prefix + self.dyno.parameter_estimator.summary())
+
+    def _print_status(self, name: str, started: float, stop: threading.Event) -> None:
+        stop.wait(self.status_interval)
+        if stop.is_set():
+            return
+        mut = self.dyno.MUT.status
+        print(
+            f"[{self.prefix}{name} {monotonic() - started:7.1f}s] "
+            f"MUT {mut.get('Status_RPM_V1', 0):.0f} rpm {mut.get('Status_TotalCurrent_V1', 0):.2f} A, "
+            f"load {self.dyno.load_motor.status.get('Status_RPM_V2', 0):.0f} rpm, "
+            f"torque {self.dyno.torque_transducer.status.get('TorqueValue', 0):.3f} Nm",
+            flush=True,
+        )
+
+    def run_experiment(self, name: str, steps: list) -> bool:
+        """Run one experiment with its own recording file. Returns True when every step completed."""
+        run_stop = threading.Event()
+        run_threads = []
+        started = monotonic()
+        step_statistics = StepStatistics(self.dyno)
+        if self.record:
+            recording = FileSaver(self.dyno)
+            recording.open()
+            self.recording = recording
+            step_statistics.file_path = summary_path(recording.file_path)
+            self.recorder.add(recording)
+        if self.status_interval > 0:
+            run_threads.append(self._start_thread(self._print_status, run_stop, name, started, run_stop))
+
+        def progress(index: int) -> None:
+            step = steps[index]
+            print(
+                f"[{self.prefix}{name} {monotonic() - started:7.1f}s] step {index + 1}/{len(steps)}: "
+                f"{step['action']} for {step['duration']} s",
+                flush=True,
+            )
+
+        try:
+            completed = self.automator.run_steps(steps, progress, step_statistics, self.log_event)
+        finally:
+            run_stop.set()
+            for thread in run_threads:
+                thread.join(timeout=1.0)
+                self._threads.remove(thread)
+            if self.record:
+                # Returns once the recorder has finished its current row, so the file can be closed
+                self.recorder.remove(recording)
+                self.recording = None
+                recording.close()
+        print(f"[{self.prefix}{name}] {'completed' if completed else 'stopped'} in {monotonic() - started:.1f} s", flush=True)
+        return completed
+
+
+def _load_plan(args: argparse.Namespace) -> list:
+    """(name, steps) pairs for every experiment file and sweep point requested."""
+    plan = []
+    for pattern in args.experiments:
+        paths = sorted(glob.glob(pattern)) or sorted(glob.glob(os.path.join("VDyno/experiments", pattern)))
+        if not paths:
+            raise FileNotFoundError(f"No experiment matches {pattern}")
+        for path in paths:
+            with open(path, "r") as file:
+                plan.append((os.path.basename(path), json.load(file)["steps"]))
+    for current, rpm in itertools.product(args.sweep_current or [], args.sweep_rpm or []):
+        steps = sweep_steps(current, rpm, args.ramp_time, args.hold_time, args.until_steady)
+        plan.append((f"sweep_{current:g}A_{rpm:g}rpm", steps))
+    return plan
+
+
+def _parse_rigs(args: argparse.Namespace) -> list:
+    """(name, port) for every rig to run, [(None, --port)] without --rig."""
+    if not args.rig:
+        return [(None, args.port)]
+    if args.port:
+        raise ValueError("give each rig's port with --rig NAME=PORT rather than --port")
+    rigs = []
+    for rig in args.rig:
+        name, separator, port = rig.partition("=")
+        if not separator or not name or not port:
+            raise ValueError(f"--rig {rig} should be NAME=PORT")
+        rigs.append((name, port))
+    names = [name for name, _ in rigs]
+    ports = [port for _, port in rigs]
+    if len(set(names)) < len(names) or len(set(ports)) < len(ports):
+        raise ValueError("every --rig needs its own name and port")
+    return rigs
+
+
+def _stop_on_trip(runner: HeadlessRunner) -> None:
+    runner.commands.zero(INTERLOCK)  # held, so the experiment can't post over it while it stops
+    if hasattr(runner.automator, "worker"):
+        runner.automator.stop_experiment()
+
+
+def _run_plan(runner: HeadlessRunner, plan: list) -> int:
+    """Run every experiment in turn on one rig, stopping at the first that fails. Returns the exit status."""
+    try:
+        for name, steps in plan:
+            if not runner.run_experiment(name, steps):
+                return 1
+    except Exception as e:
+        print(f"{runner.prefix}Experiment failed: {e}")
+        traceback.print_exc()
+        return 1
+    return 0
+
+
+def _dry_run(plan: list) -> int:
+    from VDyno.presenter.dry_run import dry_run, format_report
+
+    status = 0
+    duration = 0.0
+    wall_time = 0.0
+    for name, steps in plan:
+        report = dry_run(steps)
+        print(f"{name}:")
+        for line in format_report(report):
+            print(f"    {line}")
+        duration += report["duration"]
+        wall_time += report["wall_time"]
+        if report["violations"]:
+            status = 1
+    print(f"{len(plan)} experiments, {duration:.0f} s of rig time checked in {wall_time:.2f} s")
+    return status
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Run VDyno experiments without the GUI.")
+    parser.add_argument("experiments", nargs="*", help="experiment .json files, globs or names in VDyno/experiments")
+    parser.add_argument("--sweep-current", type=float, nargs="+", help="MUT currents (A) to sweep")
+    parser.add_argument("--sweep-rpm", type=float, nargs="+", help="load motor rpm setpoints to sweep")
+    parser.add_argument("--ramp-time", type=float, default=10.0, help="sweep ramp duration (s)")
+    parser.add_argument("--hold-time", type=float, default=5.0, help="sweep hold duration (s), the longest with --until-steady")
+    parser.add_argument("--until-steady", action="store_true", help="end sweep holds once torque and speed settle")
+    parser.add_argument("--no-record", action="store_true", help="do not write experimental_results files")
+    parser.add_argument(
+        "--dry-run", action="store_true", help="run against a simulated rig and report duration, peaks and limit violations"
+    )
+    parser.add_argument("--port", help="CAN adapter port, needed when more than one is plugged in")
+    parser.add_argument(
+        "--rig",
+        action="append",
+        metavar="NAME=PORT",
+        help="run the plan on this rig too, each on its own port (repeat for every rig)",
+    )
+    parser.add_argument("--status-interval", type=float, default=1.0, help="seconds between status lines, 0 for none")
+    parser.add_argument(
+        "--telemetry",
+        nargs="?",
+        const="tcp:127.0.0.1:5760",
+        metavar="ADDRESS",
+        help="publish live samples on tcp:HOST:PORT or unix:PATH (default tcp:127.0.0.1:5760)",
+    )
+    parser.add_argument("--trace", metavar="FILE", help="trace the hot paths and save Chrome trace JSON here on exit (or on SIGUSR1)")
+    args = parser.parse_args(argv)
+
+    if bool(args.sweep_current) != bool(args.sweep_rpm):
+        parser.error("--sweep-current and --sweep-rpm must be given together")
+    try:
+        plan = _load_plan(args)
+    except (OSError, ValueError, KeyError) as e:
+        print(f"Error: {e}")
+        return 2
+    if not plan:
+        parser.error("no experiments or sweep given")
+    try:
+        rigs = _parse_rigs(args)
+    except ValueError as e:
+        parser.error(str(e))
+    if args.telemetry and len(rigs) > 1:
+        parser.error("--telemetry publishes a single rig")
+    if args.dry_run:
+        return _dry_run(plan)
+
+    if args.trace:
+        tracer.enable()
+        if hasattr(signal, "SIGUSR1"):
+            signal.signal(signal.SIGUSR1, lambda signum, frame: tracer.dump(args.trace))
+
+    dynos = []
+    try:
+        for name, port in rigs:
+            dynos.append(Dyno(port=port, name=name))
+    except Exception as e:
+        print(f"Error: could not open {'rig ' + name if name else 'the CAN bus'}: {e}")
+        for dyno in dynos:
+            dyno.disconnect()
+        return 2
+    publisher = None
+    if args.telemetry:
+        from VDyno.model.telemetry import TelemetryPublisher
+
+        publisher = TelemetryPublisher(dynos[0], args.telemetry)
+        try:
+            publisher.start()
+        except (OSError, ValueError) as e:
+            print(f"Error: could not publish telemetry: {e}")
+            return 2
+
+    acquisition = AcquisitionEngine()
+    recorder = Recorder()
+    runners = []
+    interlocks = []
+    for dyno in dynos:
+        runner = HeadlessRunner(
+            dyno, not args.no_record, args.status_interval, acquisition=acquisition, recorder=recorder
+        )
+        interlock = Interlock(dyno)
+        interlock.on_trip.append(lambda reason, runner=runner: runner.log_event("interlock_trip", reason=reason))
+        interlock.on_trip.append(lambda reason, runner=runner: _stop_on_trip(runner))
+        interlock.start()
+        runner.start()
+        runners.append(runner)
+        interlocks.append(interlock)
+
+    statuses = [0] * len(runners)
+    threads = []
+
+    def run(index: int) -> None:
+        statuses[index] = _run_plan(runners[index], plan)
+
+    try:
+        if len(runners) == 1:
+            run(0)
+        else:
+            # Each rig runs the plan on its own thread, at its own pace
+            for index, runner in enumerate(runners):
+                thread = threading.Thread(target=run, args=(index,), name=f"{runner.prefix}experiments", daemon=True)
+                thread.start()
+                threads.append(thread)
+            for thread in threads:
+                while thread.is_alive():
+                    thread.join(0.2)  # short joins, so Ctrl+C still reaches this thread
+    except KeyboardInterrupt:
+        print("Interrupted, stopping motors.")
+        statuses.append(1)
+        for runner in runners:
+            if hasattr(runner.automator, "worker"):
+                runner.automator.stop_experiment()
+        for thread in threads:
+            thread.join(timeout=2.0)
+    finally:
+        for runner, interlock in zip(runners, interlocks):
+            interlock.stop()
+            runner.stop()
+            if interlock.tripped:
+                print(
+                    f"{runner.prefix}Interlock tripped: {interlock.trip_reason} "
+                    f"({interlock.reaction_times_ms[-1]:.2f} ms to stop)"
+                )
+                statuses.append(1)
+        print(acquisition.summary())
+        acquisition.stop()
+        recorder.stop()
+        for dyno in dynos:
+            dyno.disconnect()
+        if publisher is not None:
+            publisher.stop()
+        if args.trace:
+            tracer.dump(args.trace)
+    return max(statuses)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,384 @@
+"""
+VDyno - A PyQT based GUI for the V-Dyno project.
+
+This code contains the LatencyProbe class, a measurement mode for the delay between a command and the rig reacting to it.
+It sends setpoints itself at the control rate, stepping one channel at a time between two safe values:
+    - MUT current: Command_Current_V1 steps, answered by Status_TotalCurrent_V1, with the load motor holding a speed,
+    - load rpm: Command_RPM_V2 steps, answered by Status_RPM_V2, with the MUT at zero current.
+Each step is timed from when its first command frame was handed to the CAN interface (the on_send tap) to the bus timestamp
+of the first status frame that has moved a threshold fraction of the step away from the level before it, either way as the
+sign conventions differ (the on_receive tap). Status frames come every 20 ms at 50 Hz, so steps are spaced with random
+jitter to sample every phase of the frame period.
+The second measurement is delivery: from each status frame's bus timestamp to the timestamp listeners receive it with.
+For TEENSY_Status that is the part of "Teensy reading to our timestamp" the host can see, the Teensy doesn't stamp its readings.
+
+Results are summarised per device (mean, percentiles and a 1 ms histogram) for the transport in use, and written as JSON
+with the commit, so runs on different adapters (seeedstudio, SocketCAN) or code versions can be compared with --compare.
+An interlock runs throughout, the motors are sent zero when it finishes, and a trip ends the measurement.
+The CLI always connects through the real CANHandler, and refuses to measure a dummy handler, whose "latencies" would only
+time its random walks.
+
+Usage:
+    python -m VDyno.presenter.latency --port COM4 --output latency_seeed.json
+    python -m VDyno.presenter.latency --interface socketcan --port can0 --compare latency_seeed.json
+
+written by:
+    - Daniel Muir
+"""
+
+import argparse
+import json
+import math
+import os
+import platform
+import random
+import subprocess
+import sys
+import threading
+from collections import deque
+from datetime import datetime
+from time import perf_counter
+
+if __name__ == "__main__":
+    sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
+
+from VDyno.model.interlock import Interlock
+from VDyno.presenter.pacing import CONTROL_RATE_HZ, Ticker
+
+STEP_CURRENT = 1.0  # A, MUT current steps go between 0 and this
+HOLD_RPM = 500  # rpm the load motor holds while the MUT current steps, and the low end of its own steps
+RPM_STEP = 200  # rpm
+INTERVAL = 0.5  # s between steps, plus up to JITTER
+JITTER = 0.1  # s
+THRESHOLD = 0.5  # fraction of the step the response has to cover
+BASELINE_FRAMES = 5  # status frames averaged for the level before a step
+SETTLE_TIME = 1.0  # s at the starting setpoints before the first step
+BIN_MS = 1.0  # histogram bin width
+
+
+def calibrated(device: object, key: str, value: float) -> float:
+    calibration = device.calibration.get(key)
+    return value * calibration["factor"] + calibration["offset"] if calibration else value
+
+
+class _Channel:
+    """One stepped setpoint and the status signal that answers it."""
+
+    def __init__(self, name: str, device: object, command: str, response: str, low: float, high: float) -> None:
+        self.name = name
+        self.device = device
+        self.command = command  # message the step is sent in
+        self.response = response  # status signal that should follow it
+        self.low = low
+        self.high = high
+        self.recent = deque(maxlen=BASELINE_FRAMES)  # calibrated response values
+        self.samples = []  # ms
+        self.timeouts = 0
+
+
+class _Step:
+    def __init__(self, channel: _Channel, baseline: float, change: float) -> None:
+        self.channel = channel
+        self.baseline = baseline
+        self.change = change
+        self.sent = None  # time the first frame with the new setpoint was sent
+        self.done = threading.Event()
+
+
+def summarise(samples: list, timeouts: int = 0) -> dict:
+    """Count, mean, percentiles and a BIN_MS histogram of latencies in ms."""
+    ordered = sorted(samples)
+    summary = {"count": len(ordered), "timeouts": timeouts}
+    if not ordered:
+        return summary
+
+    def percentile(fraction: float) -> float:
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+    counts = [0] * (int(ordered[-1] // BIN_MS) + 1)
+    for sample in ordered:
+        counts[int(max(sample, 0.0) // BIN_MS)] += 1
+    summary["latency_ms"] = {
+        "mean": sum(ordered) / len(ordered),
+        "min": ordered[0],
+        "p50": percentile(0.50),
+        "p90": percentile(0.90),
+        "p99": percentile(0.99),
+        "max": ordered[-1],
+    }
+    summary["histogram"] = {"bin_ms": BIN_MS, "counts": counts}
+    return summary
+
+
+class LatencyProbe:
+    def __init__(
+        self,
+        dyno: object,
+        steps: int = 50,
+        interval: float = INTERVAL,
+        threshold: float = THRESHOLD,
+        step_current: float = STEP_CURRENT,
+        hold_rpm: float = HOLD_RPM,
+        rpm_step: float = RPM_STEP,
+    ) -> None:
+        self.dyno = dyno
+        self.handler = dyno.can_server
+        self.transport = f"{getattr(self.handler, 'interface', 'unknown')}:{self.handler.com_port}"
+        self.steps = steps
+        self.interval = interval
+        self.threshold = threshold
+        self.hold_rpm = hold_rpm
+        mut, load = dyno.MUT, dyno.load_motor
+        self.channels = [
+            _Channel(
+                "MUT current",
+                mut,
+                f"VESC_Command_AbsCurrent_V{mut.vesc_number}",
+                f"Status_TotalCurrent_V{mut.vesc_number}",
+                0.0,
+                step_current,
+            ),
+            _Channel(
+                "load rpm",
+                load,
+                f"VESC_Command_RPM_V{load.vesc_number}",
+                f"Status_RPM_V{load.vesc_number}",
+                hold_rpm,
+                hold_rpm + rpm_step,
+            ),
+        ]
+        self.current = 0.0
+        self.rpm = 0.0
+        self.delivery = {device.message_name: [] for device in dyno.devices}  # ms, bus timestamp to listener timestamp
+        self._bus_times = {}  # message name: bus timestamp of the frame being handled
+        self._listeners = []
+        self._step = None
+        self._lock = threading.Lock()
+        self.ticker = Ticker(CONTROL_RATE_HZ, "latency commands")
+        self.interlock = Interlock(dyno)
+        self.stopped = threading.Event()
+        self.interlock.on_trip.append(lambda reason: self.stopped.set())
+
+    # Taps and listeners, on the CAN threads
+    def _sent(self, message_name: str, signals: dict, sent: float) -> None:
+        step = self._step
+        if step is not None and step.sent is None and message_name == step.channel.command:
+            step.sent = sent
+
+    def _received(self, message_name: str, signals: dict, bus_time: float) -> None:
+        self._bus_times[message_name] = bus_time
+        for channel in self.channels:
+            if channel.device.message_name != message_name or channel.response not in signals:
+                continue
+            value = calibrated(channel.device, channel.response, signals[channel.response])
+            with self._lock:
+                step = self._step
+                if step is not None and step.channel is channel and step.sent is not None and bus_time >= step.sent:
+                    if abs(value - step.baseline) >= self.threshold * abs(step.change):
+                        channel.samples.append((bus_time - step.sent) * 1000)
+                        self._step = None
+                        step.done.set()
+                channel.recent.append(value)
+
+    def _delivered(self, message_name: str, status: dict, timestamp: float) -> None:
+        bus_time = self._bus_times.get(message_name)
+        if bus_time is not None:
+            self.delivery[message_name].append((timestamp - bus_time) * 1000)
+
+    # Commands, on the probe's thread
+    def _command(self) -> None:
+        self.dyno.MUT.set_current(self.current)
+        self.dyno.load_motor.set_rpm(self.rpm)
+
+    def _hold(self, duration: float, until: threading.Event | None = None) -> None:
+        end = perf_counter() + duration
+        while perf_counter() < end and not self.stopped.is_set():
+            self._command()
+            self.ticker.wait(self.stopped)
+            if until is not None and until.is_set():
+                return
+
+    def _measure(self, channel: _Channel, target: float) -> None:
+        with self._lock:
+            baseline = sum(channel.recent) / len(channel.recent) if channel.recent else 0.0
+            previous = channel.low if target == channel.high else channel.high
+            step = _Step(channel, baseline, target - previous)
+            self._step = step
+        if channel.name == "MUT current":
+            self.current = target
+        else:
+            self.rpm = target
+        self._hold(self.interval + random.uniform(0, JITTER), step.done)
+        with self._lock:
+            if not step.done.is_set():
+                channel.timeouts += 1
+                self._step = None
+        # Let the response settle before the next step's baseline is taken
+        self._hold(self.interval)
+
+    def run(self) -> dict:
+        """Step every channel and return the report. Moves the motors."""
+        self.handler.on_send.append(self._sent)
+        self.handler.on_receive.append(self._received)
+        for device in self.dyno.devices:
+            listener = lambda status, timestamp, name=device.message_name: self._delivered(name, status, timestamp)
+            device.listeners.append(listener)
+            self._listeners.append((device, listener))
+        self.interlock.start()
+        started = perf_counter()
+        try:
+            for channel in self.channels:
+                self.current = 0.0
+                self.rpm = self.hold_rpm if channel.name == "MUT current" else channel.low
+                self._hold(SETTLE_TIME)
+                for index in range(self.steps):
+                    if self.stopped.is_set():
+                        break
+                    self._measure(channel, channel.high if index % 2 == 0 else channel.low)
+                    print(f"{channel.name}: step {index + 1}/{self.steps}", end="\r", flush=True)
+                print()
+        finally:
+            self.current = 0.0
+            self.rpm = 0.0
+            self._command()
+            self.interlock.stop()
+            self.handler.on_send.remove(self._sent)
+            self.handler.on_receive.remove(self._received)
+            for device, listener in self._listeners:
+                device.listeners.remove(listener)
+        return self.report(perf_counter() - started)
+
+    def report(self, duration: float) -> dict:
+        results = []
+        for channel in self.channels:
+            results.append(
+                {"name": channel.name, "kind": "command", "transport": self.transport, **summarise(channel.samples, channel.timeouts)}
+            )
+        for message_name, samples in self.delivery.items():
+            results.append({"name": message_name, "kind": "delivery", "transport": self.transport, **summarise(samples)})
+        return {
+            "meta": {
+                **metadata(),
+                "transport": self.transport,
+                "filtering": getattr(self.handler, "filtering", None),
+                "duration_s": duration,
+                "steps": self.steps,
+                "threshold": self.threshold,
+                "interlock_trip": self.interlock.trip_reason,
+            },
+            "results": results,
+        }
+
+
+def metadata() -> dict:
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+    }
+
+
+def format_report(report: dict, width: int = 40) -> list[str]:
+    """Summary and text histogram lines for each result."""
+    meta = report["meta"]
+    lines = [f"{meta['transport']} at {meta['commit']}, filtered by {meta['filtering']}, {meta['duration_s']:.0f} s"]
+    if meta.get("interlock_trip"):
+        lines.append(f"Stopped early, interlock tripped: {meta['interlock_trip']}")
+    for result in report["results"]:
+        label = f"{result['name']} ({result['kind']})"
+        if "latency_ms" not in result:
+            lines.append(f"{label}: no responses, {result['timeouts']} timeouts")
+            continue
+        latency = result["latency_ms"]
+        lines.append(
+            f"{label}: {result['count']} samples, {result['timeouts']} timeouts, mean {latency['mean']:.2f} ms, "
+            f"p50 {latency['p50']:.2f} p90 {latency['p90']:.2f} p99 {latency['p99']:.2f} max {latency['max']:.2f} ms"
+        )
+        counts = result["histogram"]["counts"]
+        peak = max(counts)
+        bin_ms = result["histogram"]["bin_ms"]
+        for index, count in enumerate(counts):
+            if count:
+                bar = "#" * max(1, math.ceil(count / peak * width))
+                lines.append(f"    {index * bin_ms:5.0f}-{(index + 1) * bin_ms:<4.0f}ms {count:6d} {bar}")
+    return lines
+
+
+def compare(baseline: dict, current: dict) -> list[str]:
+    """p50 and p99 of every result in both reports, side by side."""
+    previous = {(result["name"], result["kind"]): result for result in baseline["results"]}
+    before = f"{baseline['meta']['transport']}@{baseline['meta']['commit']}"
+    after = f"{current['meta']['transport']}@{current['meta']['commit']}"
+    lines = [f"{'result':<30}{'p50 ' + before:>28}{'p50 now':>10}{'p99 ' + before:>28}{'p99 now':>10}"]
+    for result in current["results"]:
+        old = previous.get((result["name"], result["kind"]))
+        if old is None or "latency_ms" not in old or "latency_ms" not in result:
+            continue
+        label = f"{result['name']} ({result['kind']})"
+        lines.append(
+            f"{label:<30}{old['latency_ms']['p50']:>28.2f}{result['latency_ms']['p50']:>10.2f}"
+            f"{old['latency_ms']['p99']:>28.2f}{result['latency_ms']['p99']:>10.2f}"
+        )
+    return lines
+
+
+def main(argv: list[str] | None = None) -> int:
+    from VDyno.model.dyno import Dyno
+
+    parser = argparse.ArgumentParser(description="Measure command to response latency on the rig. Moves the motors.")
+    parser.add_argument("--port", help="CAN adapter port or channel")
+    parser.add_argument("--interface", default="seeedstudio", help="python-can interface, e.g. socketcan")
+    parser.add_argument("--steps", type=int, default=50, help="steps per channel")
+    parser.add_argument("--interval", type=float, default=INTERVAL, help="seconds between steps")
+    parser.add_argument("--threshold", type=float, default=THRESHOLD, help="fraction of the step that counts as a response")
+    parser.add_argument("--current", type=float, default=STEP_CURRENT, help="MUT current step (A)")
+    parser.add_argument("--hold-rpm", type=float, default=HOLD_RPM, help="load motor speed while the MUT current steps")
+    parser.add_argument("--rpm-step", type=float, default=RPM_STEP, help="load motor rpm step")
+    parser.add_argument("--output", help="write the JSON report here")
+    parser.add_argument("--compare", help="earlier JSON report to compare against")
+    args = parser.parse_args(argv)
+
+    try:
+        dyno = Dyno(port=args.port, interface=args.interface, dummy=False)
+    except Exception as e:
+        print(f"Error: could not open the CAN bus: {e}")
+        return 2
+    if getattr(dyno.can_server, "interface", None) == "dummy":
+        print("Error: connected to the dummy CAN handler, there is no rig to measure.")
+        dyno.disconnect()
+        return 2
+    from VDyno.presenter.acquisition import AcquisitionEngine
+
+    acquisition = AcquisitionEngine()
+    acquisition.add(dyno)
+    probe = LatencyProbe(dyno, args.steps, args.interval, args.threshold, args.current, args.hold_rpm, args.rpm_step)
+    try:
+        report = probe.run()
+    except KeyboardInterrupt:
+        print("Interrupted, motors stopped.")
+        return 1
+    finally:
+        acquisition.stop()
+        acquisition.remove(dyno)
+        dyno.disconnect()
+    for line in format_report(report):
+        print(line)
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=2)
+    if args.compare:
+        with open(args.compare, "r") as file:
+            for line in compare(json.load(file), report):
+                print(line)
+    return 1 if report["meta"]["interlock_trip"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
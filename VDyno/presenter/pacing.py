@@ -0,0 +1,67 @@
+"""
+VDyno - A PyQT based GUI for the V-Dyno project.
+
+This code contains the Ticker class, which paces the monitor and control loops at a fixed rate.
+Each tick waits until an absolute deadline rather than sleeping a fixed time after the work, so time spent in the loop
+body doesn't lower the rate or add drift. A tick that overruns by more than a whole period starts a new schedule
+instead of firing a burst of catch-up ticks. Lateness (how long after its deadline a tick woke) is kept as a measure of jitter.
+Python 3.11+ sleeps with a high resolution timer on Windows as well, so rates of a few hundred Hz are practical.
+
+written by:
+    - Daniel Muir
+"""
+
+import threading
+from time import perf_counter, sleep
+
+if __name__ == "__main__":
+    import os
+    import sys
+
+    sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
+
+from VDyno.model.tracing import tracer
+
+CONTROL_RATE_HZ = 200  # setpoints sent, and the torque loop run, this many times a second
+ACQUISITION_RATE_HZ = 200  # upper limit on status polls per device, frames usually arrive slower than this
+
+
+class Ticker:
+    def __init__(self, rate_hz: float, name: str = "loop") -> None:
+        self.period = 1.0 / rate_hz
+        self.name = name
+        self.ticks = 0
+        self.overruns = 0
+        self.max_lateness = 0.0
+        self.total_lateness = 0.0
+        self._deadline = None
+
+    def wait(self, stop: threading.Event | None = None) -> None:
+        """Block until the next deadline, returning early if stop is set."""
+        now = perf_counter()
+        if self._deadline is None:
+            self._deadline = now
+        self._deadline += self.period
+        delay = self._deadline - now
+        if delay > 0:
+            if stop is not None:
+                stop.wait(delay)
+            else:
+                sleep(delay)
+        else:
+            self.overruns += 1
+            if -delay > self.period:
+                self._deadline = now  # too far behind, start again from now
+        lateness = max(0.0, perf_counter() - self._deadline)
+        self.ticks += 1
+        self.total_lateness += lateness
+        self.max_lateness = max(self.max_lateness, lateness)
+        if tracer.enabled:
+            tracer.counter(f"{self.name} lateness (ms)", lateness * 1000)
+
+    def summary(self) -> str:
+        mean = self.total_lateness / self.ticks if self.ticks else 0.0
+        return (
+            f"{self.name}: {1 / self.period:.0f} Hz, {self.ticks} ticks, lateness mean {mean * 1000:.2f} ms "
+            f"max {self.max_lateness * 1000:.2f} ms, {self.overruns} overruns"
+        )
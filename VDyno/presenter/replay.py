@@ -0,0 +1,253 @@
+"""
+VDyno - A PyQT based GUI for the V-Dyno project.
+
+This code contains the Replayer class, which plays a recording back into a Dyno as if the rig were running.
+Each row is split back into the MUT, load motor and torque transducer statuses, which are set on the devices and passed to
+their listeners with the row's recorded Time, exactly as the acquisition threads do. So the live plots, the derived channels
+(ParameterEstimator), the torque spectrum and an interlock all see the session again.
+
+Playback runs on its own thread against a virtual clock, at 0.1x to 100x. Each tick sends the rows the clock has passed,
+read from the memory mapped RecordingIndex a block at a time, within a time budget: if the listeners can't keep up, the
+clock slips (achieved speed drops below the requested speed) rather than rows being dropped or the GUI thread starved.
+Seeking is by row or time through the index, or by experiment step through the event channel (<recording>_events.csv).
+Recordings from before the Time column are replayed at the 40 Hz record rate.
+
+Usage:
+    python -m VDyno.presenter.replay experimental_results/2025-03-01_12-00-00.csv --speed 100
+
+written by:
+    - Daniel Muir
+"""
+
+import bisect
+import os
+import sys
+import threading
+from time import perf_counter
+
+import numpy as np
+
+if __name__ == "__main__":
+    sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
+
+from VDyno.analysis.recording_index import RecordingIndex
+from VDyno.analysis.results import read_step_index
+from VDyno.model.recording_format import RECORD_RATE_HZ, TIME_KEY
+
+MIN_SPEED = 0.1
+MAX_SPEED = 100.0
+TICK = 0.01  # s between playback ticks
+BUDGET = 0.5  # fraction of each tick the replay thread may spend calling listeners
+MAX_BLOCK = 4096  # rows read from the index at once
+SPEED_WINDOW = 0.5  # s of wall time the achieved speed is measured over
+
+
+class Replayer:
+    def __init__(self, dyno: object, file_path: str, speed: float = 1.0) -> None:
+        self.dyno = dyno
+        self.file_path = file_path
+        self.index = RecordingIndex.open(file_path)
+        self.rows = self.index.rows
+        columns = self.index.columns
+        if TIME_KEY in columns:
+            self.times = np.array(self.index.column(TIME_KEY), dtype=np.float64)
+        else:
+            self.times = np.arange(self.rows) / RECORD_RATE_HZ
+        # (device, [(status key, column)]) for every device with channels in the recording
+        self._devices = []
+        for device in dyno.devices:
+            keys = [(key, columns.index(key)) for key in device.status if key in columns]
+            if keys:
+                self._devices.append((device, keys))
+        self.steps = read_step_index(file_path)
+        self._step_rows = [entry["row"] for entry in self.steps]
+
+        self.speed = min(MAX_SPEED, max(MIN_SPEED, speed))
+        self.achieved_speed = 0.0
+        self.position = 0  # next row to send
+        self.sample_time = float(self.times[0]) if self.rows else 0.0  # Time of the last row sent
+        self.paused = True
+        self.on_seek = []  # called after every seek, before the next row is sent
+        self._pending_rows = 0
+        self._generation = 0  # bumped by every seek, so a tick in progress doesn't overwrite the new position
+        self._anchor_wall = perf_counter()
+        self._anchor_time = self.sample_time
+        self._measure = (self._anchor_wall, self._anchor_time)  # (wall, recording time) the achieved speed is measured from
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def duration(self) -> float:
+        return float(self.times[-1] - self.times[0]) if self.rows else 0.0
+
+    @property
+    def elapsed(self) -> float:
+        return self.sample_time - float(self.times[0]) if self.rows else 0.0
+
+    @property
+    def finished(self) -> bool:
+        return self.position >= self.rows
+
+    def step_at(self, row: int) -> int | None:
+        """The experiment step a row belongs to, None outside the steps or without an event channel."""
+        i = bisect.bisect_right(self._step_rows, row) - 1
+        if i < 0:
+            return None
+        entry = self.steps[i]
+        if entry["end_row"] is not None and row >= entry["end_row"]:
+            return None
+        return entry["step"]
+
+    def start(self) -> None:
+        """Start the replay thread and play from the current position."""
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="replay", daemon=True)
+        self._thread.start()
+        self.play()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout=1.0)
+            self._thread = None
+
+    def play(self) -> None:
+        with self._lock:
+            if self.finished:
+                return
+            self.paused = False
+            self._anchor()
+        self._wake.set()
+
+    def pause(self) -> None:
+        with self._lock:
+            self.paused = True
+            self._pending_rows = 0
+            self.achieved_speed = 0.0
+
+    def step(self, rows: int = 1) -> None:
+        """Send the next rows straight away, pausing playback first."""
+        with self._lock:
+            self.paused = True
+            self._pending_rows += rows
+        self._wake.set()
+
+    def set_speed(self, speed: float) -> None:
+        with self._lock:
+            self.speed = min(MAX_SPEED, max(MIN_SPEED, speed))
+            self._anchor()
+
+    def seek(self, row: int) -> None:
+        with self._lock:
+            self.position = min(self.rows, max(0, int(row)))
+            if self.position < self.rows:
+                self.sample_time = float(self.times[self.position])
+            self._pending_rows = 0
+            self._generation += 1
+            self._anchor()
+        for callback in self.on_seek:
+            callback()
+        self._wake.set()
+
+    def seek_time(self, elapsed: float) -> None:
+        """Seek to the first row at or after elapsed seconds into the recording."""
+        if self.rows:
+            self.seek(int(np.searchsorted(self.times, self.times[0] + elapsed, side="left")))
+
+    def seek_step(self, step: int) -> None:
+        """Seek to where an experiment step started, using the event channel's step index."""
+        entry = next((entry for entry in self.steps if entry["step"] == step), None)
+        if entry is None:
+            raise ValueError(f"{self.file_path} has no index entry for step {step}")
+        self.seek(entry["row"])
+
+    def _anchor(self) -> None:
+        """Restart the virtual clock from the current position. Call with the lock held."""
+        self._anchor_wall = perf_counter()
+        self._anchor_time = float(self.times[self.position]) if self.position < self.rows else self.sample_time
+        self._measure = (self._anchor_wall, self._anchor_time)
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            self._wake.wait(TICK)
+            self._wake.clear()
+            with self._lock:
+                start = self.position
+                generation = self._generation
+                playing = not self.paused
+                if self._pending_rows:
+                    stop = min(self.rows, start + self._pending_rows)
+                    self._pending_rows = 0
+                elif playing and start < self.rows:
+                    target = self._anchor_time + (perf_counter() - self._anchor_wall) * self.speed
+                    stop = int(np.searchsorted(self.times, target, side="right"))
+                else:
+                    continue
+            stop = min(stop, start + MAX_BLOCK)
+            deadline = perf_counter() + TICK * BUDGET if playing else None
+            sent = self._send(start, stop, deadline)
+            with self._lock:
+                if self._generation != generation:
+                    continue  # seeked while sending, the new position stands
+                self.position = start + sent
+                if self.position >= self.rows:
+                    self.paused = True
+                    self.achieved_speed = 0.0
+                elif playing and not self.paused:
+                    if sent < stop - start:
+                        self._anchor_time = float(self.times[self.position])  # couldn't keep up, let the clock slip
+                        self._anchor_wall = perf_counter()
+                    now = perf_counter()
+                    measured_wall, measured_time = self._measure
+                    if now - measured_wall >= SPEED_WINDOW:
+                        self.achieved_speed = (self.sample_time - measured_time) / (now - measured_wall)
+                        self._measure = (now, self.sample_time)
+
+    def _send(self, start: int, stop: int, deadline: float | None) -> int:
+        """Set each row's statuses on the devices and call their listeners. Returns how many rows were sent."""
+        if stop <= start:
+            return 0
+        block = np.asarray(self.index.data[:, start:stop]).T.tolist()
+        timestamps = self.times[start:stop].tolist()
+        sent = 0
+        for values, timestamp in zip(block, timestamps):
+            self.sample_time = timestamp
+            for device, keys in self._devices:
+                status = {key: values[column] for key, column in keys}
+                device.status = status
+                for listener in device.listeners:
+                    listener(status, timestamp)
+            sent += 1
+            if deadline is not None and perf_counter() > deadline:
+                break
+        return sent
+
+
+if __name__ == "__main__":
+    # Replay a recording into an unconnected Dyno and report how fast it went
+    import argparse
+    from time import sleep
+
+    from VDyno.model.dyno import Dyno
+
+    parser = argparse.ArgumentParser(description="Replay a VDyno recording into a Dyno.")
+    parser.add_argument("recording")
+    parser.add_argument("--speed", type=float, default=MAX_SPEED)
+    args = parser.parse_args()
+
+    dyno = Dyno(connect=False)
+    frames = {"count": 0}
+    dyno.add_listener(lambda status, timestamp: frames.__setitem__("count", frames["count"] + 1))
+    replayer = Replayer(dyno, args.recording, args.speed)
+    print(f"{replayer.rows} rows, {replayer.duration:.1f} s, {len(replayer.steps)} indexed steps")
+    started = perf_counter()
+    replayer.start()
+    while not replayer.finished:
+        sleep(0.1)
+    wall = perf_counter() - started
+    replayer.stop()
+    print(f"Replayed {frames['count']} frames in {wall:.2f} s ({replayer.duration / wall:.1f}x real time)")
+    print(dyno.parameter_estimator.summary())
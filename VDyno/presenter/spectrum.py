@@ -0,0 +1,197 @@
+"""
+VDyno - A PyQT based GUI for the V-Dyno project.
+
+This code contains the TorqueSpectrum class, a streaming spectral analysis of TorqueValue for spotting torque ripple and cogging.
+It listens to the Dyno and copies each torque frame, with the MUT speed at the time, into a ring buffer, which is all the
+acquisition threads pay for. process() (called by the spectrum view) then handles each new hop of samples:
+    - one FFT of the latest Hann windowed segment, so the cost is bounded per hop however long the average is,
+    - a Welch average of the last few segments, updated by adding the new periodogram and removing the oldest,
+    - the same periodogram resampled onto mechanical orders using the segment's mean speed, and averaged in the order domain,
+      so lines locked to the shaft stay sharp while the speed changes,
+    - a waterfall of recent periodograms in dB.
+Orders are per mechanical revolution. Electrical orders are multiples of the pole pair count, which comes from the
+Status_RPM_V1 calibration factor (1/7 for the 7 pole pair MUT).
+
+Frames arrive at the acquisition rate (at most ACQUISITION_RATE_HZ), which sets the Nyquist limit of what can be seen.
+The sample rate of each segment is measured from its timestamps.
+
+written by:
+    - Daniel Muir
+"""
+
+import threading
+
+import numpy as np
+
+CHANNEL = "TorqueValue"
+SPEED_CHANNEL = "Status_RPM_V1"
+MIN_ORDER_RPM = 60.0  # rpm, slower segments aren't added to the order spectrum
+
+
+def pole_pairs_from_calibration(calibration: dict, key: str = SPEED_CHANNEL) -> int:
+    """The VESC reports electrical rpm, so the rpm calibration factor is 1 / pole pairs."""
+    factor = calibration.get(key, {}).get("factor", 1.0)
+    return max(1, round(1 / factor)) if factor else 1
+
+
+class TorqueSpectrum:
+    def __init__(
+        self,
+        pole_pairs: int = 7,
+        segment: int = 256,
+        overlap: float = 0.5,
+        averages: int = 8,
+        waterfall_rows: int = 120,
+        max_order: float | None = None,
+        order_resolution: float = 0.05,
+    ) -> None:
+        self.pole_pairs = pole_pairs
+        self.segment = segment
+        self.hop = max(1, int(segment * (1 - overlap)))
+        self.averages = averages
+        self.window = np.hanning(segment)
+        self.window_power = float(np.sum(self.window**2))
+        bins = segment // 2 + 1
+        self.order_grid = np.arange(0.0, (max_order or 3 * pole_pairs) + order_resolution / 2, order_resolution)
+
+        # Ring buffer of samples, room for a few hops of backlog before the oldest unprocessed samples are overwritten
+        self.capacity = segment + 4 * self.hop
+        self._values = np.zeros(self.capacity)
+        self._times = np.zeros(self.capacity)
+        self._speeds = np.zeros(self.capacity)
+        self._offsets = np.arange(segment)
+        self._count = 0
+        self._next_end = segment
+        self._speed = 0.0
+        self._lock = threading.Lock()
+
+        # Welch average over the last averages segments, as a ring of periodograms and their running sum
+        self._periodograms = np.zeros((averages, bins))
+        self._psd_sum = np.zeros(bins)
+        self._order_periodograms = np.zeros((averages, len(self.order_grid)))
+        self._order_counts = np.zeros((averages, len(self.order_grid)))
+        self._order_sum = np.zeros(len(self.order_grid))
+        self._order_count_sum = np.zeros(len(self.order_grid))
+        self._rates = np.zeros(averages)
+        self._waterfall = np.full((waterfall_rows, bins), np.nan)
+        self.segments = 0
+        self.skipped = 0  # hops dropped because process() fell behind
+
+    def add(self, status: dict, timestamp: float) -> None:
+        """Dyno listener, O(1) per frame."""
+        if SPEED_CHANNEL in status:
+            self._speed = abs(status[SPEED_CHANNEL])
+        if CHANNEL not in status:
+            return
+        with self._lock:
+            slot = self._count % self.capacity
+            self._values[slot] = status[CHANNEL]
+            self._times[slot] = timestamp
+            self._speeds[slot] = self._speed
+            self._count += 1
+
+    def process(self, max_hops: int | None = None) -> int:
+        """Analyse the hops completed since the last call, at most max_hops (default: averages). Returns how many."""
+        max_hops = max_hops or self.averages
+        with self._lock:
+            count = self._count
+            # Skip hops whose samples have been overwritten, or that are more than max_hops behind
+            latest = self._next_end + (count - self._next_end) // self.hop * self.hop
+            oldest = max(count - self.capacity + self.segment, latest - (max_hops - 1) * self.hop)
+            if self._next_end < oldest:
+                skip = -(-(oldest - self._next_end) // self.hop)
+                self.skipped += skip
+                self._next_end += skip * self.hop
+            segments = []
+            while self._next_end <= count:
+                index = (self._next_end - self.segment + self._offsets) % self.capacity
+                segments.append((self._values[index], self._times[index], self._speeds[index]))
+                self._next_end += self.hop
+        for values, times, speeds in segments:
+            self._add_segment(values, times, speeds)
+        return len(segments)
+
+    def _add_segment(self, values: np.ndarray, times: np.ndarray, speeds: np.ndarray) -> None:
+        duration = times[-1] - times[0]
+        if duration <= 0:
+            return
+        rate = (self.segment - 1) / duration
+        spectrum = np.fft.rfft((values - values.mean()) * self.window)
+        periodogram = np.abs(spectrum) ** 2 * (2 / (rate * self.window_power))
+        periodogram[0] /= 2
+        if self.segment % 2 == 0:
+            periodogram[-1] /= 2
+
+        slot = self.segments % self.averages
+        self._psd_sum += periodogram - self._periodograms[slot]
+        self._periodograms[slot] = periodogram
+        self._rates[slot] = rate
+
+        # Order domain: frequency / shaft frequency, using the mean speed over the segment
+        order_periodogram = np.zeros(len(self.order_grid))
+        order_count = np.zeros(len(self.order_grid))
+        speed = float(speeds.mean())
+        if speed >= MIN_ORDER_RPM:
+            shaft_hz = speed / 60
+            orders = np.fft.rfftfreq(self.segment, 1 / rate) / shaft_hz
+            # Density per order rather than per Hz, so segments at different speeds add up consistently
+            order_periodogram = np.interp(self.order_grid, orders, periodogram * shaft_hz, right=np.nan)
+            order_count = np.isfinite(order_periodogram).astype(float)
+            order_periodogram = np.nan_to_num(order_periodogram)
+        self._order_sum += order_periodogram - self._order_periodograms[slot]
+        self._order_count_sum += order_count - self._order_counts[slot]
+        self._order_periodograms[slot] = order_periodogram
+        self._order_counts[slot] = order_count
+
+        self._waterfall[self.segments % len(self._waterfall)] = 10 * np.log10(periodogram + 1e-20)
+        self.segments += 1
+
+    @property
+    def sample_rate(self) -> float:
+        filled = min(self.segments, self.averages)
+        return float(self._rates[:filled].mean()) if filled else 0.0
+
+    def frequencies(self) -> np.ndarray:
+        return np.fft.rfftfreq(self.segment, 1 / self.sample_rate) if self.segments else np.zeros(0)
+
+    def psd(self) -> np.ndarray:
+        """Welch PSD (units^2/Hz) over the last averages segments."""
+        filled = min(self.segments, self.averages)
+        return self._psd_sum / filled if filled else np.zeros(0)
+
+    def order_psd(self) -> np.ndarray:
+        """Order tracked PSD (units^2/order) on order_grid, NaN for orders no recent segment reached."""
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return np.where(self._order_count_sum > 0.5, self._order_sum / self._order_count_sum, np.nan)
+
+    def electrical_orders(self, count: int = 3) -> list:
+        """Mechanical orders of the first few electrical harmonics."""
+        return [self.pole_pairs * k for k in range(1, count + 1)]
+
+    def waterfall(self) -> np.ndarray:
+        """(rows, bins) of recent periodograms in dB, oldest row first."""
+        rows = len(self._waterfall)
+        return np.roll(self._waterfall, -(self.segments % rows), axis=0)
+
+
+if __name__ == "__main__":
+    # A 150 rpm shaft with a ripple at the first electrical order (7x) and some noise, sampled at 200 Hz
+    from time import perf_counter
+
+    spectrum = TorqueSpectrum(pole_pairs=7, max_order=10)
+    rng = np.random.default_rng(0)
+    rate, rpm = 200.0, 150.0
+    for n in range(20000):
+        t = n / rate
+        shaft = rpm / 60 * t
+        torque = 1.0 + 0.05 * np.sin(2 * np.pi * 7 * shaft) + 0.01 * rng.standard_normal()
+        spectrum.add({SPEED_CHANNEL: rpm}, t)
+        spectrum.add({CHANNEL: torque}, t)
+        if n % 500 == 0:
+            started = perf_counter()
+            hops = spectrum.process()
+            cost = (perf_counter() - started) / max(hops, 1) * 1e6
+    orders = spectrum.order_psd()
+    peak = spectrum.order_grid[np.nanargmax(orders)]
+    print(f"{spectrum.segments} segments, {spectrum.skipped} hops skipped, {cost:.0f} us per hop")
+    print(f"Sample rate {spectrum.sample_rate:.1f} Hz, peak at order {peak:.2f} (expected 7)")
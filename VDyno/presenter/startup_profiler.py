@@ -0,0 +1,96 @@
+"""
+VDyno - A PyQT based GUI for the V-Dyno project.
+
+This code contains the StartupProfiler class, used by VDyno.py --profile-startup to report where cold start time goes.
+While enabled it times every top level import (PyQt6, pyqtgraph, numpy, cantools, can, serial...) and prints a line for
+each startup milestone as it is reached. Once every expected milestone has been passed, a summary table is printed.
+When disabled every method returns straight away.
+
+written by:
+    - Daniel Muir
+"""
+
+import builtins
+import sys
+import threading
+from time import perf_counter
+
+
+class StartupProfiler:
+    def __init__(self, enabled: bool = False) -> None:
+        self.enabled = enabled
+        self.started = perf_counter()
+        self.imports = {}  # top level package: seconds spent in its own module code
+        self.marks = []  # (label, seconds since start)
+        self.pending = set()
+        self._lock = threading.Lock()
+        self._stack = threading.local()
+        self._waiting = False
+        self._original_import = None
+
+    def install_import_hook(self) -> None:
+        """Time every first import of a module, charging each top level package only for its own time."""
+        if not self.enabled or self._original_import is not None:
+            return
+        self._original_import = builtins.__import__
+        original_import = self._original_import
+
+        def timed_import(name, globals=None, locals=None, fromlist=(), level=0):
+            if level != 0 or name in sys.modules:
+                return original_import(name, globals, locals, fromlist, level)
+            stack = getattr(self._stack, "value", None)
+            if stack is None:
+                stack = self._stack.value = []
+            stack.append(0.0)  # time spent in nested first imports
+            start = perf_counter()
+            try:
+                return original_import(name, globals, locals, fromlist, level)
+            finally:
+                elapsed = perf_counter() - start
+                nested = stack.pop()
+                if stack:
+                    stack[-1] += elapsed
+                package = name.partition(".")[0]
+                with self._lock:
+                    self.imports[package] = self.imports.get(package, 0.0) + elapsed - nested
+
+        builtins.__import__ = timed_import
+
+    def remove_import_hook(self) -> None:
+        if self._original_import is not None:
+            builtins.__import__ = self._original_import
+            self._original_import = None
+
+    def expect(self, *labels: str) -> None:
+        """Milestones that must all be marked before the summary is printed."""
+        if self.enabled:
+            with self._lock:
+                self.pending.update(labels)
+                self._waiting = True
+
+    def mark(self, label: str) -> None:
+        """Record that a milestone has been reached, safe to call from any thread."""
+        if not self.enabled:
+            return
+        elapsed = perf_counter() - self.started
+        with self._lock:
+            self.marks.append((label, elapsed))
+            self.pending.discard(label)
+            done = self._waiting and not self.pending
+            if done:
+                self._waiting = False
+        print(f"[startup] {elapsed * 1000:8.1f} ms  {label}")
+        if done:
+            self.report()
+
+    def report(self) -> None:
+        self.remove_import_hook()
+        print("[startup] imports (ms, excluding packages they import in turn):")
+        slowest = sorted(self.imports.items(), key=lambda item: -item[1])[:15]
+        for package, seconds in slowest:
+            print(f"[startup]   {seconds * 1000:8.1f}  {package}")
+        print("[startup] milestones (ms since start, time since previous):")
+        previous = 0.0
+        for label, elapsed in self.marks:
+            print(f"[startup]   {elapsed * 1000:8.1f}  +{(elapsed - previous) * 1000:7.1f}  {label}")
+            previous = elapsed
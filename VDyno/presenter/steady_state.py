@@ -0,0 +1,122 @@
+"""
+VDyno - A PyQT based GUI for the V-Dyno project.
+
+This code contains the SteadyStateDetector class, used by hold steps with "until": "steady" to move on as soon as the rig
+has settled instead of always waiting the full duration.
+It listens to the Dyno (Dyno.add_listener) and keeps a rolling window of each watched channel with running sums, so every
+frame costs O(1). A channel is steady when, over the last window seconds, both its standard deviation and the slope of a
+least squares line through it are within tolerance. The step holds for at least min_duration and at most duration.
+
+Hold step options (all optional apart from "until"):
+    "until": "steady",
+    "min_duration": 1.0,
+    "steady": {"window": 1.0, "channels": {"TorqueValue": {"std": 0.02, "slope": 0.01}}}
+
+written by:
+    - Daniel Muir
+"""
+
+import math
+import threading
+from collections import deque
+
+# Channel: (largest standard deviation, largest slope per second) still counted as steady
+DEFAULT_TOLERANCES = {
+    "TorqueValue": {"std": 0.02, "slope": 0.01},
+    "Status_RPM_V1": {"std": 10.0, "slope": 5.0},
+}
+DEFAULT_WINDOW = 1.0  # s
+DEFAULT_MIN_DURATION = 1.0  # s
+MIN_WINDOW_SAMPLES = 5
+RESUM_EVERY = 1000  # samples between exact recalculations of the running sums, to stop rounding error building up
+
+
+class _RollingWindow:
+    """Samples of one channel over the last window seconds, with the sums needed for variance and slope."""
+
+    def __init__(self, window: float) -> None:
+        self.window = window
+        self.samples = deque()
+        self.origin = None
+        self.updates = 0
+        self._zero()
+
+    def _zero(self) -> None:
+        self.n = 0
+        self.st = self.stt = self.sv = self.svv = self.stv = 0.0
+
+    def _include(self, t: float, v: float, sign: int) -> None:
+        self.n += sign
+        self.st += sign * t
+        self.stt += sign * t * t
+        self.sv += sign * v
+        self.svv += sign * v * v
+        self.stv += sign * t * v
+
+    def add(self, timestamp: float, value: float) -> None:
+        if self.origin is None:
+            self.origin = timestamp
+        t = timestamp - self.origin
+        self.samples.append((t, value))
+        self._include(t, value, 1)
+        while self.samples and self.samples[0][0] < t - self.window:
+            old_t, old_v = self.samples.popleft()
+            self._include(old_t, old_v, -1)
+        self.updates += 1
+        if self.updates % RESUM_EVERY == 0:
+            self._zero()
+            for old_t, old_v in self.samples:
+                self._include(old_t, old_v, 1)
+
+    @property
+    def span(self) -> float:
+        return self.samples[-1][0] - self.samples[0][0] if self.samples else 0.0
+
+    def statistics(self) -> dict:
+        n = self.n
+        if n < 2:
+            return {"count": n, "mean": self.sv / n if n else math.nan, "std": math.nan, "slope": math.nan}
+        mean = self.sv / n
+        variance = max(0.0, (self.svv - self.sv * mean) / (n - 1))
+        denominator = n * self.stt - self.st * self.st
+        slope = (n * self.stv - self.st * self.sv) / denominator if denominator > 0 else 0.0
+        return {"count": n, "mean": mean, "std": math.sqrt(variance), "slope": slope}
+
+
+class SteadyStateDetector:
+    def __init__(self, tolerances: dict | None = None, window: float = DEFAULT_WINDOW) -> None:
+        self.tolerances = tolerances or DEFAULT_TOLERANCES
+        self.window = window
+        self._windows = {name: _RollingWindow(window) for name in self.tolerances}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_step(cls, step: dict) -> "SteadyStateDetector":
+        options = step.get("steady", {})
+        return cls(options.get("channels"), options.get("window", DEFAULT_WINDOW))
+
+    def add(self, status: dict, timestamp: float) -> None:
+        """Dyno listener."""
+        with self._lock:
+            for name, value in status.items():
+                window = self._windows.get(name)
+                if window is not None:
+                    window.add(timestamp, value)
+
+    def statistics(self) -> dict:
+        """{channel: {"count", "mean", "std", "slope"}} over the current window."""
+        with self._lock:
+            return {name: window.statistics() for name, window in self._windows.items()}
+
+    def is_steady(self) -> bool:
+        with self._lock:
+            for name, window in self._windows.items():
+                if window.n < MIN_WINDOW_SAMPLES or window.span < 0.8 * self.window:
+                    return False
+                stats = window.statistics()
+                tolerance = self.tolerances[name]
+                if stats["std"] > tolerance.get("std", math.inf):
+                    return False
+                if abs(stats["slope"]) > tolerance.get("slope", math.inf):
+                    return False
+            return True
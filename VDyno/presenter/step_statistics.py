@@ -0,0 +1,177 @@
+"""
+VDyno - A PyQT based GUI for the V-Dyno project.
+
+This code contains the StepStatistics class, which keeps running statistics of every channel for the experiment step in
+progress and writes one summary row per step as each step ends, next to the recording (<recording>_steps.csv).
+It listens to the Dyno, so every frame is counted as it is decoded. Count, mean and variance use Welford's update,
+and the 5th, 50th and 95th percentiles use the P² sketch (Jain & Chlamtac, 1985). Both take O(1) time and memory per sample,
+so steps of any length cost the same.
+
+The summary files are what `python -m VDyno.analysis.results --from-steps` reads, so an efficiency map of a campaign
+can be made without reading any recording.
+
+written by:
+    - Daniel Muir
+"""
+
+import csv
+import math
+import os
+import threading
+from time import monotonic
+
+PERCENTILES = (0.05, 0.5, 0.95)
+STATISTICS = ("count", "mean", "std", "min", "max") + tuple(f"p{round(p * 100):02d}" for p in PERCENTILES)
+
+
+def summary_path(recording_path: str) -> str:
+    return os.path.splitext(recording_path)[0] + "_steps.csv"
+
+
+class P2Quantile:
+    """Streaming estimate of one quantile from five markers, without storing the samples."""
+
+    def __init__(self, p: float) -> None:
+        self.p = p
+        self.heights = []
+        self.positions = [1, 2, 3, 4, 5]
+        self.desired = [1, 1 + 2 * p, 1 + 4 * p, 3 + 2 * p, 5]
+        self.increments = [0, p / 2, p, (1 + p) / 2, 1]
+
+    def add(self, x: float) -> None:
+        q = self.heights
+        if len(q) < 5:
+            q.append(x)
+            q.sort()
+            return
+        n = self.positions
+        if x < q[0]:
+            q[0] = x
+            k = 0
+        elif x >= q[4]:
+            q[4] = x
+            k = 3
+        else:
+            k = 0
+            while x >= q[k + 1]:
+                k += 1
+        for i in range(k + 1, 5):
+            n[i] += 1
+        for i in range(5):
+            self.desired[i] += self.increments[i]
+        # Move the middle markers towards their desired positions
+        for i in (1, 2, 3):
+            d = self.desired[i] - n[i]
+            if (d >= 1 and n[i + 1] - n[i] > 1) or (d <= -1 and n[i - 1] - n[i] < -1):
+                d = 1 if d > 0 else -1
+                height = q[i] + d / (n[i + 1] - n[i - 1]) * (
+                    (n[i] - n[i - 1] + d) * (q[i + 1] - q[i]) / (n[i + 1] - n[i])
+                    + (n[i + 1] - n[i] - d) * (q[i] - q[i - 1]) / (n[i] - n[i - 1])
+                )
+                if not q[i - 1] < height < q[i + 1]:
+                    height = q[i] + d * (q[i + d] - q[i]) / (n[i + d] - n[i])
+                q[i] = height
+                n[i] += d
+
+    def value(self) -> float:
+        if not self.heights:
+            return math.nan
+        if len(self.heights) < 5:
+            return self.heights[int(round(self.p * (len(self.heights) - 1)))]
+        return self.heights[2]
+
+
+class ChannelStatistics:
+    def __init__(self) -> None:
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.minimum = math.inf
+        self.maximum = -math.inf
+        self.quantiles = [P2Quantile(p) for p in PERCENTILES]
+
+    def add(self, value: float) -> None:
+        if not math.isfinite(value):
+            return
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+        self.minimum = min(self.minimum, value)
+        self.maximum = max(self.maximum, value)
+        for quantile in self.quantiles:
+            quantile.add(value)
+
+    def summary(self) -> list:
+        """Values in the order of STATISTICS."""
+        if self.count == 0:
+            return [0] + [math.nan] * (len(STATISTICS) - 1)
+        std = math.sqrt(self.m2 / (self.count - 1)) if self.count > 1 else math.nan
+        return [self.count, self.mean, std, self.minimum, self.maximum] + [q.value() for q in self.quantiles]
+
+
+class StepStatistics:
+    def __init__(self, dyno: object, file_path: str | None = None) -> None:
+        """file_path is the summary csv to write, None to only keep the summaries in memory."""
+        self.dyno = dyno
+        self.file_path = file_path
+        self.channels = [name for source in dyno.sources for name in source.status]
+        self.summaries = []
+        self._current = None
+        self._step = None
+        self._lock = threading.Lock()
+
+    def attach(self) -> None:
+        self.dyno.add_listener(self.add)
+
+    def detach(self) -> None:
+        self.dyno.remove_listener(self.add)
+
+    def add(self, status: dict, timestamp: float) -> None:
+        """Dyno listener, runs on the acquisition threads."""
+        with self._lock:
+            if self._current is None:
+                return
+            for name, value in status.items():
+                statistics = self._current.get(name)
+                if statistics is not None:
+                    statistics.add(value)
+
+    def start_step(self, index: int, step: dict) -> None:
+        with self._lock:
+            self._current = {name: ChannelStatistics() for name in self.channels}
+            self._step = (index, step, monotonic())
+
+    def end_step(self, settle: dict | None = None) -> dict | None:
+        """Close the step in progress and write its row. settle is the steady hold result, if the step had one."""
+        with self._lock:
+            current, self._current = self._current, None
+            step = self._step
+        if current is None:
+            return None
+        index, definition, started = step
+        summary = {
+            "step": index,
+            "action": definition["action"],
+            "mut_property": definition["MUT"]["property"],
+            "mut_setpoint": definition["MUT"].get("value", definition["MUT"].get("end")),
+            "load_property": definition["load_motor"]["property"],
+            "load_setpoint": definition["load_motor"].get("value", definition["load_motor"].get("end")),
+            "duration": monotonic() - started,
+            "settled": "" if settle is None else settle["settled"],
+        }
+        for name, statistics in current.items():
+            for label, value in zip(STATISTICS, statistics.summary()):
+                summary[f"{name}_{label}"] = value
+        self.summaries.append(summary)
+        if self.file_path is not None:
+            self._write(summary)
+        return summary
+
+    def _write(self, summary: dict) -> None:
+        new_file = not os.path.exists(self.file_path)
+        with open(self.file_path, mode="a", newline="", encoding="utf-8") as file:
+            writer = csv.writer(file)
+            if new_file:
+                writer.writerow(summary.keys())
+            writer.writerow(summary.values())
@@ -0,0 +1,225 @@
+"""
+VDyno - A PyQT based GUI for the V-Dyno project.
+
+This code contains the Worker classes that run the Presenter's background tasks on a QThreadPool, and the Supervisor that
+owns them. Every task has a name, and the Supervisor won't start a task while one of the same name is still running, so a
+second click can't start a second experiment or control loop. The pool grows to a thread per running task, as the default
+of one thread per core would leave an experiment queued behind the control loop on a small PC.
+
+Each worker has a stop Event, passed to its function as the stop keyword if it asks for one, and a done Event set when its
+function returns. Stopping sets the stop Event (and calls the task's on_stop, e.g. TestAutomator.stop_experiment), and
+joining waits on done with a timeout, so shutdown waits for the tasks without hanging on one that is stuck. Tasks wait on
+their stop Event rather than sleeping, so they finish within STOP_TIMEOUT of being asked. A task still running after that
+is reported, not waited for.
+
+health() reports the state of every task: running, stopping, finished, stopped or failed, how long it ran and its errors.
+
+Threading is handled by QThreadPool, built using a tutorial avaliable by PythonGUIs.com: https://www.pythonguis.com/tutorials/multithreading-pyqt-applications-qthreadpool/
+
+written by:
+    - Daniel Muir
+"""
+
+import sys
+import threading
+import traceback
+from time import monotonic
+
+from PyQt6.QtCore import QObject, QRunnable, QThreadPool, pyqtSignal, pyqtSlot
+
+STOP_TIMEOUT = 0.05  # s a stopped task has to finish before it is reported as stuck
+ERROR_BACKOFF = 1 / 40  # s an InfiniteWorker waits after an error, so a failing task doesn't spin
+
+
+class WorkerSignals(QObject):
+    finished = pyqtSignal()
+    error = pyqtSignal(tuple)
+    result = pyqtSignal(object)
+    progress = pyqtSignal(int)
+    stop = pyqtSignal()
+
+
+class Worker(QRunnable):
+    """
+    Worker thread
+
+    Inherits from QRunnable to handler worker thread setup, signals and wrap-up.
+
+    :param callback: The function callback to run on this worker thread. Supplied args and
+                     kwargs will be passed through to the runner.
+    :type callback: function
+    :param args: Arguments to pass to the callback function
+    :param kwargs: Keywords to pass to the callback function, a stop keyword is given the worker's stop Event
+
+    """
+
+    def __init__(self, fn, *args, **kwargs):
+        super().__init__()
+        self.setAutoDelete(False)  # the Supervisor keeps it for health reports after it finishes
+
+        # Store constructor arguments (re-used for processing)
+        self.fn = fn
+        self._args = args
+        self._kwargs = kwargs
+        self.signals = WorkerSignals()
+        self.name = fn.__name__
+        self.stop_event = threading.Event()
+        self.done = threading.Event()
+        if "stop" in kwargs:
+            self._kwargs["stop"] = self.stop_event
+        self.on_stop = []  # called by stop(), for functions that have their own way of being stopped
+        self.state = "queued"
+        self.started = None
+        self.finished = None
+        self.errors = 0
+        self.last_error = None
+
+    def _call(self) -> object:
+        try:
+            return self.fn(*self._args, **self._kwargs)
+        except Exception as e:
+            print(f"Error in worker thread {self.name}: {e}")
+            traceback.print_exc()
+            self.errors += 1
+            self.last_error = repr(e)
+            exctype, value = sys.exc_info()[:2]
+            self.signals.error.emit((exctype, value, traceback.format_exc()))
+            raise
+
+    @pyqtSlot()
+    def run(self):
+        """
+        Initialise the runner function with passed args, kwargs.
+        """
+        threading.current_thread().name = self.name
+        self.started = monotonic()
+        self.state = "running"
+        failed = False
+        try:
+            if not self.stop_event.is_set():  # stopped while still queued
+                self.signals.result.emit(self._call())  # Return the result of the processing
+        except Exception:
+            failed = True
+        finally:
+            self.finished = monotonic()
+            self.state = "failed" if failed else "stopped" if self.stop_event.is_set() else "finished"
+            self.done.set()
+            self.signals.finished.emit()  # Done
+            threading.current_thread().name = "idle pool thread"  # the pool keeps it for the next task
+
+    def stop(self):
+        if self.stop_event.is_set():
+            return
+        self.stop_event.set()
+        if self.state == "running":
+            self.state = "stopping"
+        for on_stop in self.on_stop:
+            try:
+                on_stop()
+            except Exception as e:
+                print(f"Error stopping {self.name}: {e}")
+
+    def join(self, timeout: float | None = None) -> bool:
+        """Wait for the function to return. False if it is still running after timeout seconds."""
+        return self.done.wait(timeout)
+
+    def health(self) -> str:
+        end = self.finished if self.finished is not None else monotonic()
+        ran = f", {end - self.started:.1f} s" if self.started is not None else ""
+        errors = f", {self.errors} errors (last: {self.last_error})" if self.errors else ""
+        return f"{self.name}: {self.state}{ran}{errors}"
+
+
+class InfiniteWorker(Worker):
+    """Worker that calls its function again and again until stopped. An error is reported and the loop carries on."""
+
+    def __init__(self, fn, *args, **kwargs):
+        super().__init__(fn, *args, **kwargs)
+        # Name the pool thread after its job so it can be told apart in traces
+        if args:
+            self.name += f": {type(args[0]).__name__}{getattr(args[0], 'vesc_number', '')}"
+
+    def _call(self) -> None:
+        while not self.stop_event.is_set():
+            try:
+                super()._call()
+            except Exception:
+                self.stop_event.wait(ERROR_BACKOFF)
+
+
+class Supervisor:
+    def __init__(self, threadpool: QThreadPool | None = None) -> None:
+        self.threadpool = threadpool or QThreadPool()
+        self.workers = {}  # task name: the latest worker started under it
+        self._lock = threading.Lock()
+
+    def start(self, name: str, worker: Worker, on_stop=None) -> bool:
+        """Start a worker as the named task. Returns False, without starting it, if the task is already running."""
+        with self._lock:
+            current = self.workers.get(name)
+            if current is not None and not current.done.is_set():
+                print(f"Not starting {name}: it is already running.")
+                return False
+            worker.name = name
+            if on_stop is not None:
+                worker.on_stop.append(on_stop)
+            self.workers[name] = worker
+            # Tasks run for minutes, not milliseconds, so each needs a thread of its own rather than a turn on one
+            busy = sum(not w.done.is_set() for w in self.workers.values())
+            if busy > self.threadpool.maxThreadCount():
+                self.threadpool.setMaxThreadCount(busy)
+        self.threadpool.start(worker)
+        return True
+
+    def running(self, name: str) -> bool:
+        worker = self.workers.get(name)
+        return worker is not None and not worker.done.is_set()
+
+    def stop(self, name: str, timeout: float | None = STOP_TIMEOUT) -> bool:
+        """Stop a task and wait up to timeout seconds for it. Returns False if it is still running."""
+        worker = self.workers.get(name)
+        if worker is None:
+            return True
+        worker.stop()
+        return worker.join(timeout)
+
+    def stop_all(self, timeout: float = STOP_TIMEOUT) -> list[str]:
+        """Stop every task, then wait up to timeout seconds in all for them. Returns the tasks still running."""
+        with self._lock:
+            workers = list(self.workers.values())
+        for worker in workers:
+            worker.stop()
+        deadline = monotonic() + timeout
+        stuck = [worker.name for worker in workers if not worker.join(max(0.0, deadline - monotonic()))]
+        for name in stuck:
+            print(f"{name} didn't stop within {timeout * 1000:.0f} ms, see the health report.")
+        return stuck
+
+    def health(self) -> list[str]:
+        with self._lock:
+            return [worker.health() for worker in self.workers.values()]
+
+    def summary(self) -> str:
+        return "tasks: " + ("; ".join(self.health()) or "none started")
+
+
+if __name__ == "__main__":
+    # Start a loop and a long sleep, refuse a duplicate, then time how long stopping them takes
+    from time import perf_counter, sleep
+
+    def tick(stop: threading.Event) -> None:
+        stop.wait(0.005)
+
+    def hold(seconds: float, stop: threading.Event) -> None:
+        stop.wait(seconds)
+
+    supervisor = Supervisor()
+    supervisor.start("control loop", InfiniteWorker(tick, stop=None))
+    supervisor.start("experiment", Worker(hold, 60, stop=None))
+    print("Duplicate started:", supervisor.start("experiment", Worker(hold, 60, stop=None)))
+    sleep(0.2)
+    print(supervisor.summary())
+    started = perf_counter()
+    stuck = supervisor.stop_all()
+    print(f"Stopped in {(perf_counter() - started) * 1000:.1f} ms, stuck: {stuck or 'none'}")
+    print(supervisor.summary())
@@ -4,13 +4,21 @@ VDyno - A PyQT based GUI for the V-Dyno project.
 This code contains the TestAutomator class, which reads a JSON file containing the experiment steps and executes them using the ExperimentWorker class.
 The idea is to allow for easy definition of experiment steps without code changes. Ideally JSON files could one day be made via GUI. JSON files are stored in VDyno/experiments.
 JSON was chosen because I like it, can easily be replaced if required.
+Hold steps with "until": "steady" end as soon as the rig settles, see steady_state.py. They need the dyno to be passed in.
+Given a StepStatistics, each step's statistics are started and ended with the step, see step_statistics.py.
+Given an events callback (usually FileSaver.log_event), the experiment start and stop and each step's start, with its
+setpoints, and end are added to the recording's event channel.
+Given a clock (anything with sleep() and monotonic(), such as dry_run.SimulatedRig), steps are timed by it instead of the
+wall clock, so an experiment can be run against a simulated rig faster than real time.
+Without one, steps wait on the worker's stopped Event, so stop_experiment ends even a long hold straight away.
 
 written by:
     - Daniel Muir
 """
 
 import json
-from time import sleep
+import threading
+from time import monotonic
 from typing import Protocol
 
 if __name__ == "__main__":
@@ -19,22 +27,56 @@ if __name__ == "__main__":
 
     sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
 
+from VDyno.presenter.steady_state import DEFAULT_MIN_DURATION, SteadyStateDetector
+
+STEADY_POLL = 0.05  # s between steady state checks
+
 
 class MainWindow(Protocol): ...
 
 
 class ExperimentWorker:
-    def __init__(self, parent: MainWindow, steps: list) -> None:
+    def __init__(
+        self,
+        parent: MainWindow,
+        steps: list,
+        progress_callback=None,
+        dyno: object = None,
+        step_statistics: object = None,
+        events=None,
+        clock: object = None,
+    ) -> None:
         super().__init__()
         self.parent = parent
         self.steps = steps
-        self.running = True
+        self.progress_callback = progress_callback  # called with the index of each step as it starts
+        self.dyno = dyno  # needed for "until": "steady" holds
+        self.step_statistics = step_statistics
+        self.events = events  # called with (event, step, **detail)
+        self.stopped = threading.Event()
+        # Waiting on stopped rather than sleeping, so stop_experiment ends a long hold straight away
+        self.sleep = clock.sleep if clock is not None else self.stopped.wait
+        self.monotonic = clock.monotonic if clock is not None else monotonic
+        self.settle_statistics = {}  # step index: statistics where a steady hold ended
+
+    @property
+    def running(self) -> bool:
+        return not self.stopped.is_set()
+
+    @running.setter
+    def running(self, running: bool) -> None:
+        if running:
+            self.stopped.clear()
+        else:
+            self.stopped.set()
 
     def execute_step(self, step: dict) -> None:
         """Execute a single step for both motors."""
         self.mut_property = step["MUT"]["property"]
         self.load_property = step["load_motor"]["property"]
         self.duration = step["duration"]
+        if "torque" not in (self.mut_property, self.load_property):
+            self.parent.change_torque(None)
 
         if step["action"] == "ramp":
             self.mut_start = step["MUT"]["start"]
@@ -45,7 +87,10 @@ class ExperimentWorker:
         elif step["action"] == "hold":
             self.mut_start = step["MUT"]["value"]
             self.load_start = step["load_motor"]["value"]
-            self.hold()
+            if step.get("until") == "steady":
+                self.hold_until_steady(step)
+            else:
+                self.hold()
 
     def ramp(self) -> None:
         """Ramp both motors' properties simultaneously."""
@@ -59,50 +104,121 @@ class ExperimentWorker:
         for _ in range(steps):
             if not self.running:
                 return
-            if self.mut_property == "current":
-                self.parent.change_MUT_current(float(mut_current_value))
-            if self.load_property == "rpm":
-                self.parent.change_load_rpm(int(load_current_value))
+            self.apply(mut_current_value, load_current_value)
             mut_current_value += mut_step_size
             load_current_value += load_step_size
-            sleep(step_duration)
+            self.sleep(step_duration)
 
     def hold(self) -> None:
         """Hold both motors' properties at specific values."""
         if not self.running:
             return
+        self.apply(self.mut_start, self.load_start)
+        self.sleep(self.duration)
+
+    def hold_until_steady(self, step: dict) -> None:
+        """Hold until the watched channels settle, for between min_duration and duration seconds."""
+        if self.dyno is None:
+            print("No dyno to watch for a steady hold, holding for the full duration.")
+            self.hold()
+            return
+        if not self.running:
+            return
+        detector = SteadyStateDetector.from_step(step)
+        min_duration = min(step.get("min_duration", DEFAULT_MIN_DURATION), self.duration)
+        self.dyno.add_listener(detector.add)
+        try:
+            self.apply(self.mut_start, self.load_start)
+            started = self.monotonic()
+            settled = False
+            while self.running:
+                elapsed = self.monotonic() - started
+                if elapsed >= min_duration and detector.is_steady():
+                    settled = True
+                    break
+                if elapsed >= self.duration:
+                    break
+                self.sleep(min(STEADY_POLL, max(0.0, self.duration - elapsed)))
+        finally:
+            self.dyno.remove_listener(detector.add)
+        elapsed = self.monotonic() - started
+        self.settle_statistics[self.step_index] = {
+            "settled": settled,
+            "elapsed": elapsed,
+            "channels": detector.statistics(),
+        }
+        print(f"{'Steady' if settled else 'Not steady'} after {elapsed:.2f} s of at most {self.duration} s")
+
+    def apply(self, mut_value: float, load_value: float) -> None:
+        """Send one pair of setpoints, a torque property switches that motor to closed loop torque control."""
         if self.mut_property == "current":
-            self.parent.change_MUT_current(self.mut_start)
+            self.parent.change_MUT_current(float(mut_value))
+        elif self.mut_property == "torque":
+            self.parent.change_torque(float(mut_value), "MUT")
         if self.load_property == "rpm":
-            self.parent.change_load_rpm(self.load_start)
-        sleep(self.duration)
+            self.parent.change_load_rpm(int(load_value))
+        elif self.load_property == "torque":
+            self.parent.change_torque(float(load_value), "load_motor")
+
+    def log_event(self, event: str, step: int | None = None, **detail) -> None:
+        if self.events is not None:
+            self.events(event, step, **detail)
 
     def run(self) -> None:
         """Run the experiment steps."""
         print("Experiment started")
-        for step in self.steps:
+        self.log_event("experiment_start", steps=len(self.steps))
+        for index, step in enumerate(self.steps):
             print(f"Executing step: {step}")
             if not self.running:
                 break
+            if self.progress_callback is not None:
+                self.progress_callback(index)
+            self.step_index = index
+            if self.step_statistics is not None:
+                self.step_statistics.start_step(index, step)
+            self.log_event("step_start", index, **step)
             self.execute_step(step)
+            settle = self.settle_statistics.get(index)
+            self.log_event("step_end", index, **({"settled": settle["settled"]} if settle else {}))
+            if self.step_statistics is not None:
+                self.step_statistics.end_step(settle)
+        self.parent.change_torque(None)
         self.parent.change_MUT_current(0)
         self.parent.change_load_rpm(0)
+        self.log_event("experiment_stop", completed=self.running)
         print("Experiment stopped or completed.")
 
 
 class TestAutomator:
-    def __init__(self, parent: MainWindow, stop=False) -> None:
+    def __init__(self, parent: MainWindow, dyno: object = None, stop=False) -> None:
         self.parent = parent
+        self.dyno = dyno
 
-    def start_experiment(self, experiment_file: str) -> None:
-        """Execute an experiment defined in a JSON file."""
+    def start_experiment(
+        self, experiment_file: str, progress_callback=None, step_statistics=None, events=None
+    ) -> bool:
+        """Execute an experiment defined in a JSON file. Returns False if it was stopped early."""
         with open(experiment_file, "r") as file:
             experiment = json.load(file)
 
-        steps = experiment["steps"]
-        self.worker = ExperimentWorker(self.parent, steps)
-        self.worker.run()
-        return
+        return self.run_steps(experiment["steps"], progress_callback, step_statistics, events)
+
+    def run_steps(
+        self, steps: list, progress_callback=None, step_statistics=None, events=None, clock=None
+    ) -> bool:
+        """Execute a list of steps in the same format as the experiment files."""
+        self.worker = ExperimentWorker(
+            self.parent, steps, progress_callback, self.dyno, step_statistics, events, clock
+        )
+        if step_statistics is not None:
+            step_statistics.attach()
+        try:
+            self.worker.run()
+        finally:
+            if step_statistics is not None:
+                step_statistics.detach()
+        return self.worker.running
 
     def _on_experiment_finished(self):
         """Handle experiment completion."""
@@ -115,7 +231,8 @@ class TestAutomator:
     def stop_experiment(self) -> None:
         """Stop the experiment."""
         print("Stopping experiment...")
-        self.worker.running = False
+        if hasattr(self, "worker"):
+            self.worker.running = False
 
 
 if __name__ == "__main__":
@@ -130,6 +247,10 @@ if __name__ == "__main__":
             ...
             # print(f"Setting load motor RPM to {value}")
 
+        def change_torque(self, value: float | None, actuator: str = "MUT") -> None:
+            ...
+            # print(f"Setting {actuator} torque to {value}")
+
     dyno = DummyDyno()
     automator = TestAutomator(dyno)
 
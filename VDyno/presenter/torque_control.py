@@ -0,0 +1,176 @@
+"""
+VDyno - A PyQT based GUI for the V-Dyno project.
+
+This code contains the closed loop torque mode. TorqueControl is run by the control loop every tick: with no torque
+setpoint it sends the open loop MUT current and load RPM as before, and with one it adjusts either the MUT current or
+the load motor brake current until the torque transducer reads the setpoint.
+
+The PID works on torque magnitude, so the transducer's mounting direction doesn't matter; the sign of the setpoint sets
+the direction of the MUT current. Feed-forward is setpoint / torque constant, leaving the PID to correct for friction and
+constant error. Anti-windup is by back-calculation: whatever the output limit clips is bled back out of the integral.
+
+The PID only closes the loop on a fresh reading: if the transducer hasn't reported within TORQUE_STALE_PERIODS control
+periods (or not at all since connecting) the actuator is sent zero current and the PID is reset, and the loop picks up
+again from the feed-forward once readings return. The other motor is still sent its open loop setpoint.
+
+In experiment files, use "property": "torque" with values in Nm on the MUT (drives the MUT current) or the load motor
+(drives the load brake current), in hold or ramp steps.
+
+written by:
+    - Daniel Muir
+"""
+
+import math
+from time import time
+
+if __name__ == "__main__":
+    import os
+    import sys
+
+    sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
+
+from VDyno.analysis.brake_envelope import RIG_CURRENT_LIMIT, RIG_TORQUE_CONSTANT
+
+# A/Nm, A/(Nm s), A s/Nm. The loop gain through the motor is kp * Kt, kept well under 1 as feed-forward does most of the work
+DEFAULT_GAINS = (5.0, 100.0, 0.0)
+DERIVATIVE_FILTER = 0.02  # s, time constant of the low pass on the derivative term
+TORQUE_STALE_PERIODS = 10  # control periods without a torque frame before the actuator is zeroed
+
+
+class PID:
+    def __init__(
+        self,
+        kp: float,
+        ki: float,
+        kd: float,
+        output_min: float,
+        output_max: float,
+        derivative_filter: float = DERIVATIVE_FILTER,
+    ) -> None:
+        self.kp = kp
+        self.ki = ki
+        self.kd = kd
+        self.output_min = output_min
+        self.output_max = output_max
+        self.derivative_filter = derivative_filter
+        # Back-calculation tracking gain (1/s), bleeding clipped output out of the integral over one integral time
+        self.tracking_gain = ki / kp if kp > 0 else 10.0
+        self.reset()
+
+    def reset(self) -> None:
+        self.integral = 0.0
+        self.derivative = 0.0
+        self.previous_measurement = None
+
+    def update(self, setpoint: float, measured: float, dt: float, feed_forward: float = 0.0) -> float:
+        error = setpoint - measured
+        # Derivative of the measurement rather than the error, so setpoint steps don't kick the output
+        if self.previous_measurement is not None and dt > 0:
+            raw = -(measured - self.previous_measurement) / dt
+            self.derivative += dt / (self.derivative_filter + dt) * (raw - self.derivative)
+        self.previous_measurement = measured
+
+        unsaturated = feed_forward + self.kp * error + self.integral + self.kd * self.derivative
+        output = min(self.output_max, max(self.output_min, unsaturated))
+        self.integral += (self.ki * error + self.tracking_gain * (output - unsaturated)) * dt
+        return output
+
+
+class TorqueControl:
+    def __init__(
+        self,
+        torque_constant: float = RIG_TORQUE_CONSTANT,
+        current_limit: float = RIG_CURRENT_LIMIT,
+        gains: tuple = DEFAULT_GAINS,
+        clock=time,
+    ) -> None:
+        """clock must match the timestamps the torque transducer's updated is set from, e.g. a dry run's virtual clock."""
+        self.torque_constant = torque_constant
+        self.setpoint = None  # Nm, None for open loop
+        self.actuator = "MUT"  # "MUT" (MUT current) or "load_motor" (load brake current)
+        self.pid = PID(*gains, output_min=0.0, output_max=current_limit)
+        self.output = 0.0
+        self.clock = clock
+        self.stale = False  # the last tick zeroed the actuator for want of a torque reading
+
+    @property
+    def active(self) -> bool:
+        return self.setpoint is not None
+
+    def set_setpoint(self, torque: float | None, actuator: str = "MUT") -> None:
+        """Track torque (Nm) using actuator, or return to open loop with None."""
+        if torque is None or actuator != self.actuator or not self.active:
+            self.pid.reset()
+        self.setpoint = torque
+        self.actuator = actuator
+
+    def tick(self, dyno: object, desired_MUT_current: float, desired_load_rpm: float, dt: float) -> None:
+        """Send this tick's commands to both motors."""
+        # Read once, set_setpoint may be called from another thread part way through the tick
+        setpoint, actuator = self.setpoint, self.actuator
+        if setpoint is None:
+            dyno.MUT.set_current(desired_MUT_current)
+            dyno.load_motor.set_rpm(desired_load_rpm)
+            return
+        if dyno.MUT.lockout or dyno.load_motor.lockout:
+            # The interlock is holding the outputs at zero, don't let the integral wind up meanwhile
+            self.pid.reset()
+        transducer = dyno.torque_transducer
+        updated = transducer.updated
+        if updated is None or self.clock() - updated > TORQUE_STALE_PERIODS * dt:
+            if not self.stale:
+                since = "never received" if updated is None else f"{(self.clock() - updated) * 1000:.0f} ms old"
+                print(f"Torque reading {since}, holding the {actuator} at zero current until it returns.")
+                self.stale = True
+            self.pid.reset()
+            self.output = 0.0
+        else:
+            if self.stale:
+                print("Torque reading back, closing the loop again.")
+                self.stale = False
+            measured = abs(transducer.status["TorqueValue"])
+            target = abs(setpoint)
+            self.output = self.pid.update(target, measured, dt, feed_forward=target / self.torque_constant)
+        if actuator == "MUT":
+            dyno.MUT.set_current(math.copysign(self.output, setpoint))
+            dyno.load_motor.set_rpm(desired_load_rpm)
+        else:
+            dyno.MUT.set_current(desired_MUT_current)
+            dyno.load_motor.set_brake_current(self.output)
+
+
+if __name__ == "__main__":
+    # Step response against a first order motor model with friction, to sanity check the gains
+    class Device:
+        def __init__(self) -> None:
+            self.status = {"TorqueValue": 0.0}
+            self.updated = 0.0
+            self.lockout = False
+            self.current = 0.0
+
+        def set_current(self, value: float) -> None:
+            self.current = value
+
+        def set_rpm(self, value: float) -> None: ...
+
+    class Plant:
+        def __init__(self) -> None:
+            self.MUT = Device()
+            self.load_motor = Device()
+            self.torque_transducer = Device()
+            self.now = 0.0
+
+    plant = Plant()
+    pid_loop = TorqueControl(clock=lambda: plant.now)
+    dt = 1 / 200
+    pid_loop.set_setpoint(1.5)
+    for tick in range(200):
+        pid_loop.tick(plant, 0, 0, dt)
+        # 0.9 of the nominal torque constant, 0.1 Nm friction and a 10 ms lag to the transducer
+        steady = max(0.0, 0.9 * RIG_TORQUE_CONSTANT * plant.MUT.current - 0.1)
+        torque = plant.torque_transducer.status["TorqueValue"]
+        plant.torque_transducer.status["TorqueValue"] = torque + dt / (0.01 + dt) * (steady - torque)
+        plant.now += dt
+        plant.torque_transducer.updated = plant.now
+        if tick % 20 == 0:
+            print(f"{tick * dt:5.2f} s  {plant.torque_transducer.status['TorqueValue']:.3f} Nm  {plant.MUT.current:.1f} A")
@@ -3,16 +3,41 @@ VDyno - A PyQT based GUI for the V-Dyno project.
 
 This code contains PlotData and PlotWindow classes, which together form a live plot of the data from the dyno object.
 To speed up processing, the plotting is done in a separate thread using PyQTGraph's RemoteGraphicsView. The plotting was based on the remotePlot example from PyQTGraph.
+Each Plot_Data also has a HistoryPyramid, so a small overview beside each live plot can show the whole run as a min/max band and mean,
+using bounded memory and a fixed number of points however long the run. The pyramids are fed from a Dyno listener, once per
+calibrated sample, so a spike between two timer ticks still shows in the overview. The live window is sampled on the ticks.
+
+Samples are taken on every timer tick, but a frame is only sent to the remote process once it has acknowledged the previous
+one (FramePacer). Ticks in between just update the local buffers, so a slow renderer sees fewer, newer frames instead of a
+growing queue of _callSync="off" requests. The send interval follows the measured round trip, between MIN_DRAW_FPS and
+MAX_DRAW_FPS, and the achieved rate is shown under the plot selectors. The remote methods called every frame are looked up
+once, as each attribute lookup on a remote proxy is a blocking round trip of its own.
 
 written by:
     - Daniel Muir
 """
 
 import pyqtgraph as pg
-from PyQt6.QtWidgets import QComboBox
-from numpy import zeros
+from PyQt6.QtWidgets import QComboBox, QLabel
+from numpy import zeros, absolute, arange, empty, repeat
+from time import perf_counter
+import threading
 from typing import Protocol
 
+if __name__ == "__main__":
+    import os
+    import sys
+
+    sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
+
+from VDyno.analysis.brake_envelope import rig_envelope
+from VDyno.model.tracing import traced
+
+MIN_DRAW_FPS = 5
+MAX_DRAW_FPS = 30
+ACK_TIMEOUT = 1.0  # s, draw anyway if a frame hasn't been acknowledged by then
+
+
 class Presenter(Protocol):  # allow for duck-typing of presenter class
     def plot_MUT_changed(self, index: int) -> None: ...
     def plot_load_changed(self, index: int) -> None: ...
@@ -26,14 +51,188 @@ def setup_dropdown(options: list) -> object:
     return dropdown
 
 
+class _PyramidLevel:
+    """Completed bins of one resolution, plus the bin being filled."""
+
+    def __init__(self, capacity: int) -> None:
+        self.mins = empty(capacity)
+        self.maxs = empty(capacity)
+        self.sums = empty(capacity)
+        self.counts = zeros(capacity, dtype=int)
+        self.length = 0
+        self.full = False  # once full, bins are only passed up to the next level
+        self.partial = None  # [min, max, sum, count, bins merged]
+
+    def merge(self, low: float, high: float, total: float, count: int) -> None:
+        if self.partial is None:
+            self.partial = [low, high, total, count, 1]
+        else:
+            partial = self.partial
+            partial[0] = min(partial[0], low)
+            partial[1] = max(partial[1], high)
+            partial[2] += total
+            partial[3] += count
+            partial[4] += 1
+
+    def store(self, low: float, high: float, total: float, count: int) -> None:
+        if self.full:
+            return
+        if self.length == len(self.mins):
+            # A coarser level covers the run from now on, this one is never read again
+            self.full = True
+            self.mins = self.maxs = self.sums = self.counts = None
+            return
+        self.mins[self.length] = low
+        self.maxs[self.length] = high
+        self.sums[self.length] = total
+        self.counts[self.length] = count
+        self.length += 1
+
+
+class HistoryPyramid:
+    """
+    Min, max and mean of every sample since the start, at several resolutions.
+
+    Level k bins hold base * factor**k samples and keep at most capacity bins. The whole run is always covered by the
+    finest level that hasn't filled up, so memory grows only with the log of the run length and each sample costs
+    amortised constant time.
+    """
+
+    def __init__(self, base: int = 4, factor: int = 2, capacity: int = 512) -> None:
+        self.base = base
+        self.factor = factor
+        self.capacity = capacity
+        self.count = 0
+        self.levels = [_PyramidLevel(capacity)]
+        self._lock = threading.Lock()  # samples arrive on the acquisition threads, overviews are read on the GUI thread
+
+    def add(self, value: float) -> None:
+        with self._lock:
+            self._add(float(value))
+
+    def _add(self, value: float) -> None:
+        self.count += 1
+        level = self.levels[0]
+        level.merge(value, value, value, 1)
+        if level.partial[4] < self.base:
+            return
+        # A bin is complete, store it and pass it up until a level's bin is still filling
+        number = 0
+        while True:
+            low, high, total, count, _ = level.partial
+            level.partial = None
+            level.store(low, high, total, count)
+            number += 1
+            if number == len(self.levels):
+                self.levels.append(_PyramidLevel(self.capacity))
+            level = self.levels[number]
+            level.merge(low, high, total, count)
+            if level.partial[4] < self.factor:
+                return
+
+    def overview(self) -> tuple:
+        """(first sample of each bin, mins, maxs, means) covering the whole run."""
+        with self._lock:
+            return self._overview()
+
+    def _overview(self) -> tuple:
+        for number, level in enumerate(self.levels):
+            if not level.full:
+                break
+        size = self.base * self.factor**number
+        length = level.length
+        mins, maxs = level.mins[:length], level.maxs[:length]
+        means = level.sums[:length] / level.counts[:length]
+        if level.partial is not None:
+            low, high, total, count, _ = level.partial
+            mins, maxs = list(mins) + [low], list(maxs) + [high]
+            means = list(means) + [total / count]
+        return arange(len(mins)) * size, mins, maxs, means
+
+
+class FramePacer:
+    """
+    Decides when the next frame may be sent to the remote plot process.
+
+    A frame is sent with an asynchronous request for the remote perf_counter, which is answered once the remote process has
+    worked through the frame's calls. Until then, and until the adaptive interval has passed, ready() says no.
+    perf_counter is the system monotonic clock, so the remote time can be compared with the local one.
+    """
+
+    def __init__(self, min_fps: float = MIN_DRAW_FPS, max_fps: float = MAX_DRAW_FPS) -> None:
+        self.min_interval = 1 / max_fps
+        self.max_interval = 1 / min_fps
+        self.interval = self.min_interval
+        self.latency = 0.0  # s, smoothed time from sending a frame to the remote process finishing it
+        self.cost = 0.0  # s, smoothed time spent sending a frame
+        self.pending = None
+        self.sent_at = 0.0
+        self.drawn = 0
+        self.coalesced = 0  # ticks that only updated the buffers
+        self.fps = 0.0
+        self._window_start = perf_counter()
+        self._window_drawn = 0
+
+    def ready(self, now: float) -> bool:
+        if self.pending is not None:
+            if self.pending.hasResult():
+                self._acknowledged(self.pending.result())
+            elif now - self.sent_at > ACK_TIMEOUT:
+                self._acknowledged(now)
+            else:
+                self.coalesced += 1
+                return False
+        if now - self.sent_at < self.interval:
+            self.coalesced += 1
+            return False
+        return True
+
+    def sent(self, request: object, started: float, cost: float) -> None:
+        self.pending = request
+        self.sent_at = started
+        self.cost += 0.2 * (cost - self.cost)
+        self.drawn += 1
+        self._window_drawn += 1
+        elapsed = started - self._window_start
+        if elapsed >= 1.0:
+            self.fps = self._window_drawn / elapsed
+            self._window_start = started
+            self._window_drawn = 0
+
+    def _acknowledged(self, remote_time: float) -> None:
+        self.pending = None
+        latency = max(0.0, remote_time - self.sent_at)
+        self.latency += 0.2 * (latency - self.latency)
+        # Leave the remote process idle for about as long as it is busy, so it has time to render and handle input
+        self.interval = min(self.max_interval, max(self.min_interval, 2 * self.latency + self.cost))
+
+    def summary(self) -> str:
+        return f"{self.fps:.0f} fps, {self.latency * 1000:.0f} ms round trip, {self.coalesced} ticks coalesced"
+
+
+class _RemoteView(pg.widgets.RemoteGraphicsView.RemoteGraphicsView):
+    """RemoteGraphicsView counting the frames the remote process has rendered."""
+
+    def __init__(self, *args, **kwargs) -> None:
+        self.renders = 0
+        super().__init__(*args, **kwargs)
+
+    def remoteSceneChanged(self, data) -> None:
+        self.renders += 1
+        super().remoteSceneChanged(data)
+
+
 class Plot_Data:
     """Class handling creation and updating of plot windows"""
 
-    def __init__(self, window_width=200) -> None:
+    def __init__(self, window_width=200, history=True, channel=None) -> None:
         super().__init__()
         self.Xm = zeros(window_width)  # Array to hold the data for the plot
+        self.channel = channel  # status key the history is fed from, see PlotWindow.add_sample
+        self.history = HistoryPyramid() if history else None
 
     def extend(self, value) -> None:
+        """Add a timer tick's sample to the live window. The history is fed per sample instead."""
         self.Xm[:-1] = self.Xm[1:]  # Shift data in the temporal mean 1 sample left
         self.Xm[-1] = float(value)  # Add the new value to the end of the array
         return self.Xm  # Return the updated array for plotting
@@ -51,6 +250,9 @@ class PlotWindow(pg.LayoutWidget):
         self.MUT_index = 0
         self.Load_index = 0
         self.TT_index = 0
+        self.pacer = FramePacer()
+        self.last_overview = None
+        self.last_label = (perf_counter(), 0)  # (time, remote renders) when the rate label was last updated
         self.setupInputs()
         self.setupLivePlot()
         self.show()
@@ -80,12 +282,15 @@ class PlotWindow(pg.LayoutWidget):
         dropdown_widget.addWidget(dropdown1, row=0, col=0)
         dropdown_widget.addWidget(dropdown2, row=1, col=0)
         dropdown_widget.addWidget(dropdown3, row=2, col=0)
+        self.fps_label = QLabel("")
+        dropdown_widget.addWidget(self.fps_label, row=3, col=0)
 
         # Add the combined widget to the window
         self.addWidget(dropdown_widget, row=0, col=0)
 
     def setupLivePlot(self) -> None:
-        view = pg.widgets.RemoteGraphicsView.RemoteGraphicsView()
+        view = _RemoteView()
+        self.view = view
         view.pg.setConfigOptions(
             antialias=True
         )  # Enable antialiasing for smoother plots
@@ -102,39 +307,114 @@ class PlotWindow(pg.LayoutWidget):
         self.MUT_plot = layout.addPlot(row=0, col=0)
         self.Load_plot = layout.addPlot(row=1, col=0)
         self.TT_plot = layout.addPlot(row=2, col=0)
+        self.setupEnvelopePlot(layout)
+        self.setupOverviewPlots(layout)
+
+        # Look up the per-frame remote methods once, each lookup on a proxy waits for the remote process
+        self.MUT_draw = self.MUT_plot.plot
+        self.Load_draw = self.Load_plot.plot
+        self.TT_draw = self.TT_plot.plot
+        self.operating_points_draw = self.operating_points.setData
+        self.overview_draws = [overview.plot for overview in self.overview_plots]
+        self.remote_clock = view._proc._import("time").perf_counter
 
         # Initialize data arrays for each plot
-        self.MUT_data_rpm = Plot_Data()
-        self.MUT_data_current = Plot_Data()
-        self.MUT_data_duty_cycle = Plot_Data()
-        self.Load_data_rpm = Plot_Data()
-        self.Load_data_current = Plot_Data()
-        self.Load_data_duty_cycle = Plot_Data()
-        self.TT_torque = Plot_Data()
+        self.MUT_data_rpm = Plot_Data(channel="Status_RPM_V1")
+        self.MUT_data_current = Plot_Data(channel="Status_TotalCurrent_V1")
+        self.MUT_data_duty_cycle = Plot_Data(channel="Status_DutyCycle_V1")
+        self.Load_data_rpm = Plot_Data(channel="Status_RPM_V2")
+        self.Load_data_current = Plot_Data(channel="Status_TotalCurrent_V2")
+        self.Load_data_duty_cycle = Plot_Data(channel="Status_DutyCycle_V2")
+        self.TT_torque = Plot_Data(channel="TorqueValue")
+        self.histories = {
+            data.channel: data.history
+            for data in (
+                self.MUT_data_rpm,
+                self.MUT_data_current,
+                self.MUT_data_duty_cycle,
+                self.Load_data_rpm,
+                self.Load_data_current,
+                self.Load_data_duty_cycle,
+                self.TT_torque,
+            )
+        }
+        self.parent.dyno.add_listener(self.add_sample)
+
+    def add_sample(self, status: dict, timestamp: float) -> None:
+        """Dyno listener, runs on the acquisition threads. Feeds every calibrated sample to the whole-run histories."""
+        histories = self.histories
+        for name, value in status.items():
+            history = histories.get(name)
+            if history is not None:
+                history.add(value)
+
+    def setupEnvelopePlot(self, layout: object) -> None:
+        """Torque-speed plot with the rig's absorption envelope drawn once behind the live operating points."""
+        envelope = rig_envelope()
+        self.envelope_plot = layout.addPlot(row=3, col=0, colspan=2)
+        self.envelope_plot.setLabel("bottom", "MUT speed (rpm)")
+        self.envelope_plot.setLabel("left", "Torque (Nm)")
+        speed, torque = envelope.outline()
+        self.envelope_plot.plot(speed, torque, _callSync="off", pen="r")
+        self.envelope_plot.setXRange(0, envelope.speed[-1], _callSync="off")
+        self.envelope_plot.setYRange(0, envelope.torque.max() * 1.2, _callSync="off")
+        self.operating_points = self.envelope_plot.plot(
+            pen=None, symbol="o", symbolSize=4, symbolBrush="k"
+        )
 
+    def setupOverviewPlots(self, layout: object) -> None:
+        """Narrow whole-run plots beside the MUT, load and torque plots."""
+        self.overview_plots = []
+        for row in range(3):
+            overview = layout.addPlot(row=row, col=1)
+            overview.setMaximumWidth(250, _callSync="off")
+            overview.hideAxis("bottom", _callSync="off")
+            self.overview_plots.append(overview)
+        self.overview_plots[0].setTitle("Whole run", _callSync="off")
+
+    def update_overviews(self, channels: list) -> None:
+        """Redraw the whole-run band and mean of the channel shown in each live plot."""
+        for draw, data in zip(self.overview_draws, channels):
+            x, mins, maxs, means = data.history.overview()
+            band = empty(2 * len(x))
+            band[0::2] = mins
+            band[1::2] = maxs
+            draw(repeat(x, 2), band, connect="pairs", clear=True, _callSync="off", pen=(160, 160, 160))
+            draw(x, means, _callSync="off", pen="k")
+
+    @traced("plot update", "plot")
     def update(self):
-        """Update the plots with new data from the dyno object."""
-        # Update MUT data
+        """Sample the latest data from the dyno object, and send a frame if the remote process is ready for one."""
         mut_status = self.parent.dyno.MUT.status
         self.MUT_data_rpm.extend(mut_status["Status_RPM_V1"])
         self.MUT_data_current.extend(mut_status["Status_TotalCurrent_V1"])
         self.MUT_data_duty_cycle.extend(mut_status["Status_DutyCycle_V1"])
+        load_status = self.parent.dyno.load_motor.status
+        self.Load_data_rpm.extend(load_status["Status_RPM_V2"])
+        self.Load_data_current.extend(load_status["Status_TotalCurrent_V2"])
+        self.Load_data_duty_cycle.extend(load_status["Status_DutyCycle_V2"])
+        self.TT_torque.extend(self.parent.dyno.torque_transducer.status["TorqueValue"])
 
+        started = perf_counter()
+        if not self.pacer.ready(started):
+            return  # coalesced, the next frame sent carries these samples too
+        self.draw(started)
+        self.pacer.sent(self.remote_clock(_callSync="async"), started, perf_counter() - started)
+        label_time, label_renders = self.last_label
+        if started - label_time >= 1.0:
+            render_fps = (self.view.renders - label_renders) / (started - label_time)
+            self.fps_label.setText(f"{self.pacer.summary()}, {render_fps:.0f} renders/s")
+            self.last_label = (started, self.view.renders)
+
+    def draw(self, now: float) -> None:
+        """Send the selected channels, operating points and (about once a second) overviews to the remote process."""
         mut_data_map = {
             0: self.MUT_data_rpm,
             1: self.MUT_data_current,
             2: self.MUT_data_duty_cycle,
         }
         if self.MUT_index in mut_data_map:
-            self.MUT_plot.plot(
-                mut_data_map[self.MUT_index].Xm, clear=True, _callSync="off", pen="k"
-            )
-
-        # Update Load motor data
-        load_status = self.parent.dyno.load_motor.status
-        self.Load_data_rpm.extend(load_status["Status_RPM_V2"])
-        self.Load_data_current.extend(load_status["Status_TotalCurrent_V2"])
-        self.Load_data_duty_cycle.extend(load_status["Status_DutyCycle_V2"])
+            self.MUT_draw(mut_data_map[self.MUT_index].Xm, clear=True, _callSync="off", pen="k")
 
         load_data_map = {
             0: self.Load_data_rpm,
@@ -142,13 +422,25 @@ class PlotWindow(pg.LayoutWidget):
             2: self.Load_data_duty_cycle,
         }
         if self.Load_index in load_data_map:
-            self.Load_plot.plot(
-                load_data_map[self.Load_index].Xm, clear=True, _callSync="off", pen="k"
-            )
+            self.Load_draw(load_data_map[self.Load_index].Xm, clear=True, _callSync="off", pen="k")
 
-        # Update Torque Transducer data
-        self.TT_torque.extend(self.parent.dyno.torque_transducer.status["TorqueValue"])
-        self.TT_plot.plot(self.TT_torque.Xm, clear=True, _callSync="off", pen="k")
+        self.TT_draw(self.TT_torque.Xm, clear=True, _callSync="off", pen="k")
+
+        # Operating points over the same window, against the envelope
+        self.operating_points_draw(
+            absolute(self.MUT_data_rpm.Xm), absolute(self.TT_torque.Xm), _callSync="off"
+        )
+
+        # The whole run changes slowly, redraw it about once a second
+        if self.last_overview is None or now - self.last_overview >= 1.0:
+            self.last_overview = now
+            self.update_overviews(
+                [
+                    mut_data_map.get(self.MUT_index, self.MUT_data_rpm),
+                    load_data_map.get(self.Load_index, self.Load_data_rpm),
+                    self.TT_torque,
+                ]
+            )
 
 
 if __name__ == "__main__":
@@ -180,12 +472,11 @@ if __name__ == "__main__":
             self.app = QApplication(sys.argv)
 
         def randomise(self):
-            for key in self.dyno.MUT.status:
-                self.dyno.MUT.status[key] += randint(-1, 1)
-            for key in self.dyno.load_motor.status:
-                self.dyno.load_motor.status[key] += randint(-1, 1)
-            for key in self.dyno.torque_transducer.status:
-                self.dyno.torque_transducer.status[key] += randint(-1, 1)
+            for device in (self.dyno.MUT, self.dyno.load_motor, self.dyno.torque_transducer):
+                for key in device.status:
+                    device.status[key] += randint(-1, 1)
+                for listener in self.dyno.listeners:
+                    listener(device.status, 0.0)
 
         def run(self):
             sys.exit(self.app.exec())
@@ -195,6 +486,10 @@ if __name__ == "__main__":
             self.MUT = DummyMotor()
             self.load_motor = DummyMotor()
             self.torque_transducer = DummyTorqueTransducer()
+            self.listeners = []
+
+        def add_listener(self, listener) -> None:
+            self.listeners.append(listener)
 
     example = DummyPresenter()
     live_plot = PlotWindow(example)
@@ -2,6 +2,7 @@
 VDyno - A PyQT based GUI for the V-Dyno project.
 
 This code contains MainWindow class, which pulls together the other windows and handles navigation between them. Generally handles the user inputs.
+Recently opened recordings are kept with QSettings, so the Open Recent menu persists between sessions.
 style_sheet.py is used to set the style of the GUI.
 
 written by:
@@ -9,8 +10,9 @@ written by:
 """
 # Import the required libraries
 
+import os
 import sys
-from PyQt6.QtCore import Qt, pyqtSignal, QSize
+from PyQt6.QtCore import Qt, pyqtSignal, QSize, QTimer, QSettings
 from PyQt6.QtWidgets import (
     QMainWindow,
     QApplication,
@@ -22,24 +24,24 @@ from PyQt6.QtWidgets import (
     QSizePolicy,
     QComboBox,
     QMessageBox,
+    QFileDialog,
 )
-from PyQt6.QtGui import QAction
-from pyqtgraph.Qt import QtGui
+from PyQt6.QtGui import QAction, QIcon
 import ctypes
 from typing import Protocol
 from functools import partial
 
 # Import the other windows to display
 if __name__ == "__main__":
-    import os
-
     sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
 
 from VDyno.view.style_sheet import StyleSheet
 from VDyno.view.anim_window import AnimWindow
-from VDyno.view.live_plots import PlotWindow
 from VDyno.view.tools_panel import ToolsPanel
 
+RESULTS_FOLDER = "experimental_results"
+MAX_RECENT_FILES = 8
+
 
 class Presenter(Protocol):  # allow for duck-typing of presenter class
     def openCANBus(self) -> None: ...
@@ -59,6 +61,7 @@ class MainWindow(QMainWindow):
     def __init__(self, app: QApplication) -> None:
         super().__init__()
         self.app = app
+        self.settings = QSettings("V-Dyno", "VDyno")
 
     def init_UI(self, presenter: Presenter) -> None:
         """Initialize the window and display its contents."""
@@ -72,28 +75,31 @@ class MainWindow(QMainWindow):
         self._setup_tool_bar()
         self._connect_actions()
         self.show()
-        self.presenter.start_plots()
+        # Paint the window before pyqtgraph, the remote plot process and the CAN bus are started
+        self.app.processEvents()
+        QTimer.singleShot(0, self.presenter.start_subsystems)
         sys.exit(self.app.exec())
 
     def setup_window(self):
         """Create the main window and its components."""
         self.tools_panel = ToolsPanel(self)
-        self.live_plot = PlotWindow(self.presenter)
-        print(type(self.live_plot))
+        self.live_plot = None  # created by load_live_plot once the window is showing
+        self.plot_placeholder = QLabel("Loading plots...")
+        self.plot_placeholder.setAlignment(Qt.AlignmentFlag.AlignCenter)
+        self.plot_placeholder.setMinimumHeight(400)
         self.anim_dock = AnimWindow()
         self.addDockWidget(Qt.DockWidgetArea.BottomDockWidgetArea, self.anim_dock)
 
         # Create a layout for the main window
         self.graph_layout = QVBoxLayout()  # Vertical layout for the graph and buttons
 
-        self.graph_layout.addWidget(self.live_plot, alignment=Qt.AlignmentFlag.AlignTop)
+        self.graph_layout.addWidget(self.plot_placeholder, alignment=Qt.AlignmentFlag.AlignTop)
         self.graph_layout.addWidget(self.anim_dock)
 
-        # Initialize results_label but hide it initially
-        self.results_label = QLabel("Results layout is not yet implemented")
-        self.results_label.setAlignment(Qt.AlignmentFlag.AlignCenter)
-        self.results_label.hide()  # Hide it initially
-        self.graph_layout.addWidget(self.results_label)
+        # The results window is created the first time it is shown, see show_results_window
+        self.results_window = None
+        self.spectrum_window = None  # likewise, see show_spectrum_window
+        self.replay_panel = None  # while replaying a recording, see replay_file
 
         # Add the tools panel and graph layout to the main layout
         self.main_layout = (
@@ -109,6 +115,16 @@ class MainWindow(QMainWindow):
 
         self.tab_changed.connect(self.on_tab_change)
 
+    def load_live_plot(self) -> None:
+        """Import pyqtgraph, start the remote plot process and swap the plots in for the placeholder."""
+        from VDyno.view.live_plots import PlotWindow
+
+        self.live_plot = PlotWindow(self.presenter)
+        self.graph_layout.replaceWidget(self.plot_placeholder, self.live_plot)
+        self.graph_layout.setAlignment(self.live_plot, Qt.AlignmentFlag.AlignTop)
+        self.plot_placeholder.deleteLater()
+        self.plot_placeholder = None
+
     def on_tab_change(self, index):
         """Handle tab changes in the tools panel."""
         for i in range(self.graph_layout.count()):
@@ -119,12 +135,62 @@ class MainWindow(QMainWindow):
 
         if index == 0:  # "Motor Control" tab
             # Show the original layout
-            self.live_plot.show()
+            if self.live_plot is not None:
+                self.live_plot.show()
+            else:
+                self.plot_placeholder.show()
             self.anim_dock.show()
             # self.button_widget.show()
 
-        elif index == 1:  # "Graph Settings" tab
-            self.results_label.show()
+        elif index == 1:  # "Results Window" tab
+            self.show_results_window()
+
+    def show_results_window(self) -> None:
+        if self.results_window is None:
+            from VDyno.view.results_window import ResultsWindow
+
+            self.results_window = ResultsWindow()
+            self.graph_layout.addWidget(self.results_window)
+        self.results_window.show()
+
+    def show_spectrum_window(self) -> None:
+        if self.spectrum_window is None:
+            from VDyno.view.spectrum_window import SpectrumWindow
+
+            self.spectrum_window = SpectrumWindow(self.presenter.torque_spectrum())
+            self.addDockWidget(Qt.DockWidgetArea.RightDockWidgetArea, self.spectrum_window)
+        self.spectrum_window.show()
+
+    def replay_file(self) -> None:
+        """Ask for a recording and replay it into the live plots."""
+        file_path, _ = QFileDialog.getOpenFileName(
+            self, "Replay Recording", RESULTS_FOLDER, "Recordings (*.csv)"
+        )
+        if not file_path:
+            return
+        if self.replay_panel is not None:
+            self.replay_panel.stop()
+            self.replay_panel = None
+        try:
+            replayer = self.presenter.start_replay(file_path)
+        except (OSError, ValueError) as e:
+            QMessageBox.warning(self, "Replay Recording", f"Could not replay {file_path}: {e}")
+            return
+        if replayer is None:
+            QMessageBox.warning(
+                self, "Replay Recording", "Replay can't start while an experiment is running or with the interlock tripped."
+            )
+            return
+        from VDyno.view.replay_panel import ReplayPanel
+
+        # Back to the live plots, which now show the replay
+        self.tools_panel.settings_toolbox.setCurrentIndex(0)
+        self.replay_panel = ReplayPanel(replayer, self.presenter)
+        self.replay_panel.destroyed.connect(self._replay_closed)
+        self.addDockWidget(Qt.DockWidgetArea.BottomDockWidgetArea, self.replay_panel)
+
+    def _replay_closed(self) -> None:
+        self.replay_panel = None
 
     def _create_actions(self) -> None:
         self.selected_experiment = "experiment"
@@ -145,7 +211,20 @@ class MainWindow(QMainWindow):
         warning_dialog.setIcon(QMessageBox.Icon.Warning)
         warning_dialog.setWindowTitle("Warning: is it safe to begin experiment?")
         warning_dialog.setText(f"Starting experiment: {self.selected_experiment}")
-        warning_dialog.setInformativeText("Ensure all safety checks are complete before proceeding.")
+        # The dry run predicts duration, peaks, energy and limit violations, its first line is the summary
+        dry_run = self.presenter.dry_run_experiment()
+        informative = "Ensure all safety checks are complete before proceeding."
+        if dry_run:
+            informative = f"{dry_run[0]}\n{informative}"
+        envelope_warnings = self.presenter.check_experiment()
+        if envelope_warnings:
+            informative = (
+                f"{len(envelope_warnings)} step(s) are outside the rig's absorption envelope, see details.\n{informative}"
+            )
+        warning_dialog.setInformativeText(informative)
+        details = envelope_warnings + dry_run
+        if details:
+            warning_dialog.setDetailedText("\n".join(details))
         warning_dialog.setStandardButtons(QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No)
         warning_dialog.button(QMessageBox.StandardButton.Yes).setText("Begin")
         warning_dialog.button(QMessageBox.StandardButton.No).setText("Cancel")
@@ -159,35 +238,102 @@ class MainWindow(QMainWindow):
         else:
             print("Experiment start canceled.")
 
+    def show_interlock_trip(self, reason: str, reaction_ms: float) -> None:
+        """Tell the user the interlock stopped the motors, offering to reset it."""
+        trip_dialog = QMessageBox(self)
+        trip_dialog.setIcon(QMessageBox.Icon.Critical)
+        trip_dialog.setWindowTitle("Interlock tripped")
+        trip_dialog.setText(f"Motors stopped: {reason}")
+        trip_dialog.setInformativeText(
+            f"Zero commands were sent {reaction_ms:.1f} ms after detection. "
+            "Setpoints stay at zero until the interlock is reset."
+        )
+        reset_button = trip_dialog.addButton("Reset Interlock", QMessageBox.ButtonRole.AcceptRole)
+        trip_dialog.addButton("Keep Stopped", QMessageBox.ButtonRole.RejectRole)
+        trip_dialog.exec()
+        if trip_dialog.clickedButton() == reset_button:
+            self.presenter.reset_interlock()
+
     def _connect_actions(self):
         # Connect Open Recent to dynamically populate it
         self.open_recent_menu.aboutToShow.connect(self.populate_open_recent)
 
+    def open_file(self) -> None:
+        """Ask for a recording and show it in the results window."""
+        file_path, _ = QFileDialog.getOpenFileName(
+            self, "Open Recording", RESULTS_FOLDER, "Recordings (*.csv)"
+        )
+        if file_path:
+            self.open_recent_file(file_path)
+
     def open_recent_file(self, filename):
-        # Logic for opening a recent file goes here...
-        print(f"This feature does not work yet, but would open {filename}. Love, Dan")
+        if not os.path.exists(filename):
+            QMessageBox.warning(self, "Open Recording", f"{filename} no longer exists.")
+            self.set_recent_files([f for f in self.recent_files() if f != filename])
+            return
+        # Switching tab shows the results window through on_tab_change
+        self.tools_panel.settings_toolbox.setCurrentIndex(1)
+        self.show_results_window()
+        try:
+            self.results_window.open(filename)
+        except (OSError, ValueError) as e:
+            QMessageBox.warning(self, "Open Recording", f"Could not open {filename}: {e}")
+            return
+        self.add_recent_file(filename)
+
+    def recent_files(self) -> list[str]:
+        return list(self.settings.value("recent_files", [], type=list))
+
+    def set_recent_files(self, filenames: list[str]) -> None:
+        self.settings.setValue("recent_files", filenames[:MAX_RECENT_FILES])
+
+    def add_recent_file(self, filename: str) -> None:
+        filename = os.path.abspath(filename)
+        self.set_recent_files([filename] + [f for f in self.recent_files() if f != filename])
 
     def _setup_menu(self):
         """Create a simple menu to manage the dock widget."""
         menu_bar = self.menuBar()
         # Create file menu and add actions
         file_menu = menu_bar.addMenu("&File")
-        file_menu.addAction("Open", lambda: self.open_recent_file("a test"))
+        open_action = file_menu.addAction("Open...", self.open_file)
+        open_action.setShortcut("Ctrl+O")
         self.open_recent_menu = file_menu.addMenu("Open Recent")
+        file_menu.addAction("Replay Recording...", self.replay_file)
         # Create view menu and add actions
         view_menu = menu_bar.addMenu("&View")
         view_menu.addAction(self.anim_dock.toggleViewAction())
+        view_menu.addAction("Torque Spectrum", self.show_spectrum_window)
+        view_menu.addSeparator()
+        tracing_action = view_menu.addAction("Trace Hot Paths")
+        tracing_action.setCheckable(True)
+        tracing_action.toggled.connect(self.presenter.set_tracing)
+        view_menu.addAction("Save Trace...", self.save_trace)
+        safety_menu = menu_bar.addMenu("&Safety")
+        safety_menu.addAction("Reset Interlock", self.presenter.reset_interlock)
+
+    def save_trace(self) -> None:
+        """Ask where to save the trace, which opens in chrome://tracing or ui.perfetto.dev."""
+        file_path, _ = QFileDialog.getSaveFileName(
+            self, "Save Trace", "vdyno_trace.json", "Chrome trace (*.json)"
+        )
+        if file_path:
+            self.presenter.save_trace(file_path)
 
     def populate_open_recent(self):
         # Step 1. Remove the old options from the menu
         self.open_recent_menu.clear()
         # Step 2. Dynamically create the actions
         actions = []
-        filenames = [f"File-{n}" for n in range(5)]
-        for filename in filenames:
-            action = QAction(filename, self)
+        for filename in self.recent_files():
+            action = QAction(os.path.basename(filename), self)
+            action.setToolTip(filename)
             action.triggered.connect(partial(self.open_recent_file, filename))
             actions.append(action)
+        if not actions:
+            action = QAction("No recent recordings", self)
+            action.setEnabled(False)
+            actions.append(action)
         # Step 3. Add the actions to the menu
         self.open_recent_menu.addActions(actions)
 
@@ -225,19 +371,34 @@ class MainWindow(QMainWindow):
         ToolBar.addWidget(self.separator(20))
 
     def change_MUT_current(self, value):
-        self.presenter.desired_MUT_current = value
+        self.presenter.post_command("MUT_current", value, "experiment")
 
     def change_load_rpm(self, value):
-        self.presenter.desired_load_rpm = value
+        self.presenter.post_command("load_rpm", value, "experiment")
+
+    def change_torque(self, value, actuator="MUT"):
+        self.presenter.post_command("torque", (value, actuator), "experiment")
+
+    def manual_MUT_current(self, value):
+        """Setpoint from the Manual Control box, overrides the experiment and is logged once per control tick."""
+        self.presenter.post_command("MUT_current", value, "manual")
+
+    def manual_load_rpm(self, value):
+        self.presenter.post_command("load_rpm", value, "manual")
+
+    def manual_control(self, enabled):
+        if not enabled:
+            self.presenter.release_manual_control()
 
 
 def create_UI() -> MainWindow:
     app = QApplication(sys.argv)
     app.setStyleSheet(StyleSheet)
     myappid = "V-dyno"  # arbitrary string as name
-    ctypes.windll.shell32.SetCurrentProcessExplicitAppUserModelID(myappid)
+    if sys.platform == "win32":
+        ctypes.windll.shell32.SetCurrentProcessExplicitAppUserModelID(myappid)
     app.setStyle("WindowsVista")
-    app.setWindowIcon(QtGui.QIcon("VDyno/images/icon.svg"))
+    app.setWindowIcon(QIcon("VDyno/images/icon.svg"))
 
     # Create the main window
     main_window = MainWindow(app)
@@ -246,7 +407,6 @@ def create_UI() -> MainWindow:
 
 
 if __name__ == "__main__":
-    sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
 
     class DummyPresenter:
         def __init__(self) -> None:
@@ -264,11 +424,45 @@ if __name__ == "__main__":
         def start_record_thread(self) -> None:
             print("Starting recording thread")
 
+        def check_experiment(self) -> list[str]:
+            return []
+
+        def dry_run_experiment(self) -> list[str]:
+            return []
+
         def get_experiment_list(self) -> list[str]:
             return ["Experiment 1", "Experiment 2", "Experiment 3"]
 
         def start_plots(self) -> None:
             print("Starting plots...")
 
+        def start_subsystems(self) -> None:
+            print("Starting subsystems...")
+
+        def set_tracing(self, enabled: bool) -> None: ...
+
+        def reset_interlock(self) -> None: ...
+
+        def post_command(self, channel: str, value: object, source: str = "experiment") -> bool:
+            print(f"{source} set {channel} to {value}")
+            return True
+
+        def release_manual_control(self) -> None: ...
+
+        def log_event(self, event: str, step: int | None = None, **detail) -> None:
+            print(f"Event {event} {detail}")
+
+        def torque_spectrum(self) -> object:
+            from VDyno.presenter.spectrum import TorqueSpectrum
+
+            return TorqueSpectrum()
+
+        def save_trace(self, file_path: str) -> None: ...
+
+        def start_replay(self, file_path: str) -> None:
+            print(f"Replaying {file_path}")
+
+        def stop_replay(self) -> None: ...
+
     main_window, app = create_UI()
     main_window.init_UI(DummyPresenter())
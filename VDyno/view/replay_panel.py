@@ -0,0 +1,119 @@
+"""
+VDyno - A PyQT based GUI for the V-Dyno project.
+
+This code contains the ReplayPanel class, a dock with the controls for replaying a recording into the live plots
+(see VDyno/presenter/replay.py): play/pause, single row steps, speed from 0.1x to 100x, a position slider and a jump to any
+indexed experiment step. It only reads the Replayer's state from a slow timer, the replay itself runs on its own thread.
+
+written by:
+    - Daniel Muir
+"""
+
+import os
+
+from PyQt6.QtCore import Qt, QTimer
+from PyQt6.QtWidgets import (
+    QComboBox,
+    QDockWidget,
+    QGridLayout,
+    QLabel,
+    QPushButton,
+    QSlider,
+    QWidget,
+)
+
+SPEEDS = (0.1, 0.25, 0.5, 1, 2, 5, 10, 20, 50, 100)
+REFRESH_MS = 100
+
+
+class ReplayPanel(QDockWidget):
+    def __init__(self, replayer: object, presenter: object) -> None:
+        super().__init__()
+        self.replayer = replayer
+        self.presenter = presenter
+        self.setWindowTitle(f"Replay: {os.path.basename(replayer.file_path)}")
+        self.setAllowedAreas(Qt.DockWidgetArea.BottomDockWidgetArea | Qt.DockWidgetArea.TopDockWidgetArea)
+        self.setFeatures(QDockWidget.DockWidgetFeature.DockWidgetMovable)
+
+        self.play_button = QPushButton("Pause")
+        self.play_button.clicked.connect(self.toggle_play)
+        self.step_button = QPushButton("Step")
+        self.step_button.setToolTip("Pause and send the next row")
+        self.step_button.clicked.connect(lambda: self.replayer.step())
+        self.stop_button = QPushButton("Stop Replay")
+        self.stop_button.clicked.connect(self.stop)
+
+        self.speed_choice = QComboBox()
+        self.speed_choice.addItems([f"{speed:g}x" for speed in SPEEDS])
+        self.speed_choice.setCurrentIndex(SPEEDS.index(1))
+        self.speed_choice.currentIndexChanged.connect(lambda i: self.replayer.set_speed(SPEEDS[i]))
+
+        self.step_choice = QComboBox()
+        self.step_choice.addItem("Jump to step..." if replayer.steps else "No step index")
+        for entry in replayer.steps:
+            self.step_choice.addItem(f"Step {entry['step']}: {entry['detail'].get('action', '')}", entry["step"])
+        self.step_choice.setEnabled(bool(replayer.steps))
+        self.step_choice.activated.connect(self._jump_to_step)
+
+        self.slider = QSlider(Qt.Orientation.Horizontal)
+        self.slider.setRange(0, max(0, replayer.rows - 1))
+        self.slider.sliderReleased.connect(lambda: self.replayer.seek(self.slider.value()))
+        self.info = QLabel()
+
+        layout = QGridLayout()
+        layout.addWidget(self.play_button, 0, 0)
+        layout.addWidget(self.step_button, 0, 1)
+        layout.addWidget(self.speed_choice, 0, 2)
+        layout.addWidget(self.step_choice, 0, 3)
+        layout.addWidget(self.stop_button, 0, 4)
+        layout.addWidget(self.slider, 1, 0, 1, 5)
+        layout.addWidget(self.info, 2, 0, 1, 5)
+        container = QWidget()
+        container.setLayout(layout)
+        self.setWidget(container)
+
+        self.timer = QTimer(self)
+        self.timer.timeout.connect(self.refresh)
+        self.timer.start(REFRESH_MS)
+
+    def toggle_play(self) -> None:
+        if self.replayer.paused:
+            self.replayer.play()
+        else:
+            self.replayer.pause()
+        self.refresh()
+
+    def _jump_to_step(self, index: int) -> None:
+        step = self.step_choice.itemData(index)
+        if step is not None:
+            self.replayer.seek_step(step)
+        self.step_choice.setCurrentIndex(0)
+
+    def stop(self) -> None:
+        self.timer.stop()
+        self.presenter.stop_replay()
+        self.close()
+        self.deleteLater()
+
+    def refresh(self) -> None:
+        replayer = self.replayer
+        self.play_button.setText("Play" if replayer.paused else "Pause")
+        self.play_button.setEnabled(not replayer.finished)
+        if not self.slider.isSliderDown():
+            self.slider.setValue(min(replayer.position, self.slider.maximum()))
+        step = replayer.step_at(max(0, replayer.position - 1))
+        text = (
+            f"{replayer.elapsed:.2f} / {replayer.duration:.2f} s, row {replayer.position} of {replayer.rows}"
+            f"{'' if step is None else f', step {step}'}"
+        )
+        if replayer.finished:
+            text += ", finished"
+        elif not replayer.paused:
+            text += f", {replayer.speed:g}x requested, {replayer.achieved_speed:.1f}x achieved"
+        trips = self.presenter.replay_trips
+        if trips:
+            elapsed, reason = trips[-1]
+            text += f"\nInterlock would have tripped {elapsed:.2f} s in: {reason}"
+            if len(trips) > 1:
+                text += f" ({len(trips)} trips, seeking re-arms it)"
+        self.info.setText(text)
@@ -0,0 +1,172 @@
+"""
+VDyno - A PyQT based GUI for the V-Dyno project.
+
+This code contains the ResultsWindow class, a browser for recordings saved in experimental_results.
+Recordings are opened through VDyno.analysis.recording_index, so only the samples or min/max bins needed for the visible
+range are read from disk. Whenever the plot is panned, zoomed or resized, each ticked channel is re-fetched at about two
+points per pixel, which keeps multi-hour recordings interactive.
+Beside it, the recording's operating points are drawn as torque against speed over the rig's absorption envelope, as in the
+live torque-speed plot. Points outside the envelope are always drawn, in red, the rest are thinned to MAX_OPERATING_POINTS.
+
+written by:
+    - Daniel Muir
+"""
+
+import os
+
+import numpy as np
+import pyqtgraph as pg
+from PyQt6.QtCore import Qt, QTimer
+from PyQt6.QtWidgets import (
+    QApplication,
+    QHBoxLayout,
+    QLabel,
+    QListWidget,
+    QListWidgetItem,
+    QVBoxLayout,
+    QWidget,
+)
+
+if __name__ == "__main__":
+    import sys
+
+    sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
+
+from VDyno.analysis.brake_envelope import rig_envelope
+from VDyno.analysis.recording_index import RecordingIndex
+from VDyno.analysis.results import SPEED_KEY, TORQUE_KEY
+from VDyno.model.recording_format import TIME_KEY
+
+COLOURS = ["k", "b", "r", "g", "m", "c", (255, 140, 0)]
+MAX_OPERATING_POINTS = 20000  # inside the envelope, a scatter of more hides nothing and slows panning
+
+
+class ResultsWindow(QWidget):
+    """Plot any channel of a recording against sample number."""
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.index = None
+        self.curves = {}  # channel name: PlotDataItem
+        self.setMinimumHeight(400)
+
+        self.title = QLabel("Open a recording with File > Open")
+        self.channel_list = QListWidget()
+        self.channel_list.setFixedWidth(200)
+        self.channel_list.itemChanged.connect(self._channel_toggled)
+
+        self.plot = pg.PlotWidget(background="w")
+        self.plot.showGrid(x=True, y=True)
+        self.plot.setLabel("bottom", "Sample")
+        self.plot.addLegend()
+        self.plot.setAutoVisible(y=True)
+        # Coalesce bursts of range changes while dragging into one refresh
+        self.refresh_timer = QTimer(self)
+        self.refresh_timer.setSingleShot(True)
+        self.refresh_timer.setInterval(15)
+        self.refresh_timer.timeout.connect(self.refresh)
+        self.plot.getViewBox().sigXRangeChanged.connect(lambda *args: self.refresh_timer.start())
+        self.plot.getViewBox().sigResized.connect(lambda *args: self.refresh_timer.start())
+        self.setupEnvelopePlot()
+
+        body = QHBoxLayout()
+        body.addWidget(self.channel_list)
+        body.addWidget(self.plot, 2)
+        body.addWidget(self.envelope_plot, 1)
+        layout = QVBoxLayout()
+        layout.addWidget(self.title)
+        layout.addLayout(body)
+        self.setLayout(layout)
+
+    def setupEnvelopePlot(self) -> None:
+        """Torque-speed plot with the rig's absorption envelope drawn once behind the recording's operating points."""
+        self.envelope = rig_envelope()
+        self.envelope_plot = pg.PlotWidget(background="w")
+        self.envelope_plot.setLabel("bottom", "MUT speed (rpm)")
+        self.envelope_plot.setLabel("left", "Torque (Nm)")
+        speed, torque = self.envelope.outline()
+        self.envelope_plot.plot(speed, torque, pen="r")
+        self.envelope_plot.setXRange(0, self.envelope.speed[-1])
+        self.envelope_plot.setYRange(0, self.envelope.torque.max() * 1.2)
+        self.operating_points = self.envelope_plot.plot(pen=None, symbol="o", symbolSize=3, symbolBrush="k", symbolPen=None)
+        self.outside_points = self.envelope_plot.plot(pen=None, symbol="o", symbolSize=4, symbolBrush="r", symbolPen=None)
+
+    def show_operating_points(self) -> str:
+        """Plot the recording's torque against speed. Returns how much of it ran outside the envelope, for the title."""
+        if SPEED_KEY not in self.index.columns or TORQUE_KEY not in self.index.columns:
+            self.operating_points.setData([], [])
+            self.outside_points.setData([], [])
+            return "no torque-speed channels"
+        speed = np.abs(np.asarray(self.index.column(SPEED_KEY)))
+        torque = np.abs(np.asarray(self.index.column(TORQUE_KEY)))
+        # As check_recording, a stationary shaft isn't held against the envelope
+        outside = (self.envelope.margin(speed, torque) < 0) & (speed != 0)
+        stride = max(1, len(speed) // MAX_OPERATING_POINTS)
+        self.operating_points.setData(speed[::stride], torque[::stride])
+        self.outside_points.setData(speed[outside], torque[outside])
+        return f"{np.count_nonzero(outside)} outside {self.envelope.name}"
+
+    def open(self, file_path: str) -> None:
+        """Show a recording, indexing it first if it hasn't been opened before."""
+        QApplication.setOverrideCursor(Qt.CursorShape.WaitCursor)
+        try:
+            self.index = RecordingIndex.open(file_path)
+        finally:
+            QApplication.restoreOverrideCursor()
+        for curve in self.curves.values():
+            self.plot.removeItem(curve)
+        self.curves.clear()
+        envelope_check = self.show_operating_points()
+        self.title.setText(f"{os.path.basename(file_path)}: {self.index.rows} samples, {envelope_check}")
+
+        self.channel_list.blockSignals(True)
+        self.channel_list.clear()
+        # The Time column is the clock, not a channel worth plotting against sample number
+        channels = [name for name in self.index.columns if name != TIME_KEY]
+        for number, name in enumerate(channels):
+            item = QListWidgetItem(name)
+            item.setFlags(item.flags() | Qt.ItemFlag.ItemIsUserCheckable)
+            item.setCheckState(Qt.CheckState.Checked if number == 0 else Qt.CheckState.Unchecked)
+            self.channel_list.addItem(item)
+        self.channel_list.blockSignals(False)
+
+        if channels:
+            self._add_curve(channels[0])
+        self.plot.setXRange(0, max(self.index.rows, 1), padding=0)
+        self.plot.enableAutoRange(axis="y")
+        self.refresh()
+
+    def _add_curve(self, name: str) -> None:
+        colour = COLOURS[self.index.columns.index(name) % len(COLOURS)]
+        self.curves[name] = self.plot.plot(name=name, pen=colour)
+
+    def _channel_toggled(self, item: QListWidgetItem) -> None:
+        name = item.text()
+        if item.checkState() == Qt.CheckState.Checked and name not in self.curves:
+            self._add_curve(name)
+            self.refresh()
+        elif item.checkState() != Qt.CheckState.Checked and name in self.curves:
+            self.plot.removeItem(self.curves.pop(name))
+
+    def refresh(self) -> None:
+        """Fetch the visible range of every ticked channel at about two points per pixel."""
+        if self.index is None:
+            return
+        start, stop = self.plot.getViewBox().viewRange()[0]
+        max_points = max(200, 2 * int(self.plot.getViewBox().width()))
+        for name, curve in self.curves.items():
+            x, y = self.index.view(name, start, stop, max_points)
+            curve.setData(x, y)
+
+
+if __name__ == "__main__":
+    import glob
+    import sys
+
+    app = QApplication(sys.argv)
+    window = ResultsWindow()
+    recordings = sys.argv[1:] or sorted(glob.glob("experimental_results/*.csv"))
+    if recordings:
+        window.open(recordings[-1])
+    window.show()
+    sys.exit(app.exec())
@@ -0,0 +1,143 @@
+"""
+VDyno - A PyQT based GUI for the V-Dyno project.
+
+This code contains the SpectrumWindow class, a dock showing the live torque spectrum from VDyno.presenter.spectrum.
+The top plot is the Welch PSD against frequency, or the order tracked PSD against mechanical order with the electrical
+orders marked. Below it, a waterfall of recent periodograms shows how the spectrum moves with speed.
+The analysis runs on the GUI thread from a slow timer, a hop at a time, so it costs nothing when the dock is closed.
+
+written by:
+    - Daniel Muir
+"""
+
+import numpy as np
+import pyqtgraph as pg
+from PyQt6.QtCore import Qt, QTimer
+from PyQt6.QtWidgets import QComboBox, QDockWidget, QLabel, QVBoxLayout, QWidget
+
+REFRESH_MS = 200
+
+
+class SpectrumWindow(QDockWidget):
+    def __init__(self, spectrum: object) -> None:
+        super().__init__()
+        self.spectrum = spectrum
+        self.setWindowTitle("Torque Spectrum")
+        self.setAllowedAreas(Qt.DockWidgetArea.RightDockWidgetArea | Qt.DockWidgetArea.BottomDockWidgetArea)
+        self.setFeatures(
+            QDockWidget.DockWidgetFeature.DockWidgetClosable | QDockWidget.DockWidgetFeature.DockWidgetMovable
+        )
+
+        self.axis_choice = QComboBox()
+        self.axis_choice.addItems(["Frequency (Hz)", "Mechanical order"])
+        self.axis_choice.currentIndexChanged.connect(self._axis_changed)
+        self.info = QLabel("Waiting for torque samples...")
+
+        self.psd_plot = pg.PlotWidget(background="w")
+        self.psd_plot.setLogMode(y=True)
+        self.psd_plot.setLabel("left", "PSD (Nm²/Hz)")
+        self.psd_plot.setLabel("bottom", "Frequency (Hz)")
+        self.psd_curve = self.psd_plot.plot(pen="k")
+        self.order_lines = []
+        for order in spectrum.electrical_orders():
+            line = pg.InfiniteLine(order, pen=pg.mkPen("r", style=Qt.PenStyle.DashLine))
+            line.setVisible(False)
+            self.psd_plot.addItem(line)
+            self.order_lines.append(line)
+
+        self.waterfall_plot = pg.PlotWidget(background="w")
+        self.waterfall_plot.setLabel("left", "Segments ago")
+        self.waterfall_plot.setLabel("bottom", "Frequency (Hz)")
+        self.waterfall = pg.ImageItem(axisOrder="row-major")
+        self.waterfall.setColorMap(pg.colormap.get("viridis"))
+        self.waterfall_plot.addItem(self.waterfall)
+
+        layout = QVBoxLayout()
+        layout.addWidget(self.axis_choice)
+        layout.addWidget(self.psd_plot, stretch=2)
+        layout.addWidget(self.waterfall_plot, stretch=1)
+        layout.addWidget(self.info)
+        container = QWidget()
+        container.setLayout(layout)
+        self.setWidget(container)
+
+        self.timer = QTimer(self)
+        self.timer.timeout.connect(self.refresh)
+        self.visibilityChanged.connect(self._visibility_changed)
+
+    def _visibility_changed(self, visible: bool) -> None:
+        if visible:
+            self.timer.start(REFRESH_MS)
+        else:
+            self.timer.stop()
+
+    def _axis_changed(self, index: int) -> None:
+        self.psd_plot.setLabel("bottom", "Mechanical order" if index else "Frequency (Hz)")
+        self.psd_plot.setLabel("left", "PSD (Nm²/order)" if index else "PSD (Nm²/Hz)")
+        for line in self.order_lines:
+            line.setVisible(bool(index))
+        self.psd_plot.enableAutoRange()
+        self.refresh()
+
+    def refresh(self) -> None:
+        spectrum = self.spectrum
+        spectrum.process()
+        if not spectrum.segments:
+            return
+        if self.axis_choice.currentIndex() == 0:
+            x, y = spectrum.frequencies(), spectrum.psd()
+        else:
+            x, y = spectrum.order_grid, spectrum.order_psd()
+        valid = np.isfinite(y) & (y > 0)
+        self.psd_curve.setData(x[valid], y[valid])
+
+        rows = spectrum.waterfall()
+        rate = spectrum.sample_rate
+        self.waterfall.setImage(rows, autoLevels=False, levels=self._levels(rows))
+        self.waterfall.setRect(0, -len(rows), rate / 2, len(rows))
+        self.info.setText(
+            f"{spectrum.segments} segments of {spectrum.segment} at {rate:.0f} Hz "
+            f"({rate / spectrum.segment:.2f} Hz resolution), {spectrum.skipped} skipped. "
+            f"Electrical orders at {', '.join(str(order) for order in spectrum.electrical_orders())}."
+        )
+
+    @staticmethod
+    def _levels(rows: np.ndarray) -> tuple:
+        finite = rows[np.isfinite(rows)]
+        if finite.size == 0:
+            return (0.0, 1.0)
+        return (float(np.percentile(finite, 5)), float(finite.max()))
+
+
+if __name__ == "__main__":
+    import os
+    import sys
+
+    from PyQt6.QtWidgets import QApplication, QMainWindow
+
+    sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
+    from VDyno.presenter.spectrum import CHANNEL, SPEED_CHANNEL, TorqueSpectrum
+
+    app = QApplication(sys.argv)
+    window = QMainWindow()
+    spectrum = TorqueSpectrum()
+    dock = SpectrumWindow(spectrum)
+    window.addDockWidget(Qt.DockWidgetArea.RightDockWidgetArea, dock)
+    window.show()
+
+    # Feed a sweeping shaft speed with a 7th order ripple at 200 Hz
+    samples = {"n": 0}
+
+    def feed() -> None:
+        for _ in range(10):
+            t = samples["n"] / 200
+            rpm = 100 + 50 * np.sin(0.05 * t)
+            shaft = (100 * t - 1000 * np.cos(0.05 * t) + 1000) / 60
+            spectrum.add({SPEED_CHANNEL: rpm}, t)
+            spectrum.add({CHANNEL: 1 + 0.05 * np.sin(2 * np.pi * 7 * shaft) + 0.01 * np.random.randn()}, t)
+            samples["n"] += 1
+
+    feeder = QTimer()
+    feeder.timeout.connect(feed)
+    feeder.start(50)
+    sys.exit(app.exec())
@@ -33,6 +33,7 @@ class ToolsPanel(QVBoxLayout):
     def setupToolsPanel(self):
         """Set up a permanent tools panel with a QToolBox for motor control, graph settings, and data filters."""
         settings_toolbox = QToolBox()
+        self.settings_toolbox = settings_toolbox
         settings_toolbox.setFixedWidth(300)
         settings_toolbox.setCurrentIndex(0)  # Show the first tab by default
 
@@ -53,7 +54,7 @@ class ToolsPanel(QVBoxLayout):
         MUT_current_box.setValue(0)  # Set a default value
         MUT_current_box.setEnabled(False)  # Initially disabled
 
-        MUT_current_box.valueChanged.connect(self.parent.change_MUT_current)
+        MUT_current_box.valueChanged.connect(self.parent.manual_MUT_current)
 
         # Load RPM Spin Box
         load_rpm_label = QLabel("Motor 2 rpm:")
@@ -63,7 +64,7 @@ class ToolsPanel(QVBoxLayout):
         load_rpm_input.setValue(0)  # Set a default value
         load_rpm_input.setEnabled(False)  # Initially disabled
 
-        load_rpm_input.valueChanged.connect(self.parent.change_load_rpm)
+        load_rpm_input.valueChanged.connect(self.parent.manual_load_rpm)
 
         # Define a method to enable/disable spin boxes
         def toggle_manual_control(state):
@@ -72,6 +73,7 @@ class ToolsPanel(QVBoxLayout):
             print(f"Is checked: {is_checked}")
             MUT_current_box.setEnabled(is_checked)
             load_rpm_input.setEnabled(is_checked)
+            self.parent.manual_control(bool(is_checked))
 
         # Connect Manual Control Checkbox to the toggle method
         manual_control_cb.stateChanged.connect(toggle_manual_control)
@@ -120,12 +122,15 @@ if __name__ == "__main__":
         def __init__(self):
             super().__init__()
         
-        def change_MUT_current(self, value):
+        def manual_MUT_current(self, value):
             print(f"MUT current changed to: {value}")
 
-        def change_load_rpm(self, value):   
+        def manual_load_rpm(self, value):   
             print(f"Load RPM changed to: {value}")
 
+        def manual_control(self, enabled):
+            print(f"Manual control {'on' if enabled else 'off'}")
+
 
     app = QApplication(sys.argv)
     app.setStyle("WindowsVista")
@@ -0,0 +1,20 @@
+"""
+VDyno - A PyQT based GUI for the V-Dyno project.
+
+This code is the entry point for running experiments without the GUI, e.g. on a headless lab machine or from a script.
+Progress is streamed to stdout and the exit status reports whether every experiment completed.
+
+Examples:
+    python VDyno_headless.py test_4A_1000rpm.json test_6A_1000rpm.json
+    python VDyno_headless.py --sweep-current 2 4 6 --sweep-rpm -1000 -2000 --hold-time 5
+
+written by:
+    - Daniel Muir
+"""
+
+import sys
+
+from VDyno.presenter.headless_runner import main
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,328 @@
+"""
+VDyno - A PyQT based GUI for the V-Dyno project.
+
+This code benchmarks the acquisition -> record -> plot hot paths with synthetic frame streams:
+    - load_calibration: parsing value_calibration.csv.
+    - update_status: Motor.update_status against a synthetic CAN server, for 1-8 VESCs.
+    - record: FileSaver.write_row into a temporary folder.
+    - plot_extend: Plot_Data.extend for every channel.
+    - plot_update: PlotWindow.update on an offscreen Qt platform (skip with --no-plot).
+Frames are scheduled at a fixed rate. Latency is measured from when a frame was due to when it was handled,
+so a path that can't keep up shows growing latency rather than just a lower rate.
+Each benchmark is run a second time under tracemalloc to report peak memory without skewing the timings.
+
+Results are JSON, written to stdout or --output. Anything else the benchmarked code prints goes to stderr, so stdout can be
+piped straight into a JSON reader. Pass --compare with an earlier result file to print the change.
+
+Usage:
+    python benchmarks/hot_paths.py --rates 100 1000 10000 --vescs 1 2 8 --output before.json
+    python benchmarks/hot_paths.py --compare before.json
+
+written by:
+    - Daniel Muir
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import tracemalloc
+from datetime import datetime
+from random import randint
+from time import perf_counter, sleep
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from VDyno.model.dyno import Motor, TorqueTransducer, load_calibration
+from VDyno.presenter.file_saver import FileSaver
+from VDyno.view.live_plots import Plot_Data
+
+CALIBRATION_FILE = os.path.join(os.path.dirname(__file__), "..", "VDyno", "model", "value_calibration.csv")
+
+
+class SyntheticCANServer:
+    """Stands in for CANHandler, answering every expect with a fresh raw status frame."""
+
+    def send(self, message_name: str, signals: dict) -> None: ...
+
+    def flush_input(self) -> None: ...
+
+    def expect(self, message_name: str, timeout: float) -> dict:
+        if message_name == "TEENSY_Status":
+            return {"TorqueValue": randint(0, 4095)}
+        vesc = message_name.rsplit("_V", 1)[1]
+        return {
+            f"Status_RPM_V{vesc}": randint(-20000, 20000),
+            f"Status_TotalCurrent_V{vesc}": randint(-100, 100) / 10,
+            f"Status_DutyCycle_V{vesc}": randint(-1000, 1000) / 10,
+        }
+
+
+class BenchDyno:
+    def __init__(self, vescs: int) -> None:
+        can_server = SyntheticCANServer()
+        self.motors = [Motor(can_server, n, CALIBRATION_FILE) for n in range(1, vescs + 1)]
+        self.MUT = self.motors[0]
+        self.load_motor = self.motors[1] if vescs > 1 else Motor(can_server, 2, CALIBRATION_FILE)
+        self.torque_transducer = TorqueTransducer(can_server, CALIBRATION_FILE)
+
+
+def percentile(sorted_values: list, fraction: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def run_paced(handle, rate: float, duration: float) -> dict:
+    """Call handle(frame_number) for every frame due at rate Hz over duration seconds."""
+    interval = 1.0 / rate
+    frames = max(1, int(rate * duration))
+    latencies = []
+    start = perf_counter()
+    for frame in range(frames):
+        due = start + frame * interval
+        now = perf_counter()
+        if due - now > 0.0005:
+            sleep(due - now - 0.0005)
+        while perf_counter() < due:
+            pass
+        handle(frame)
+        latencies.append(perf_counter() - due)
+    elapsed = perf_counter() - start
+    latencies.sort()
+    return {
+        "frames": frames,
+        "throughput_hz": frames / elapsed,
+        "latency_us": {
+            "p50": percentile(latencies, 0.50) * 1e6,
+            "p90": percentile(latencies, 0.90) * 1e6,
+            "p99": percentile(latencies, 0.99) * 1e6,
+            "max": latencies[-1] * 1e6,
+        },
+    }
+
+
+def run_unpaced(handle, repeats: int) -> dict:
+    """Call handle as fast as possible, for paths that are not driven by frames."""
+    timings = []
+    start = perf_counter()
+    for frame in range(repeats):
+        before = perf_counter()
+        handle(frame)
+        timings.append(perf_counter() - before)
+    elapsed = perf_counter() - start
+    timings.sort()
+    return {
+        "frames": repeats,
+        "throughput_hz": repeats / elapsed,
+        "latency_us": {
+            "p50": percentile(timings, 0.50) * 1e6,
+            "p90": percentile(timings, 0.90) * 1e6,
+            "p99": percentile(timings, 0.99) * 1e6,
+            "max": timings[-1] * 1e6,
+        },
+    }
+
+
+def peak_memory_kb(setup, run) -> float:
+    """Peak traced allocation of a short repeat of the benchmark."""
+    handle = setup()
+    tracemalloc.start()
+    run(handle)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak / 1024
+
+
+def bench_load_calibration(args: argparse.Namespace) -> list:
+    def run(_handle):
+        return run_unpaced(lambda frame: load_calibration(CALIBRATION_FILE), 200)
+
+    result = {"name": "load_calibration", **run(None)}
+    result["peak_memory_kb"] = peak_memory_kb(lambda: None, run)
+    return [result]
+
+
+def bench_update_status(args: argparse.Namespace) -> list:
+    results = []
+    for vescs in args.vescs:
+        for rate in args.rates:
+
+            def setup(vescs=vescs):
+                dyno = BenchDyno(vescs)
+                devices = dyno.motors + [dyno.torque_transducer]
+                return lambda frame: devices[frame % len(devices)].update_status()
+
+            def run(handle, rate=rate):
+                return run_paced(handle, rate, args.duration)
+
+            result = {"name": "update_status", "rate_hz": rate, "vescs": vescs, **run(setup())}
+            result["peak_memory_kb"] = peak_memory_kb(setup, lambda handle: run_paced(handle, rate, 0.2))
+            results.append(result)
+    return results
+
+
+def bench_record(args: argparse.Namespace) -> list:
+    results = []
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as folder:
+        dyno = BenchDyno(2)
+        for device in (dyno.MUT, dyno.load_motor, dyno.torque_transducer):
+            device.update_status()
+        os.chdir(folder)
+        try:
+            for rate in args.rates:
+
+                def setup():
+                    saver = FileSaver(dyno)
+                    saver.open()
+                    return saver
+
+                saver = setup()
+                result = {
+                    "name": "record",
+                    "rate_hz": rate,
+                    **run_paced(lambda frame: saver.write_row(), rate, args.duration),
+                }
+                saver.close()
+                result["peak_memory_kb"] = peak_memory_kb(
+                    setup, lambda saver: run_paced(lambda frame: saver.write_row(), rate, 0.2)
+                )
+                results.append(result)
+        finally:
+            os.chdir(cwd)
+    return results
+
+
+def bench_plot_extend(args: argparse.Namespace) -> list:
+    def setup():
+        channels = [Plot_Data() for _ in range(7)]
+        return lambda frame: [channel.extend(frame) for channel in channels]
+
+    def run(handle):
+        return run_unpaced(handle, 20000)
+
+    result = {"name": "plot_extend", "channels": 7, **run(setup())}
+    result["peak_memory_kb"] = peak_memory_kb(setup, run)
+    return [result]
+
+
+def bench_plot_update(args: argparse.Namespace) -> list:
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    from PyQt6.QtWidgets import QApplication
+    from VDyno.view.live_plots import PlotWindow
+
+    class BenchPresenter:
+        def __init__(self) -> None:
+            self.app = QApplication.instance() or QApplication(sys.argv)
+            self.dyno = BenchDyno(2)
+
+    presenter = BenchPresenter()
+    window = PlotWindow(presenter)
+    devices = [presenter.dyno.MUT, presenter.dyno.load_motor, presenter.dyno.torque_transducer]
+
+    def handle(frame):
+        devices[frame % 3].update_status()
+        window.update()
+        presenter.app.processEvents()
+
+    # The remote plot process starts with the window, let it settle before timing
+    for frame in range(50):
+        handle(frame)
+
+    results = []
+    for rate in args.plot_rates:
+        result = {"name": "plot_update", "rate_hz": rate, **run_paced(handle, rate, args.duration)}
+        tracemalloc.start()
+        run_paced(handle, rate, 0.2)
+        result["peak_memory_kb"] = tracemalloc.get_traced_memory()[1] / 1024
+        tracemalloc.stop()
+        results.append(result)
+    presenter.app.aboutToQuit.emit()
+    return results
+
+
+def metadata() -> dict:
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+    }
+
+
+def _key(result: dict) -> tuple:
+    return (result["name"], result.get("rate_hz"), result.get("vescs"))
+
+
+def compare(baseline: dict, current: dict) -> None:
+    """Print the change in throughput and p99 latency for every benchmark found in both runs."""
+    previous = {_key(result): result for result in baseline["results"]}
+    print(f"{'benchmark':<34}{'throughput':>14}{'p99 latency':>16}")
+    for result in current["results"]:
+        old = previous.get(_key(result))
+        if old is None:
+            continue
+        label = " ".join(str(part) for part in _key(result) if part is not None)
+        throughput = (result["throughput_hz"] / old["throughput_hz"] - 1) * 100
+        p99 = (result["latency_us"]["p99"] / max(old["latency_us"]["p99"], 1e-9) - 1) * 100
+        print(f"{label:<34}{throughput:>+13.1f}%{p99:>+15.1f}%")
+
+
+BENCHMARKS = {
+    "load_calibration": bench_load_calibration,
+    "update_status": bench_update_status,
+    "record": bench_record,
+    "plot_extend": bench_plot_extend,
+    "plot_update": bench_plot_update,
+}
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the VDyno acquisition, record and plot paths.")
+    parser.add_argument("--rates", type=float, nargs="+", default=[100, 1000, 10000], help="frame rates (Hz)")
+    parser.add_argument("--vescs", type=int, nargs="+", default=[1, 2, 4, 8], help="VESC counts for update_status")
+    parser.add_argument("--plot-rates", type=float, nargs="+", default=[30, 100], help="plot update rates (Hz)")
+    parser.add_argument("--duration", type=float, default=2.0, help="seconds per paced benchmark")
+    parser.add_argument("--only", nargs="+", choices=list(BENCHMARKS), help="run only these benchmarks")
+    parser.add_argument("--no-plot", action="store_true", help="skip the Qt plot benchmark")
+    parser.add_argument("--output", help="write the JSON results here instead of stdout")
+    parser.add_argument("--compare", help="earlier JSON result file to compare against")
+    args = parser.parse_args(argv)
+
+    names = args.only or [name for name in BENCHMARKS if not (args.no_plot and name == "plot_update")]
+    results = []
+    # e.g. FileSaver's "Closing file...", which would otherwise land in the middle of the JSON
+    with contextlib.redirect_stdout(sys.stderr):
+        for name in names:
+            print(f"Running {name}...")
+            results.extend(BENCHMARKS[name](args))
+    report = {"meta": metadata(), "results": results}
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    if args.compare:
+        with open(args.compare, "r") as file:
+            previous = json.load(file)
+        with contextlib.redirect_stdout(sys.stdout if args.output else sys.stderr):
+            compare(previous, report)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())